@@ -0,0 +1,109 @@
+"""
+Async variants of the app.crud functions, for routers running as async def
+
+Single-row lookups and plain listings are native async queries. Writes and the
+more involved reads run the sync implementation from app.crud on the async
+session with run_sync: with an async driver its I/O is still awaited on the
+event loop, and rollups, write generations and pagination rules stay in one place.
+"""
+
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import crud, models, schemas
+from app.hashing import hash_password_async
+
+# User CRUD
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(select(models.User).offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    # bcrypt is CPU-bound, it runs in the hashing pool (raises HashingBusy when full)
+    hashed_password = await hash_password_async(user.password)
+    return await db.run_sync(crud.create_user, user, hashed_password=hashed_password)
+
+async def update_user(db: AsyncSession, user_id: int, user_update: schemas.UserUpdate):
+    return await db.run_sync(crud.update_user, user_id, user_update)
+
+async def update_password_hash(db: AsyncSession, user_id: int, hashed_password: str):
+    return await db.run_sync(crud.update_password_hash, user_id, hashed_password)
+
+async def delete_user(db: AsyncSession, user_id: int):
+    return await db.run_sync(crud.delete_user, user_id)
+
+# Zone CRUD
+async def get_zone(db: AsyncSession, zone_id: int):
+    return await db.get(models.Zone, zone_id)
+
+async def get_zones(db: AsyncSession, skip: int = 0, limit: int = 100, count: str = "exact", bbox=None):
+    return await db.run_sync(crud.get_zones, skip=skip, limit=limit, count=count, bbox=bbox)
+
+async def get_nearest_zones(db: AsyncSession, latitude: float, longitude: float, k: int = 5):
+    return await db.run_sync(crud.get_nearest_zones, latitude, longitude, k)
+
+async def get_zones_latest(db: AsyncSession, type: Optional[str] = None, bbox=None):
+    return await db.run_sync(crud.get_zones_latest, type, bbox)
+
+async def create_zone(db: AsyncSession, zone: schemas.ZoneCreate):
+    return await db.run_sync(crud.create_zone, zone)
+
+async def update_zone(db: AsyncSession, zone_id: int, zone_update: schemas.ZoneUpdate):
+    return await db.run_sync(crud.update_zone, zone_id, zone_update)
+
+async def delete_zone(db: AsyncSession, zone_id: int):
+    return await db.run_sync(crud.delete_zone, zone_id)
+
+# Source CRUD
+async def get_source(db: AsyncSession, source_id: int):
+    return await db.get(models.Source, source_id)
+
+async def get_sources(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(select(models.Source).offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def create_source(db: AsyncSession, source: schemas.SourceCreate):
+    return await db.run_sync(crud.create_source, source)
+
+async def update_source(db: AsyncSession, source_id: int, source_update: schemas.SourceUpdate):
+    return await db.run_sync(crud.update_source, source_id, source_update)
+
+async def delete_source(db: AsyncSession, source_id: int):
+    return await db.run_sync(crud.delete_source, source_id)
+
+# Indicator CRUD
+async def get_indicator(db: AsyncSession, indicator_id: int):
+    return await db.get(models.Indicator, indicator_id)
+
+async def get_indicators(db: AsyncSession, **filters):
+    """Same arguments as crud.get_indicators"""
+    return await db.run_sync(crud.get_indicators, **filters)
+
+async def get_existing_ids(db: AsyncSession, model, ids) -> set:
+    return await db.run_sync(crud.get_existing_ids, model, ids)
+
+async def create_indicator(db: AsyncSession, indicator: schemas.IndicatorCreate):
+    return await db.run_sync(crud.create_indicator, indicator)
+
+async def create_indicators_bulk(db: AsyncSession, indicators: List[schemas.IndicatorCreate]) -> int:
+    return await db.run_sync(crud.create_indicators_bulk, indicators)
+
+async def upsert_indicators(db: AsyncSession, indicators: List[schemas.IndicatorCreate], update: bool = False) -> dict:
+    return await db.run_sync(crud.upsert_indicators, indicators, update)
+
+async def update_indicator(db: AsyncSession, indicator_id: int, indicator_update: schemas.IndicatorUpdate):
+    return await db.run_sync(crud.update_indicator, indicator_id, indicator_update)
+
+async def delete_indicator(db: AsyncSession, indicator_id: int):
+    return await db.run_sync(crud.delete_indicator, indicator_id)
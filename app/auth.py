@@ -1,11 +1,12 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import NamedTuple, Optional
 from jose import JWTError, jwt
-import bcrypt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import select
+from app.cache import user_cache
+from app.database import AsyncSessionLocal
+from app.hashing import get_password_hash, verify_password  # noqa: F401  (re-exported)
 from app.models import User
 from app.schemas import TokenData
 
@@ -15,51 +16,15 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
 
 
-# Password hashing using bcrypt directly to avoid passlib issues
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against a bcrypt hash"""
-    # Ensure password is <= 72 bytes
-    password_bytes = plain_password.encode('utf-8')
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-        plain_password = password_bytes.decode('utf-8', errors='replace')
-    
-    try:
-        # bcrypt.checkpw works with both passlib and direct bcrypt hashes
-        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
-    except Exception:
-        return False
-
-
-def get_password_hash(password: str) -> str:
-    """Hash a password using bcrypt, ensuring it's <= 72 bytes"""
-    # Bcrypt has a strict 72-byte limit
-    password_bytes = password.encode('utf-8')
-    
-    # If password is longer than 72 bytes, truncate it
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-        # Decode, handling potential Unicode boundary issues
-        try:
-            password = password_bytes.decode('utf-8')
-        except UnicodeDecodeError:
-            # If we hit a multi-byte boundary, remove bytes until we can decode
-            while len(password_bytes) > 0:
-                try:
-                    password = password_bytes.decode('utf-8')
-                    break
-                except UnicodeDecodeError:
-                    password_bytes = password_bytes[:-1]
-            else:
-                # Last resort: decode with error handling
-                password = password_bytes.decode('utf-8', errors='replace')
-    
-    # Hash using bcrypt directly
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+class AuthenticatedUser(NamedTuple):
+    """What the auth dependencies resolve a token to, cached per token subject"""
+    id: int
+    username: str
+    role: str
+    is_active: bool
 
 
 # JWT token creation
@@ -74,15 +39,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-# Get current user from token
-async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
-) -> User:
+async def _user_from_token(token: Optional[str]) -> AuthenticatedUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if not token:
+        raise credentials_exception
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -92,16 +56,36 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
+    user = user_cache.get(token_data.username)
+    if user is not None:
+        return user
+
+    # Awaited on the async session so resolving the user never blocks the event loop.
+    # The session is its own and closed right away: a yield dependency would stay
+    # checked out until a streaming response ends (exports, event streams)
+    epoch = user_cache.epoch
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(User.id, User.username, User.role, User.is_active)
+            .where(User.username == token_data.username)
+        )
+        row = result.first()
+    if row is None:
         raise credentials_exception
+    user = AuthenticatedUser(*row)
+    user_cache.set(token_data.username, user, epoch)
     return user
 
 
+# Get current user from token
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> AuthenticatedUser:
+    return await _user_from_token(token)
+
+
 # Check if user is active
 async def get_current_active_user(
-    current_user: User = Depends(get_current_user),
-) -> User:
+    current_user: AuthenticatedUser = Depends(get_current_user),
+) -> AuthenticatedUser:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
@@ -109,10 +93,22 @@ async def get_current_active_user(
 
 # Check if user is admin
 async def get_current_admin_user(
-    current_user: User = Depends(get_current_active_user),
-) -> User:
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+) -> AuthenticatedUser:
     if current_user.role != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions"
         )
     return current_user
+
+
+# Active user from the Authorization header or, for clients that cannot set
+# headers (EventSource), an access_token query parameter
+async def get_current_active_stream_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    access_token: Optional[str] = Query(None, description="Bearer token, when the Authorization header cannot be set"),
+) -> AuthenticatedUser:
+    current_user = await _user_from_token(token or access_token)
+    if not current_user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return current_user
@@ -0,0 +1,227 @@
+"""
+Write generations and in-process caches
+
+Each tracked table has a write generation stored in the database and bumped in
+the same transaction as every write to it. Cached values are stored together
+with the generation they were computed at, so any write from any process
+(API workers, ingestion scripts) makes them stale.
+
+The user cache is the exception: checking a generation would cost the query
+it saves, so entries expire after a TTL and crud invalidates them directly.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional, Sequence, Tuple
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session, Query
+from app import models
+
+COUNT_STRATEGIES = ("exact", "cached", "estimate", "none")
+
+
+def bump_generation(db: Session, table: str):
+    """Increment the write generation of a table (caller commits)"""
+    result = db.execute(
+        update(models.WriteGeneration)
+        .where(models.WriteGeneration.table_name == table)
+        .values(generation=models.WriteGeneration.generation + 1, updated_at=datetime.utcnow())
+    )
+    if result.rowcount == 0:
+        db.add(models.WriteGeneration(table_name=table, generation=1, updated_at=datetime.utcnow()))
+        db.flush()
+
+
+def get_generation(db: Session, table: str) -> int:
+    """Current write generation of a table (0 if it was never written through the API)"""
+    generation = db.execute(
+        select(models.WriteGeneration.generation).where(models.WriteGeneration.table_name == table)
+    ).scalar()
+    return generation or 0
+
+
+def get_generations(db: Session, tables: Sequence[str]) -> Dict[str, Tuple[int, Optional[datetime]]]:
+    """Write generation and last write time of each table, in one query"""
+    rows = db.execute(
+        select(models.WriteGeneration.table_name, models.WriteGeneration.generation,
+               models.WriteGeneration.updated_at)
+        .where(models.WriteGeneration.table_name.in_(tables))
+    ).all()
+    found = {row.table_name: (row.generation, row.updated_at) for row in rows}
+    return {table: found.get(table, (0, None)) for table in tables}
+
+
+class CountCache:
+    """Bounded LRU of row counts, each stored with the generation it was counted at"""
+    
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Tuple[int, int]]" = OrderedDict()
+        self._lock = Lock()
+    
+    def get(self, key: Hashable, generation: int) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key: Hashable, generation: int, total: int):
+        with self._lock:
+            self._entries[key] = (generation, total)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+count_cache = CountCache()
+
+
+class UserCache:
+    """
+    Bounded TTL/LRU of authenticated users, keyed by token subject.
+    
+    Writes through crud.update_user/delete_user invalidate their entries at
+    once; writes from other processes are picked up when the entry expires.
+    """
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._epoch = 0
+        self._lock = Lock()
+    
+    @property
+    def epoch(self) -> int:
+        """Invalidation counter, read before loading a user and passed back to set()"""
+        return self._epoch
+    
+    def get(self, subject: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[subject]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return entry[1]
+    
+    def set(self, subject: str, user: Any, epoch: int):
+        """Cache user unless an invalidation happened since epoch was read (it may be stale)"""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            self._entries[subject] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, *subjects: str):
+        with self._lock:
+            self._epoch += 1
+            for subject in subjects:
+                self._entries.pop(subject, None)
+    
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self.hits = self.misses = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# USER_CACHE_TTL=0 disables the cache
+user_cache = UserCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60"))
+)
+
+
+def _normalize_filters(filters: Dict[str, Any]) -> Tuple:
+    """Hashable, order-independent cache key for a filter set (unset filters are dropped)"""
+    normalized = []
+    for name, value in sorted(filters.items()):
+        if value is None:
+            continue
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        normalized.append((name, value))
+    return tuple(normalized)
+
+
+def _estimate_count(db: Session, query: Query, table: str, filtered: bool) -> Optional[int]:
+    """
+    Planner/metadata based row estimate, or None when the backend has no cheap one.
+    
+    PostgreSQL reports the planner's row estimate for the filtered query. SQLite
+    has no planner estimate, but for an unfiltered table the rowid range is read
+    from the primary key index in O(log n).
+    """
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy import text
+        compiled = query.statement.compile(dialect=db.bind.dialect, compile_kwargs={"literal_binds": True})
+        plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+        return int(plan[0]["Plan"]["Plan Rows"])
+    if dialect == "sqlite" and not filtered:
+        from sqlalchemy import text
+        low, high = db.execute(text(f"SELECT min(rowid), max(rowid) FROM {table}")).one()
+        return 0 if high is None else high - low + 1
+    return None
+
+
+def count_total(db: Session, query: Query, table: str, filters: Dict[str, Any], strategy: str = "exact"):
+    """
+    Count the rows matched by query using the given strategy.
+    
+    Returns (total, strategy_used). "cached" reuses a count computed at the
+    current write generation of the table; "estimate" falls back to "cached"
+    when the backend cannot estimate the filtered query; "none" skips counting.
+    """
+    if strategy not in COUNT_STRATEGIES:
+        raise ValueError(f"Invalid count strategy, expected one of: {', '.join(COUNT_STRATEGIES)}")
+    
+    if strategy == "none":
+        return None, "none"
+    
+    key = (table,) + _normalize_filters(filters)
+    
+    if strategy == "estimate":
+        estimate = _estimate_count(db, query, table, filtered=len(key) > 1)
+        if estimate is not None:
+            return estimate, "estimate"
+        strategy = "cached"
+    
+    if strategy == "cached":
+        generation = get_generation(db, table)
+        total = count_cache.get(key, generation)
+        if total is None:
+            total = query.count()
+            count_cache.set(key, generation, total)
+        return total, "cached"
+    
+    return query.count(), "exact"
@@ -0,0 +1,81 @@
+"""
+Conditional GET support
+
+Responses derived from a set of tables carry an ETag and Last-Modified built
+from the tables' write generations (see app.cache). The not_modified
+dependency answers a matching If-None-Match / If-Modified-Since with 304
+before the endpoint runs its query, so polling clients that already have the
+current data cost one primary key lookup.
+"""
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.cache import get_generations
+from app.database import get_async_db
+
+
+def _etag(generations) -> str:
+    # The write time is part of the tag so a recreated database does not reuse old tags
+    parts = [
+        f"{table}.{generation}.{int(updated_at.timestamp() * 1e6) if updated_at else 0}"
+        for table, (generation, updated_at) in sorted(generations.items())
+    ]
+    return f'W/"{"-".join(parts)}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as recommended for If-None-Match
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any(
+        (candidate[2:] if candidate.startswith("W/") else candidate) == opaque
+        for candidate in (part.strip() for part in header.split(","))
+    )
+
+
+def _not_modified_since(header: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since is None:
+        return False
+    # HTTP dates have a one second resolution
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return last_modified.replace(microsecond=0) <= since
+
+
+def not_modified(*tables: str):
+    """
+    Dependency factory for endpoints whose response only changes when one of
+    tables is written. Sets ETag/Last-Modified and raises 304 when the
+    client's copy is current.
+    """
+    async def dependency(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+        generations = await db.run_sync(get_generations, tables)
+        etag = _etag(generations)
+        written = [updated_at for _, updated_at in generations.values() if updated_at is not None]
+        last_modified: Optional[datetime] = max(written) if written else None
+
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if last_modified is not None:
+            # Generations are stamped with utcnow()
+            headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+
+        if_none_match = request.headers.get("if-none-match")
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_none_match is not None:
+            fresh = _etag_matches(if_none_match, etag)
+        else:
+            fresh = bool(if_modified_since and last_modified and _not_modified_since(if_modified_since, last_modified))
+        if fresh:
+            raise HTTPException(status_code=304, headers=headers)
+
+        response.headers.update(headers)
+
+    return dependency
@@ -1,9 +1,15 @@
+import base64
+import json
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, func
+from sqlalchemy import and_, func, select
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from app import models, schemas
-from app.auth import get_password_hash
+from app.cache import COUNT_STRATEGIES, bump_generation, count_total, user_cache
+from app.database import dialect_insert, naive_datetime
+from app import events, latest, rollups, spatial
+from app.hotwindow import hot_window
+from app.hashing import get_password_hash
 
 # User CRUD
 def get_user(db: Session, user_id: int):
@@ -18,8 +24,9 @@ def get_user_by_username(db: Session, username: str):
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: Optional[str] = None):
+    if hashed_password is None:
+        hashed_password = get_password_hash(user.password)
     db_user = models.User(
         email=user.email,
         username=user.username,
@@ -33,45 +40,93 @@ def create_user(db: Session, user: schemas.UserCreate):
 def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
     db_user = get_user(db, user_id)
     if db_user:
+        old_username = db_user.username
         update_data = user_update.model_dump(exclude_unset=True)
         for key, value in update_data.items():
             setattr(db_user, key, value)
         db.commit()
+        # Role and is_active changes must apply to the user's next request
+        user_cache.invalidate(old_username, db_user.username)
         db.refresh(db_user)
     return db_user
 
+def update_password_hash(db: Session, user_id: int, hashed_password: str):
+    db_user = get_user(db, user_id)
+    if db_user:
+        db_user.hashed_password = hashed_password
+        db.commit()
+    return db_user
+
 def delete_user(db: Session, user_id: int):
     db_user = get_user(db, user_id)
     if db_user:
         db.delete(db_user)
         db.commit()
+        user_cache.invalidate(db_user.username)
     return db_user
 
 # Zone CRUD
 def get_zone(db: Session, zone_id: int):
     return db.query(models.Zone).filter(models.Zone.id == zone_id).first()
 
-def get_zones(db: Session, skip: int = 0, limit: int = 100):
+def get_zones(db: Session, skip: int = 0, limit: int = 100, count: str = "exact",
+              bbox: Optional[Tuple[float, float, float, float]] = None):
+    """
+    List zones by id. With bbox (west, south, east, north) only the zones whose
+    position or extent intersects it, looked up in the spatial index.
+    """
     query = db.query(models.Zone)
     
-    # Get total count before pagination
-    total = query.count()
-    
-    # Apply pagination
-    items = query.offset(skip).limit(limit).all()
+    if bbox is not None:
+        ids = spatial.zone_index.get(db).in_bbox(*bbox)
+        if count not in COUNT_STRATEGIES:
+            raise ValueError(f"Invalid count strategy, expected one of: {', '.join(COUNT_STRATEGIES)}")
+        # The index already knows the exact total
+        total, total_strategy = (None, "none") if count == "none" else (len(ids), "exact")
+        page_ids = ids[skip:skip + limit + 1]
+        items = query.filter(models.Zone.id.in_(page_ids)).order_by(models.Zone.id).all() if page_ids else []
+    else:
+        # Get total count before pagination
+        total, total_strategy = count_total(db, query, "zones", {}, strategy=count)
+        
+        # Apply pagination, fetching one extra row to know whether another page exists
+        items = query.order_by(models.Zone.id).offset(skip).limit(limit + 1).all()
     
     return {
-        "items": items,
+        "items": items[:limit],
         "total": total,
+        "total_strategy": total_strategy,
         "skip": skip,
         "limit": limit,
-        "has_next": (skip + limit) < total,
+        "has_next": len(items) > limit,
         "has_prev": skip > 0
     }
 
+def get_nearest_zones(db: Session, latitude: float, longitude: float, k: int = 5) -> List[dict]:
+    """The k zones closest to a point, nearest first, with their distance in km"""
+    nearest = spatial.zone_index.get(db).nearest(latitude, longitude, k)
+    zones = {
+        zone.id: zone
+        for zone in db.query(models.Zone).filter(models.Zone.id.in_([zone_id for zone_id, _ in nearest]))
+    }
+    return [
+        {**schemas.ZoneResponse.model_validate(zones[zone_id]).model_dump(), "distance_km": distance}
+        for zone_id, distance in nearest
+        if zone_id in zones
+    ]
+
+def backfill_zone_coordinates(db: Session):
+    """Fill the parsed position columns of zones created before they existed"""
+    for zone in db.query(models.Zone).filter(models.Zone.geom.is_not(None)):
+        for field, value in models.coordinates_of(zone.geom).items():
+            setattr(zone, field, value)
+    bump_generation(db, "zones")
+    db.commit()
+
 def create_zone(db: Session, zone: schemas.ZoneCreate):
     db_zone = models.Zone(**zone.model_dump())
     db.add(db_zone)
+    bump_generation(db, "zones")
     db.commit()
     db.refresh(db_zone)
     return db_zone
@@ -82,6 +137,7 @@ def update_zone(db: Session, zone_id: int, zone_update: schemas.ZoneUpdate):
         update_data = zone_update.model_dump(exclude_unset=True)
         for key, value in update_data.items():
             setattr(db_zone, key, value)
+        bump_generation(db, "zones")
         db.commit()
         db.refresh(db_zone)
     return db_zone
@@ -90,9 +146,56 @@ def delete_zone(db: Session, zone_id: int):
     db_zone = get_zone(db, zone_id)
     if db_zone:
         db.delete(db_zone)
+        bump_generation(db, "zones")
         db.commit()
     return db_zone
 
+def get_zones_latest(db: Session, type: Optional[str] = None,
+                     bbox: Optional[Tuple[float, float, float, float]] = None) -> List[dict]:
+    """
+    Every zone (in bbox, if given) with the latest indicator of each of its
+    (type, parameter) series, read from the latest_indicators table, plus count
+    and average over all of the zone's indicators (of type, if given).
+    """
+    query = db.query(models.Zone)
+    zone_ids = None
+    if bbox is not None:
+        zone_ids = spatial.zone_index.get(db).in_bbox(*bbox)
+        if not zone_ids:
+            return []
+        query = query.filter(models.Zone.id.in_(zone_ids))
+    zones = query.order_by(models.Zone.id).all()
+    rows = latest.latest_values(db, types=[type] if type else None, zone_ids=zone_ids)
+    
+    by_zone = {}
+    for row in rows:
+        by_zone.setdefault(row.zone_id, []).append(row)
+    
+    result = []
+    for zone in zones:
+        series = by_zone.get(zone.id, [])
+        count = sum(row.value_count for row in series)
+        total = sum(row.value_sum for row in series)
+        result.append({
+            **schemas.ZoneResponse.model_validate(zone).model_dump(),
+            "count": count,
+            "average": total / count if count else None,
+            "latest": [
+                {
+                    "type": row.type,
+                    "parameter": row.parameter or None,
+                    "value": row.value,
+                    "unit": row.unit,
+                    "timestamp": row.timestamp,
+                    "source_id": row.source_id,
+                    "count": row.value_count,
+                    "average": row.value_sum / row.value_count,
+                }
+                for row in series
+            ]
+        })
+    return result
+
 # Source CRUD
 def get_source(db: Session, source_id: int):
     return db.query(models.Source).filter(models.Source.id == source_id).first()
@@ -128,6 +231,68 @@ def delete_source(db: Session, source_id: int):
 def get_indicator(db: Session, indicator_id: int):
     return db.query(models.Indicator).filter(models.Indicator.id == indicator_id).first()
 
+# Columns that can be used for sorting (and keyset cursors) on indicators
+INDICATOR_SORT_COLUMNS = ("timestamp", "value", "type", "created_at")
+
+
+def encode_cursor(sort_by: str, order: str, sort_value, last_id: int) -> str:
+    """Encode the last seen (sort value, id) pair as an opaque cursor token"""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    payload = json.dumps([sort_by, order, sort_value, last_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: str, order: str):
+    """Decode a cursor token, raising ValueError if it is malformed or does not match the sort"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort_by, cursor_order, sort_value, last_id = json.loads(
+            base64.urlsafe_b64decode(padded.encode("ascii"))
+        )
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    
+    if cursor_sort_by != sort_by or cursor_order != order:
+        raise ValueError("Cursor does not match sort_by/order")
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise ValueError("Invalid cursor")
+    
+    # The sort value is bound into the keyset condition, it must have the column's type
+    if sort_by in ("timestamp", "created_at"):
+        if not isinstance(sort_value, str):
+            raise ValueError("Invalid cursor")
+        try:
+            sort_value = datetime.fromisoformat(sort_value)
+        except ValueError:
+            raise ValueError("Invalid cursor")
+    elif sort_by == "value":
+        if not isinstance(sort_value, (int, float)) or isinstance(sort_value, bool):
+            raise ValueError("Invalid cursor")
+    elif not isinstance(sort_value, str):
+        raise ValueError("Invalid cursor")
+    return sort_value, last_id
+
+
+def indicator_filters(
+    type: Optional[str] = None,
+    zone_id: Optional[int] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None
+) -> list:
+    """WHERE clauses shared by the indicator listing and export endpoints"""
+    filters = []
+    if type:
+        filters.append(models.Indicator.type == type)
+    if zone_id:
+        filters.append(models.Indicator.zone_id == zone_id)
+    if from_date:
+        filters.append(models.Indicator.timestamp >= from_date)
+    if to_date:
+        filters.append(models.Indicator.timestamp <= to_date)
+    return filters
+
+
 def get_indicators(
     db: Session,
     skip: int = 0,
@@ -137,65 +302,324 @@ def get_indicators(
     from_date: Optional[datetime] = None,
     to_date: Optional[datetime] = None,
     sort_by: Optional[str] = "timestamp",
-    order: Optional[str] = "desc"
+    order: Optional[str] = "desc",
+    cursor: Optional[str] = None,
+    use_cursor: bool = False,
+    count: Optional[str] = None
 ):
-    from sqlalchemy import desc, asc
+    """
+    List indicators with filters, sorting and pagination.
     
-    query = db.query(models.Indicator)
+    Rows are always ordered by (sort_by, id) so pages are stable even when many
+    rows share the same sort value. With use_cursor (or a cursor token) the page
+    is selected with a keyset condition on (sort_by, id) instead of OFFSET, so
+    every page costs the same as the first one; next_cursor points at the next page.
     
-    if type:
-        query = query.filter(models.Indicator.type == type)
-    if zone_id:
-        query = query.filter(models.Indicator.zone_id == zone_id)
-    if from_date:
-        query = query.filter(models.Indicator.timestamp >= from_date)
-    if to_date:
-        query = query.filter(models.Indicator.timestamp <= to_date)
+    count selects how total is computed (exact, cached, estimate, none), see
+    app.cache.count_total; total_strategy reports the one actually used. It
+    defaults to exact, and to none with cursors so that no page counts the
+    whole filtered set.
+    """
+    from sqlalchemy import desc, asc, or_
     
-    # Sorting
-    if sort_by:
-        sort_column = getattr(models.Indicator, sort_by, None)
-        if sort_column:
-            if order == "desc":
-                query = query.order_by(desc(sort_column))
-            else:
-                query = query.order_by(asc(sort_column))
+    if count is None:
+        count = "none" if use_cursor or cursor else "exact"
+    
+    query = db.query(models.Indicator).filter(*indicator_filters(type, zone_id, from_date, to_date))
     
     # Get total count before pagination
-    total = query.count()
+    total, total_strategy = count_total(
+        db, query, "indicators",
+        {"type": type, "zone_id": zone_id, "from": from_date, "to": to_date},
+        strategy=count
+    )
     
-    # Apply pagination
-    items = query.offset(skip).limit(limit).all()
+    if sort_by not in INDICATOR_SORT_COLUMNS:
+        sort_by = "timestamp"
+    if order != "asc":
+        order = "desc"
+    sort_column = getattr(models.Indicator, sort_by)
+    direction = desc if order == "desc" else asc
+    
+    # Keyset condition: rows strictly after the last seen (sort value, id)
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor, sort_by, order)
+        if order == "desc":
+            query = query.filter(or_(
+                sort_column < sort_value,
+                and_(sort_column == sort_value, models.Indicator.id < last_id)
+            ))
+        else:
+            query = query.filter(or_(
+                sort_column > sort_value,
+                and_(sort_column == sort_value, models.Indicator.id > last_id)
+            ))
+    
+    # Sorting, with id as a tiebreak so the order is total
+    query = query.order_by(direction(sort_column), direction(models.Indicator.id))
+    
+    if cursor or use_cursor:
+        skip = 0
+    else:
+        query = query.offset(skip)
+    
+    # Apply pagination, fetching one extra row to know whether another page exists
+    items = query.limit(limit + 1).all()
+    has_next = len(items) > limit
+    items = items[:limit]
+    
+    next_cursor = None
+    if (cursor or use_cursor) and has_next:
+        last = items[-1]
+        next_cursor = encode_cursor(sort_by, order, getattr(last, sort_by), last.id)
     
     return {
         "items": items,
         "total": total,
+        "total_strategy": total_strategy,
         "skip": skip,
         "limit": limit,
-        "has_next": (skip + limit) < total,
-        "has_prev": skip > 0
+        "has_next": has_next,
+        "has_prev": skip > 0 or cursor is not None,
+        "next_cursor": next_cursor
     }
 
+def deduplicate_indicators(db: Session) -> int:
+    """
+    Delete readings stored more than once under the same natural key (the
+    first one is kept), then create the unique natural key index. Rollups and
+    latest values are rebuilt when rows were deleted. Returns the number of
+    deleted rows.
+    """
+    from sqlalchemy import delete, text
+    
+    table = models.Indicator.__table__
+    first = (
+        select(func.min(table.c.id))
+        .where(table.c.parameter.is_not(None))
+        .group_by(*[table.c[field] for field in models.NATURAL_KEY])
+    )
+    deleted = db.execute(
+        delete(table).where(table.c.parameter.is_not(None), table.c.id.not_in(first))
+    ).rowcount
+    for index in table.indexes:
+        if index.name == "uq_indicators_natural_key":
+            index.create(bind=db.connection(), checkfirst=True)
+    # Non-unique index on the same columns it replaces
+    db.execute(text("DROP INDEX IF EXISTS ix_indicators_natural_key"))
+    db.commit()
+    if deleted:
+        rollups.rebuild_rollups(db)
+        latest.rebuild_latest(db)
+    return deleted
+
+def backfill_indicator_parameters(db: Session):
+    """Fill the parameter column of indicators created before it existed"""
+    from sqlalchemy import update
+    
+    db.execute(
+        update(models.Indicator)
+        .where(models.Indicator.parameter.is_(None), models.Indicator.extra_data.is_not(None))
+        .values(parameter=models.Indicator.extra_data["parameter"].as_string())
+    )
+    db.commit()
+
+def get_existing_ids(db: Session, model, ids) -> set:
+    """Subset of ids that exist in the model's table, in one query"""
+    if not ids:
+        return set()
+    return set(db.execute(select(model.id).where(model.id.in_(set(ids)))).scalars())
+
+def iter_indicator_rows(
+    db: Session,
+    type: Optional[str] = None,
+    zone_id: Optional[int] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    batch_size: int = 1000
+):
+    """
+    Yield batches of filtered indicator rows in (timestamp, id) order.
+    
+    Plain column rows are fetched batch_size at a time with yield_per (a
+    server-side cursor on PostgreSQL), so memory does not grow with the number
+    of rows and no ORM objects are built.
+    """
+    indicator = models.Indicator
+    query = (
+        select(
+            indicator.id, indicator.type, indicator.value, indicator.unit, indicator.timestamp,
+            indicator.extra_data, indicator.zone_id, indicator.source_id, indicator.created_at,
+            indicator.parameter
+        )
+        .where(*indicator_filters(type, zone_id, from_date, to_date))
+        .order_by(indicator.timestamp, indicator.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for batch in db.execute(query).partitions():
+        yield batch
+
 def create_indicator(db: Session, indicator: schemas.IndicatorCreate):
     db_indicator = models.Indicator(**indicator.model_dump())
     db.add(db_indicator)
+    rollups.add_readings(db, [rollups.reading_of(db_indicator)])
+    latest.add_indicators(db, [latest.latest_of(db_indicator)])
+    bump_generation(db, "indicators")
+    version = hot_window.write_version(db)
     db.commit()
     db.refresh(db_indicator)
+    hot_window.apply(version, added=[db_indicator])
+    events.broker.publish([_indicator_event(db_indicator)])
     return db_indicator
 
+def _indicator_event(indicator) -> dict:
+    return schemas.IndicatorResponse.model_validate(indicator).model_dump(mode="json")
+
+def create_indicators_bulk(db: Session, indicators: List[schemas.IndicatorCreate]) -> int:
+    """Insert many indicators with one executemany in a single transaction, returns the row count"""
+    from sqlalchemy import insert
+    
+    if not indicators:
+        return 0
+    
+    rows = []
+    for indicator in indicators:
+        row = indicator.model_dump()
+        # Bulk inserts bypass the model's validators
+        row["parameter"] = models.parameter_of(row["extra_data"])
+        rows.append(row)
+    
+    stmt = insert(models.Indicator)
+    # Ids are only needed for the events and the hot window; RETURNING makes the insert about twice as slow
+    subscribed = events.broker.subscriber_count > 0
+    returning = subscribed or hot_window.enabled
+    if returning:
+        stmt = stmt.returning(models.Indicator.id, models.Indicator.created_at, sort_by_parameter_order=True)
+    result = db.execute(stmt, rows)
+    if returning:
+        for row, (indicator_id, created_at) in zip(rows, result.all()):
+            row["id"], row["created_at"] = indicator_id, created_at
+    rollups.add_readings(db, [rollups.reading_of(row) for row in rows])
+    latest.add_indicators(db, [latest.latest_of(row) for row in rows])
+    bump_generation(db, "indicators")
+    version = hot_window.write_version(db)
+    db.commit()
+    hot_window.apply(version, added=rows)
+    if subscribed:
+        events.broker.publish([_indicator_event(row) for row in rows])
+    return len(rows)
+
+def upsert_indicators(db: Session, indicators: List[schemas.IndicatorCreate], update: bool = False) -> dict:
+    """
+    Insert indicators in one transaction with INSERT ... ON CONFLICT on their
+    natural key (zone, source, type, timestamp, parameter).
+    
+    Readings already stored are skipped, or with update overwritten when their
+    value or unit changed. Indicators without parameter have no natural key
+    and are always inserted. Rollups, latest values, the hot window and events
+    follow like create_indicators_bulk.
+    Returns the number of rows inserted, updated and skipped (already stored).
+    """
+    from sqlalchemy import or_
+    
+    # Duplicates within the batch: the last one wins
+    rows = {}
+    for position, indicator in enumerate(indicators):
+        row = indicator.model_dump()
+        row["parameter"] = models.parameter_of(row["extra_data"])
+        key = natural_key(row) if row["parameter"] is not None else position
+        rows.pop(key, None)
+        rows[key] = row
+    rows = list(rows.values())
+    if not rows:
+        return {"inserted": 0, "updated": 0, "skipped": 0}
+    
+    table = models.Indicator.__table__
+    old = {}
+    if update:
+        # Values being replaced, to take them out of the rollups
+        timestamps = [rollups.reading_of(row).timestamp for row in rows]
+        existing = db.execute(
+            select(table.c.id, table.c.zone_id, table.c.source_id, table.c.type, table.c.timestamp,
+                   table.c.parameter, table.c.value, table.c.unit)
+            .where(
+                table.c.zone_id.in_({row["zone_id"] for row in rows}),
+                table.c.source_id.in_({row["source_id"] for row in rows}),
+                table.c.type.in_({row["type"] for row in rows}),
+                table.c.timestamp >= min(timestamps),
+                table.c.timestamp <= max(timestamps),
+                table.c.parameter.is_not(None),
+            )
+        )
+        keys = {natural_key(row) for row in rows if row["parameter"] is not None}
+        old = {row.id: row for row in existing if natural_key(row._mapping) in keys}
+    
+    stmt = dialect_insert(db.bind, table)
+    if update:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(models.NATURAL_KEY),
+            set_={"value": stmt.excluded.value, "unit": stmt.excluded.unit, "extra_data": stmt.excluded.extra_data},
+            where=or_(table.c.value != stmt.excluded.value, table.c.unit != stmt.excluded.unit)
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=list(models.NATURAL_KEY))
+    written = [dict(row._mapping) for row in db.execute(stmt.returning(*table.c), rows)]
+    inserted = [row for row in written if row["id"] not in old]
+    updated = [row for row in written if row["id"] in old]
+    
+    if written:
+        if updated:
+            rollups.remove_readings(db, [rollups.reading_of(old[row["id"]]._mapping) for row in updated])
+            latest.remove_indicators(db, [latest.latest_of(old[row["id"]]._mapping) for row in updated])
+        rollups.add_readings(db, [rollups.reading_of(row) for row in written])
+        latest.add_indicators(db, [latest.latest_of(row) for row in written])
+        bump_generation(db, "indicators")
+    version = hot_window.write_version(db) if written else None
+    db.commit()
+    hot_window.apply(version, removed=[row["id"] for row in updated], added=written)
+    if inserted and events.broker.subscriber_count > 0:
+        events.broker.publish([_indicator_event(row) for row in inserted])
+    return {"inserted": len(inserted), "updated": len(updated), "skipped": len(rows) - len(written)}
+
+def natural_key(indicator) -> Tuple:
+    """(zone_id, source_id, type, timestamp, parameter) of an indicator, row or dict of its columns"""
+    get = indicator.get if hasattr(indicator, "get") else lambda field: getattr(indicator, field)
+    return get("zone_id"), get("source_id"), get("type"), naive_datetime(get("timestamp")), get("parameter")
+
 def update_indicator(db: Session, indicator_id: int, indicator_update: schemas.IndicatorUpdate):
     db_indicator = get_indicator(db, indicator_id)
     if db_indicator:
+        old_reading = rollups.reading_of(db_indicator)
+        old_latest = latest.latest_of(db_indicator)
         update_data = indicator_update.model_dump(exclude_unset=True)
         for key, value in update_data.items():
             setattr(db_indicator, key, value)
+        new_reading = rollups.reading_of(db_indicator)
+        new_latest = latest.latest_of(db_indicator)
+        if new_reading != old_reading:
+            db.flush()
+            rollups.remove_readings(db, [old_reading])
+            rollups.add_readings(db, [new_reading])
+        if new_latest != old_latest:
+            db.flush()
+            latest.remove_indicators(db, [old_latest])
+            latest.add_indicators(db, [new_latest])
+        bump_generation(db, "indicators")
+        version = hot_window.write_version(db)
         db.commit()
         db.refresh(db_indicator)
+        hot_window.apply(version, removed=[indicator_id], added=[db_indicator])
     return db_indicator
 
 def delete_indicator(db: Session, indicator_id: int):
     db_indicator = get_indicator(db, indicator_id)
     if db_indicator:
         db.delete(db_indicator)
+        db.flush()
+        rollups.remove_readings(db, [rollups.reading_of(db_indicator)])
+        latest.remove_indicators(db, [latest.latest_of(db_indicator)])
+        bump_generation(db, "indicators")
+        version = hot_window.write_version(db)
         db.commit()
+        hot_window.apply(version, removed=[indicator_id])
     return db_indicator
@@ -1,16 +1,48 @@
-from sqlalchemy import create_engine
+import os
+from datetime import datetime
+from sqlalchemy import BigInteger, create_engine, inspect, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.functions import FunctionElement
 
 # SQLite database for development (can be changed to PostgreSQL for production)
-SQLALCHEMY_DATABASE_URL = "sqlite:///./ecotrack.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ecotrack.db")
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # Needed for SQLite
+    connect_args={"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}  # Needed for SQLite
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _async_url(url: str) -> str:
+    """Async driver URL for a sync database URL (aiosqlite for SQLite, asyncpg for PostgreSQL)"""
+    scheme, rest = url.split("://", 1)
+    backend = scheme.split("+", 1)[0]
+    if backend == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    if backend in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+
+# Async engine used by the API routers, on the same database as the sync engine
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(SQLALCHEMY_DATABASE_URL))
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    # aiosqlite defaults to NullPool on SQLAlchemy 2.0 (a new connection and thread
+    # per session), file databases are pooled like on the sync engine
+    **({"poolclass": AsyncAdaptedQueuePool}
+       if ASYNC_DATABASE_URL.startswith("sqlite") and ":memory:" not in ASYNC_DATABASE_URL else {})
+)
+
+# Objects stay loaded after commit: they are serialized after the session is gone
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 class Base(DeclarativeBase):
     pass
 
@@ -21,3 +53,76 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency to get an async DB session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def dialect_insert(bind, table):
+    """INSERT construct of the bind's dialect, which supports ON CONFLICT on SQLite and PostgreSQL"""
+    if bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def naive_datetime(timestamp: datetime) -> datetime:
+    """A timestamp as stored by the timezone-naive DateTime columns: aware values keep their wall clock time"""
+    return timestamp.replace(tzinfo=None) if timestamp.tzinfo else timestamp
+
+
+class epoch_seconds(FunctionElement):
+    """Whole seconds since 1970-01-01 of a (naive, UTC) DateTime expression, on SQLite and PostgreSQL"""
+    type = BigInteger()
+    inherit_cache = True
+
+
+@compiles(epoch_seconds)
+def _epoch_seconds(element, compiler, **kw):
+    return f"CAST(FLOOR(EXTRACT(EPOCH FROM {compiler.process(element.clauses, **kw)})) AS BIGINT)"
+
+
+@compiles(epoch_seconds, "sqlite")
+def _epoch_seconds_sqlite(element, compiler, **kw):
+    return f"CAST(strftime('%s', {compiler.process(element.clauses, **kw)}) AS INTEGER)"
+
+
+def upgrade_schema(bind=engine):
+    """
+    Bring an existing database up to date with the models.
+    
+    create_all() only creates missing tables, so nullable columns and indexes
+    added to existing tables are created here. Returns what was added, as
+    "table" for new tables and "table.column" for new columns, so callers can
+    backfill them. Unique indexes missing from existing tables are not created,
+    as existing rows may violate them: their names are returned instead, for
+    the caller to deduplicate the rows and create them.
+    """
+    existing_tables = set(inspect(bind).get_table_names())
+    Base.metadata.create_all(bind=bind)
+    
+    added = {table.name for table in Base.metadata.sorted_tables if table.name not in existing_tables}
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                    added.add(f"{table.name}.{column.name}")
+    
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique and table.name not in added:
+                added.add(index.name)
+                continue
+            index.create(bind=bind, checkfirst=True)
+    
+    return added
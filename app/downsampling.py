@@ -0,0 +1,113 @@
+"""
+Downsampling of chart series
+
+Charts draw a few hundred points at most, so long series are reduced on the
+server to max_points with one of:
+- lttb: Largest-Triangle-Three-Buckets, keeps the points that preserve the
+  visual shape of the line;
+- minmax: the minimum and maximum of each bucket, keeps every peak and dip.
+
+Both work on NumPy arrays of the fetched column. Selection always returns
+indices of original points, values are never interpolated.
+"""
+
+from typing import List, Optional, Sequence
+import numpy as np
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """
+    Indices of n points of (x, y) chosen with Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept, the others are split into n - 2
+    buckets. Bucket averages are computed in one vectorized pass; each bucket
+    then keeps the point forming the largest triangle with the point kept in
+    the previous bucket and the average of the next one, which is a NumPy
+    operation over the bucket (the loop runs over output points only).
+    """
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        return np.array([0, size - 1][:max(n, 0)], dtype=np.intp)
+
+    # n - 2 buckets over the points between the first and the last one
+    edges = np.linspace(1, size - 1, n - 1).astype(np.intp)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:size - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:size - 1], edges[:-1]) / counts
+    # The third vertex is the next bucket's average, the last point for the last bucket
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(n, dtype=np.intp)
+    selected[0], selected[-1] = 0, size - 1
+    previous = 0
+    for bucket in range(n - 2):
+        low, high = edges[bucket], edges[bucket + 1]
+        px, py = x[previous], y[previous]
+        areas = np.abs((px - next_x[bucket]) * (y[low:high] - py) - (px - x[low:high]) * (next_y[bucket] - py))
+        previous = low + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """Indices of the minimum and maximum of n // 2 equal-count buckets, in order (at most n points)"""
+    size = len(y)
+    if n >= size:
+        return np.arange(size)
+    buckets = max(1, n // 2)
+    segment = np.arange(size) * buckets // size
+    # Sorted by bucket then value: each bucket's first entry is its minimum, its last one its maximum
+    order = np.lexsort((y, segment))
+    starts = np.searchsorted(segment[order], np.arange(buckets))
+    ends = np.append(starts[1:], size) - 1
+    return np.unique(np.concatenate([order[starts], order[ends]]))
+
+
+def select_points(
+    x: Sequence[float],
+    columns: Sequence[Sequence[Optional[float]]],
+    max_points: int,
+    method: str = "lttb",
+) -> Optional[np.ndarray]:
+    """
+    Indices of the shared x axis to keep so several series sharing it fit in
+    max_points points, or None when they already do.
+
+    Each series gets an equal share of max_points and is downsampled on its
+    non-null values; the kept indices are the union of every series' choice,
+    so all series stay aligned on the same labels. With more than
+    max_points / 2 series a share would be under 2 points, so their mean is
+    downsampled instead. Either way at most max_points indices are kept.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Invalid downsampling method, expected one of: {', '.join(METHODS)}")
+    if max_points < 2:
+        raise ValueError("max_points must be at least 2")
+    if len(x) <= max_points:
+        return None
+
+    reduce = lttb if method == "lttb" else minmax
+    xs = np.asarray(x, dtype=np.float64)
+    matrix = np.array([[np.nan if value is None else value for value in column] for column in columns],
+                      dtype=np.float64).reshape(len(columns), len(xs))
+    share = max_points // max(1, len(columns))
+    if share < 2:
+        present = np.flatnonzero(~np.isnan(matrix).all(axis=0))
+        if not len(present):
+            return np.arange(0)
+        mean = np.nanmean(matrix[:, present], axis=0)
+        return present[reduce(xs[present], mean, max_points)]
+
+    kept: List[np.ndarray] = []
+    for values in matrix:
+        present = np.flatnonzero(~np.isnan(values))
+        if len(present):
+            kept.append(present[reduce(xs[present], values[present], share)])
+    if not kept:
+        return np.arange(0)
+    return np.unique(np.concatenate(kept))
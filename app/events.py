@@ -0,0 +1,122 @@
+"""
+In-process publish/subscribe of new indicators
+
+crud publishes every indicator it creates, after the commit; the
+/indicators/stream endpoint subscribes with optional type/zone filters and
+pushes matching indicators and the resulting summary deltas to the client as
+Server-Sent Events. Only writes made by this process are seen: indicators
+ingested by scripts in another process are picked up by polling.
+
+publish() is thread-safe and never blocks the writer. A subscriber that
+falls more than its queue size behind gets a single "resync" event instead
+of the events it missed, and should reload its data.
+"""
+
+import asyncio
+import json
+from collections import defaultdict
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set
+
+SUBSCRIBER_QUEUE_SIZE = 256
+
+RESYNC = "resync"
+
+
+def summary_delta(indicators: Iterable[dict]) -> List[dict]:
+    """Per-type count/sum/min/max of indicators, to merge into a /stats/summary result"""
+    groups: Dict[str, dict] = defaultdict(lambda: {"count": 0, "sum": 0.0, "min": None, "max": None})
+    for indicator in indicators:
+        group = groups[indicator["type"]]
+        value = indicator["value"]
+        group["count"] += 1
+        group["sum"] += value
+        group["min"] = value if group["min"] is None else min(group["min"], value)
+        group["max"] = value if group["max"] is None else max(group["max"], value)
+    return [dict(type=type_, **group) for type_, group in sorted(groups.items())]
+
+
+def sse_message(event: str, data) -> str:
+    """One Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class Subscription:
+    """Queue of the event batches matching one client's filters"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, types: Optional[Iterable[str]] = None,
+                 zone_ids: Optional[Iterable[int]] = None, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.loop = loop
+        self.types: Optional[Set[str]] = set(types) if types else None
+        self.zone_ids: Optional[Set[int]] = set(zone_ids) if zone_ids else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.lagged = False
+
+    def matches(self, indicator: dict) -> bool:
+        return ((self.types is None or indicator["type"] in self.types)
+                and (self.zone_ids is None or indicator["zone_id"] in self.zone_ids))
+
+    def _deliver(self, indicators: List[dict]):
+        # Runs on the subscriber's event loop
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(indicators)
+        except asyncio.QueueFull:
+            # Drop the backlog, the client reloads instead
+            self.lagged = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self, timeout: Optional[float] = None):
+        """Next batch of indicators, RESYNC, or None after timeout"""
+        try:
+            item = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if item == RESYNC:
+            self.lagged = False
+        return item
+
+
+class Broker:
+    """Fans published indicators out to the subscriptions they match"""
+
+    def __init__(self):
+        self._subscriptions: Set[Subscription] = set()
+        self._lock = Lock()
+
+    def subscribe(self, types: Optional[Iterable[str]] = None,
+                  zone_ids: Optional[Iterable[int]] = None) -> Subscription:
+        """Subscribe from a coroutine, events are delivered on its event loop"""
+        subscription = Subscription(asyncio.get_running_loop(), types, zone_ids)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def publish(self, indicators: List[dict]):
+        """Send committed indicators (IndicatorResponse dicts) to matching subscribers"""
+        if not indicators or not self._subscriptions:
+            return
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            matching = [indicator for indicator in indicators if subscription.matches(indicator)]
+            if matching:
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription._deliver, matching)
+                except RuntimeError:
+                    # Its event loop is closed
+                    self.unsubscribe(subscription)
+
+
+broker = Broker()
@@ -0,0 +1,166 @@
+"""
+Indicator export formats
+
+Each writer takes batches of indicator rows (see crud.iter_indicator_rows) and
+yields encoded chunks, one per batch, so exports can be streamed without
+holding the result set in memory.
+
+The Arrow IPC and Parquet writers need the optional pyarrow package.
+"""
+
+import csv
+import importlib.util
+import io
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, Optional, Sequence
+
+EXPORT_COLUMNS = (
+    "id", "type", "value", "unit", "timestamp", "extra_data", "zone_id", "source_id", "created_at"
+)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def ndjson_chunks(batches: Iterable[Sequence]) -> Iterator[bytes]:
+    """One JSON object per line"""
+    for batch in batches:
+        lines = [
+            json.dumps({column: getattr(row, column) for column in EXPORT_COLUMNS},
+                       default=_json_default, ensure_ascii=False)
+            for row in batch
+        ]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def csv_chunks(batches: Iterable[Sequence]) -> Iterator[bytes]:
+    """CSV with a header row; extra_data is written as a JSON string"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        for row in batch:
+            writer.writerow([
+                row.id, row.type, row.value, row.unit, row.timestamp.isoformat(),
+                json.dumps(row.extra_data, ensure_ascii=False) if row.extra_data is not None else "",
+                row.zone_id, row.source_id,
+                row.created_at.isoformat() if row.created_at else "",
+            ])
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file object that hands back whatever pyarrow wrote since the last drain"""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_schema(pa):
+    # Low-cardinality strings are dictionary-encoded, in particular extra_data's parameter
+    strings = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("id", pa.int64()),
+        ("type", strings),
+        ("parameter", strings),
+        ("value", pa.float64()),
+        ("unit", strings),
+        ("timestamp", pa.timestamp("us")),
+        ("zone_id", pa.int64()),
+        ("source_id", pa.int64()),
+        ("extra_data", pa.string()),
+        ("created_at", pa.timestamp("us")),
+    ])
+
+
+def _record_batch(pa, schema, batch: Sequence):
+    columns = {
+        "id": [row.id for row in batch],
+        "type": [row.type for row in batch],
+        "parameter": [row.parameter for row in batch],
+        "value": [row.value for row in batch],
+        "unit": [row.unit for row in batch],
+        "timestamp": [row.timestamp for row in batch],
+        "zone_id": [row.zone_id for row in batch],
+        "source_id": [row.source_id for row in batch],
+        "extra_data": [json.dumps(row.extra_data, ensure_ascii=False) if row.extra_data is not None else None
+                       for row in batch],
+        "created_at": [row.created_at for row in batch],
+    }
+    return pa.record_batch(
+        [pa.array(columns[field.name], type=field.type) for field in schema],
+        schema=schema
+    )
+
+
+def _arrow_chunks(batches: Iterable[Sequence], parquet: bool) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    schema = _arrow_schema(pa)
+    sink = _ChunkSink()
+    if parquet:
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    try:
+        for batch in batches:
+            # Each batch becomes one Parquet row group / one IPC record batch
+            writer.write_batch(_record_batch(pa, schema, batch))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def arrow_chunks(batches: Iterable[Sequence]) -> Iterator[bytes]:
+    """Arrow IPC stream, one record batch per row batch"""
+    return _arrow_chunks(batches, parquet=False)
+
+
+def parquet_chunks(batches: Iterable[Sequence]) -> Iterator[bytes]:
+    """Parquet file, one row group per row batch"""
+    return _arrow_chunks(batches, parquet=True)
+
+
+# format name -> (writer, media type, file extension, rows per batch, required module)
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_chunks, "application/x-ndjson", "ndjson", 1000, None),
+    "csv": (csv_chunks, "text/csv", "csv", 1000, None),
+    "arrow": (arrow_chunks, "application/vnd.apache.arrow.stream", "arrows", 65536, "pyarrow"),
+    "parquet": (parquet_chunks, "application/vnd.apache.parquet", "parquet", 65536, "pyarrow"),
+}
+
+
+def missing_dependency(format: str) -> Optional[str]:
+    """Name of the package a format needs but is not installed, if any"""
+    module = EXPORT_FORMATS[format][4]
+    if module and importlib.util.find_spec(module) is None:
+        return module
+    return None
@@ -0,0 +1,132 @@
+"""
+Password hashing
+
+bcrypt is CPU-bound by design. The API runs it in a dedicated, size-bounded
+process pool (hash_password_async / verify_password_async), so a burst of
+logins neither holds the GIL nor fills the threadpool the data endpoints
+share; once HASH_QUEUE_SIZE hashes are pending, further ones fail fast with
+HashingBusy. Scripts keep using the synchronous functions.
+
+The work factor is BCRYPT_ROUNDS; hashes made with another cost are reported
+by needs_rehash so they can be upgraded on the next successful login.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Optional
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hashes running or waiting in the pool before new ones are refused
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", str(HASH_WORKERS * 16)))
+
+
+class HashingBusy(Exception):
+    """The hashing pool has HASH_QUEUE_SIZE hashes pending"""
+
+
+# Password hashing using bcrypt directly to avoid passlib issues
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against a bcrypt hash"""
+    # Ensure password is <= 72 bytes
+    password_bytes = plain_password.encode('utf-8')
+    if len(password_bytes) > 72:
+        password_bytes = password_bytes[:72]
+        plain_password = password_bytes.decode('utf-8', errors='replace')
+
+    try:
+        # bcrypt.checkpw works with both passlib and direct bcrypt hashes
+        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    except Exception:
+        return False
+
+
+def get_password_hash(password: str, rounds: Optional[int] = None) -> str:
+    """Hash a password using bcrypt, ensuring it's <= 72 bytes"""
+    # Bcrypt has a strict 72-byte limit
+    password_bytes = password.encode('utf-8')
+
+    # If password is longer than 72 bytes, truncate it
+    if len(password_bytes) > 72:
+        password_bytes = password_bytes[:72]
+        # Decode, handling potential Unicode boundary issues
+        try:
+            password = password_bytes.decode('utf-8')
+        except UnicodeDecodeError:
+            # If we hit a multi-byte boundary, remove bytes until we can decode
+            while len(password_bytes) > 0:
+                try:
+                    password = password_bytes.decode('utf-8')
+                    break
+                except UnicodeDecodeError:
+                    password_bytes = password_bytes[:-1]
+            else:
+                # Last resort: decode with error handling
+                password = password_bytes.decode('utf-8', errors='replace')
+
+    # Hash using bcrypt directly
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
+    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
+    return hashed.decode('utf-8')
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Whether a bcrypt hash was made with another cost than BCRYPT_ROUNDS"""
+    try:
+        # $2b$<cost>$<salt and hash>
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_pending = 0
+_lock = Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn: forking a process that runs threads (event loop, DB drivers) is unsafe
+            _executor = ProcessPoolExecutor(
+                max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+async def _run(fn, *args):
+    global _pending
+    with _lock:
+        if _pending >= HASH_QUEUE_SIZE:
+            raise HashingBusy()
+        _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password in the hashing pool, raises HashingBusy when it is full"""
+    return await _run(verify_password, plain_password, hashed_password)
+
+
+async def hash_password_async(password: str) -> str:
+    """get_password_hash in the hashing pool, raises HashingBusy when it is full"""
+    return await _run(get_password_hash, password, BCRYPT_ROUNDS)
+
+
+def shutdown_pool():
+    """Stop the hashing workers (on application shutdown)"""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
@@ -0,0 +1,392 @@
+"""
+In-memory window of recent indicators
+
+With HOT_WINDOW_DAYS set, each API process keeps the indicators of the last
+days in NumPy columns (id, timestamp in epoch microseconds, value, and zone,
+type and parameter codes), one segment per UTC day. The /stats routes answer
+ranges that start inside the window with vectorized aggregates over these
+columns instead of SQL; other ranges still go to the rollups.
+
+The crud write paths apply every indicator write to the window after it is
+committed, tagged with the write generation it produced. A write from another
+process (ingestion scripts) leaves a gap in the generations, and the window
+is reloaded from the database by the next query, like the zone index (see
+app.spatial). Segments older than the window, or over HOT_WINDOW_MAX_MB
+(oldest first), are evicted and the window then starts after them.
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app import models, rollups
+from app.cache import get_generations
+from app.database import naive_datetime
+
+EPOCH = datetime(1970, 1, 1)
+# Weeks start on Mondays, like timeseries buckets
+_WEEK_ORIGIN_US = 4 * 86400 * 10**6
+_DAY_US = 86400 * 10**6
+_MICROSECOND = timedelta(microseconds=1)
+
+COLUMNS = (("id", np.int64), ("timestamp", np.int64), ("value", np.float64),
+           ("zone_id", np.int32), ("type", np.int32), ("parameter", np.int32))
+ROW_BYTES = sum(np.dtype(dtype).itemsize for _, dtype in COLUMNS)
+
+Version = Tuple[int, Optional[datetime]]
+
+
+def _micros(timestamp: datetime) -> int:
+    return (naive_datetime(timestamp) - EPOCH) // _MICROSECOND
+
+
+def _datetime(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=int(micros))
+
+
+def _day(micros: int) -> int:
+    return micros - micros % _DAY_US
+
+
+class Values:
+    """Sorted values of a group, with exact quantiles"""
+
+    def __init__(self, values: np.ndarray):
+        self.values = values
+        self.count = len(values)
+
+    def quantile(self, q: float, low: Optional[float] = None, high: Optional[float] = None) -> Optional[float]:
+        # Same rank as Sketch.quantile, low and high are already the exact bounds
+        if not self.count:
+            return None
+        return float(self.values[int(q * (self.count - 1))])
+
+
+class Segment:
+    """Columns of one day; appended rows are buffered and concatenated on read"""
+
+    def __init__(self, arrays: Optional[Dict[str, np.ndarray]] = None):
+        self.arrays = arrays or {name: np.empty(0, dtype) for name, dtype in COLUMNS}
+        self.pending: List[Tuple] = []
+
+    def __len__(self) -> int:
+        return len(self.arrays["id"]) + len(self.pending)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        if self.pending:
+            rows = list(zip(*self.pending))
+            self.arrays = {
+                name: np.concatenate([self.arrays[name], np.asarray(values, dtype)])
+                for (name, dtype), values in zip(COLUMNS, rows)
+            }
+            self.pending = []
+        return self.arrays
+
+    def remove(self, ids: np.ndarray) -> int:
+        arrays = self.columns()
+        keep = ~np.isin(arrays["id"], ids)
+        removed = len(keep) - int(keep.sum())
+        if removed:
+            self.arrays = {name: array[keep] for name, array in arrays.items()}
+        return removed
+
+
+class Codes:
+    """Integer codes of type and parameter strings"""
+
+    def __init__(self):
+        self.names: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def code(self, name: str) -> int:
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def lookup(self, names: Sequence[str]) -> List[int]:
+        return [self._codes[name] for name in names if name in self._codes]
+
+
+def _floor(micros: np.ndarray, bucket) -> np.ndarray:
+    """
+    Bucket starts of epoch microseconds: bucket is "hour" or "day", or a
+    timeseries.Bucket (fixed width aligned like its floor(), or months).
+    """
+    if isinstance(bucket, str):
+        width = rollups.GRANULARITIES[bucket] // _MICROSECOND
+        return micros - micros % width
+    if bucket.months:
+        months = micros.astype("datetime64[us]").astype("datetime64[M]").astype(np.int64)
+        months -= months % bucket.months
+        return months.astype("datetime64[M]").astype("datetime64[us]").astype(np.int64)
+    width = bucket.width // _MICROSECOND
+    origin = _WEEK_ORIGIN_US if bucket.width % timedelta(weeks=1) == timedelta(0) else 0
+    return micros - (micros - origin) % width
+
+
+class Window:
+    """A snapshot of the columns of the window, from start on"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], codes: Codes, start: datetime):
+        self.columns = columns
+        self.codes = codes
+        self.start = start
+
+    def __len__(self) -> int:
+        return len(self.columns["id"])
+
+    def aggregate(
+        self,
+        group_by: Sequence[str] = (),
+        bucket=None,
+        types: Optional[Sequence[str]] = None,
+        zone_ids: Optional[Sequence[int]] = None,
+        parameters: Optional[Sequence[str]] = None,
+        from_date: Optional[datetime] = None,
+        to_date: Optional[datetime] = None,
+        with_quantiles: bool = False,
+    ) -> Tuple[Dict[Tuple, rollups.Agg], Optional[Dict[Tuple, Values]]]:
+        """
+        Aggregates keyed like rollups.aggregate (bucket start appended with a
+        bucket), and the sorted values of each key with with_quantiles.
+        """
+        for field in group_by:
+            if field not in rollups.GROUP_FIELDS:
+                raise ValueError(f"Cannot group by {field}")
+        columns = self.columns
+        mask = np.ones(len(self), dtype=bool)
+        if types:
+            mask &= np.isin(columns["type"], self.codes.lookup(types))
+        if zone_ids:
+            mask &= np.isin(columns["zone_id"], list(zone_ids))
+        if parameters:
+            mask &= np.isin(columns["parameter"], self.codes.lookup(parameters))
+        if from_date is not None:
+            mask &= columns["timestamp"] >= _micros(from_date)
+        if to_date is not None:
+            mask &= columns["timestamp"] <= _micros(to_date)
+
+        values = columns["value"][mask]
+        fields = [columns[field][mask].astype(np.int64) for field in group_by]
+        if bucket is not None:
+            fields.append(_floor(columns["timestamp"][mask], bucket))
+        if not len(values):
+            return {}, ({} if with_quantiles else None)
+
+        if fields:
+            keys, inverse = np.unique(np.stack(fields, axis=1), axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        else:
+            keys, inverse = np.empty((1, 0), dtype=np.int64), np.zeros(len(values), dtype=np.intp)
+
+        # Sorted by group, then value: each group's first value is its minimum, its last one its maximum
+        order = np.lexsort((values, inverse))
+        ordered = values[order]
+        counts = np.bincount(inverse, minlength=len(keys))
+        sums = np.bincount(inverse, weights=values, minlength=len(keys))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        decoders = []
+        for field in group_by:
+            decoders.append(int if field == "zone_id" else self.codes.names.__getitem__)
+        if bucket is not None:
+            decoders.append(_datetime)
+
+        results: Dict[Tuple, rollups.Agg] = {}
+        quantiles: Optional[Dict[Tuple, Values]] = {} if with_quantiles else None
+        for index, row in enumerate(keys.tolist()):
+            key = tuple(decode(part) for decode, part in zip(decoders, row))
+            start, count = starts[index], counts[index]
+            results[key] = rollups.Agg(int(count), float(sums[index]),
+                                       float(ordered[start]), float(ordered[start + count - 1]))
+            if with_quantiles:
+                quantiles[key] = Values(ordered[start:start + count])
+        return results, quantiles
+
+
+class HotWindow:
+    """The current process's window of recent indicators, disabled when days is 0"""
+
+    def __init__(self, days: float = 0, max_bytes: int = 64 * 2**20):
+        self.days = days
+        self.max_bytes = max_bytes
+        self.loads = 0
+        self._segments: Dict[int, Segment] = {}
+        self._codes = Codes()
+        self._start: Optional[int] = None
+        self._version: Optional[Version] = None
+        self._lock = Lock()
+        self._load_lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.days > 0
+
+    def _horizon(self) -> int:
+        return _day(_micros(datetime.utcnow() - timedelta(days=self.days)))
+
+    def _evict(self):
+        """Drop segments older than the window, then the oldest ones over the memory budget"""
+        horizon = self._horizon()
+        self._start = max(self._start if self._start is not None else horizon, horizon)
+        for day in [day for day in self._segments if day < self._start]:
+            del self._segments[day]
+        total = sum(len(segment) for segment in self._segments.values()) * ROW_BYTES
+        for day in sorted(self._segments):
+            if total <= self.max_bytes:
+                break
+            total -= len(self._segments.pop(day)) * ROW_BYTES
+            self._start = day + _DAY_US
+
+    def _add(self, rows: Iterable[Tuple]):
+        for row in rows:
+            if row[1] >= self._start:
+                day = _day(row[1])
+                segment = self._segments.get(day)
+                if segment is None:
+                    segment = self._segments[day] = Segment()
+                segment.pending.append(row)
+
+    def _row(self, indicator) -> Tuple:
+        get = indicator.get if isinstance(indicator, dict) else lambda name: getattr(indicator, name)
+        return (get("id"), _micros(get("timestamp")), float(get("value")), get("zone_id"),
+                self._codes.code(get("type")), self._codes.code(get("parameter") or ""))
+
+    def write_version(self, db: Session) -> Optional[Version]:
+        """Generation of indicators in the current write transaction (after bump_generation), None when disabled"""
+        if not self.enabled:
+            return None
+        return get_generations(db, ["indicators"])["indicators"]
+
+    def apply(self, version: Optional[Version], removed: Sequence[int] = (), added: Sequence[Any] = ()):
+        """
+        Apply a committed write that produced version: indicators removed by
+        id, and added ones (models or dicts of columns with their id). Adding
+        an id already held replaces it, so replaying a write is harmless.
+        """
+        if version is None or not self.enabled:
+            return
+        with self._lock:
+            if self._version is None or version[0] <= self._version[0]:
+                # Not loaded yet, or already in the loaded data
+                return
+            if version[0] != self._version[0] + 1:
+                # Missed a write from elsewhere, reload on the next query
+                self._version = None
+                return
+            rows = [self._row(indicator) for indicator in added]
+            ids = np.asarray(list(removed) + [row[0] for row in rows], dtype=np.int64)
+            if len(ids):
+                for segment in self._segments.values():
+                    segment.remove(ids)
+            self._add(rows)
+            self._version = version
+            self._evict()
+
+    def load(self, db: Session, batch_size: int = 50000):
+        """(Re)load the window from the indicators table"""
+        with self._load_lock:
+            version = get_generations(db, ["indicators"])["indicators"]
+            with self._lock:
+                if self._version == version:
+                    return
+            start = self._horizon()
+            indicator = models.Indicator
+            rows = db.execute(
+                select(indicator.id, indicator.timestamp, indicator.value, indicator.zone_id,
+                       indicator.type, func.coalesce(indicator.parameter, ""))
+                .where(indicator.timestamp >= _datetime(start))
+                .execution_options(yield_per=batch_size)
+            )
+            codes = Codes()
+            parts: Dict[str, List[np.ndarray]] = defaultdict(list)
+            for batch in rows.partitions():
+                ids, timestamps, values, zones, types, parameters = zip(*batch)
+                parts["id"].append(np.asarray(ids, np.int64))
+                parts["timestamp"].append(
+                    np.asarray(timestamps, dtype="datetime64[us]").astype(np.int64)
+                )
+                parts["value"].append(np.asarray(values, np.float64))
+                parts["zone_id"].append(np.asarray(zones, np.int32))
+                parts["type"].append(np.asarray([codes.code(name) for name in types], np.int32))
+                parts["parameter"].append(np.asarray([codes.code(name) for name in parameters], np.int32))
+            arrays = {
+                name: np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype)
+                for name, dtype in COLUMNS
+            }
+
+            days = arrays["timestamp"] - arrays["timestamp"] % _DAY_US
+            order = np.argsort(days, kind="stable")
+            arrays = {name: array[order] for name, array in arrays.items()}
+            days = days[order]
+            segments = {}
+            bounds = np.flatnonzero(np.diff(days)) + 1
+            for first, last in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(days)]])):
+                if last > first:
+                    segments[int(days[first])] = Segment({name: array[first:last] for name, array in arrays.items()})
+
+            with self._lock:
+                self._segments, self._codes, self._start, self._version = segments, codes, start, version
+                self._evict()
+                self.loads += 1
+
+    def snapshot(self, db: Session, from_date: Optional[datetime]) -> Optional[Window]:
+        """
+        The columns from the day of from_date on, when the window holds every
+        indicator from from_date, reloaded first if the database was written
+        by another process; None when the query must go to the database.
+        """
+        if not self.enabled or from_date is None:
+            return None
+        start = _micros(from_date)
+        with self._lock:
+            if self._start is not None and start < max(self._start, self._horizon()):
+                return None
+            current = self._version
+        version = get_generations(db, ["indicators"])["indicators"]
+        if current != version:
+            self.load(db)
+        with self._lock:
+            if self._version != version:
+                # Written again while loading, this query goes to the database
+                return None
+            self._evict()
+            if start < self._start:
+                return None
+            day = _day(start)
+            segments = [self._segments[key].columns() for key in sorted(self._segments) if key >= day]
+            columns = {
+                name: np.concatenate([segment[name] for segment in segments]) if segments else np.empty(0, dtype)
+                for name, dtype in COLUMNS
+            }
+            return Window(columns, self._codes, _datetime(self._start))
+
+    def clear(self):
+        with self._lock:
+            self._segments, self._codes, self._start, self._version = {}, Codes(), None, None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = sum(len(segment) for segment in self._segments.values())
+            return {
+                "enabled": self.enabled,
+                "days": self.days,
+                "start": _datetime(self._start).isoformat() if self._start is not None else None,
+                "rows": rows,
+                "bytes": rows * ROW_BYTES,
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+            }
+
+
+# HOT_WINDOW_DAYS=0 (the default) disables the window
+hot_window = HotWindow(
+    days=float(os.getenv("HOT_WINDOW_DAYS", "0")),
+    max_bytes=int(float(os.getenv("HOT_WINDOW_MAX_MB", "64")) * 2**20)
+)
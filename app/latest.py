@@ -0,0 +1,195 @@
+"""
+Latest value per zone, type and parameter
+
+latest_indicators holds, per (zone, type, parameter), the most recent
+indicator's value, unit, timestamp and source along with the count and sum of
+all its values. The crud write paths call add_indicators/remove_indicators in
+the same transaction as the indicator write, so /zones/latest reads one row per
+series instead of scanning the indicators.
+
+Run "python rebuild_rollups.py" to rebuild it from existing indicators.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+from sqlalchemy import and_, bindparam, case, delete, func, select, tuple_, update
+from sqlalchemy.orm import Session
+from app import models
+from app.cache import bump_generation
+from app.database import dialect_insert, naive_datetime
+
+LATEST_FIELDS = ("value", "unit", "timestamp", "source_id")
+
+
+class Latest(NamedTuple):
+    """The part of an indicator that the latest values depend on"""
+    zone_id: int
+    type: str
+    parameter: str
+    timestamp: datetime
+    value: float
+    unit: str
+    source_id: int
+
+    @property
+    def key(self) -> Tuple[int, str, str]:
+        return self.zone_id, self.type, self.parameter
+
+
+def latest_of(indicator) -> Latest:
+    """Latest of an Indicator model, a row with the same attributes, or a dict of its columns"""
+    get = indicator.get if isinstance(indicator, dict) else lambda field: getattr(indicator, field)
+    return Latest(
+        get("zone_id"),
+        get("type"),
+        get("parameter") or "",
+        naive_datetime(get("timestamp")),
+        float(get("value")),
+        get("unit"),
+        get("source_id")
+    )
+
+
+def _group(indicators: Iterable[Latest]) -> Dict[Tuple, dict]:
+    """Count, sum and most recent indicator per key (the last one wins timestamp ties)"""
+    groups: Dict[Tuple, dict] = {}
+    for item in indicators:
+        group = groups.get(item.key)
+        if group is None:
+            groups[item.key] = group = {"value_count": 0, "value_sum": 0.0, "latest": item}
+        group["value_count"] += 1
+        group["value_sum"] += item.value
+        if item.timestamp >= group["latest"].timestamp:
+            group["latest"] = item
+    return groups
+
+
+def _row(key: Tuple, group: dict) -> dict:
+    latest = group["latest"]
+    return {
+        "zone_id": key[0], "type": key[1], "parameter": key[2],
+        "value": latest.value, "unit": latest.unit, "timestamp": latest.timestamp, "source_id": latest.source_id,
+        "value_count": group["value_count"], "value_sum": group["value_sum"],
+    }
+
+
+def add_indicators(db: Session, indicators: Iterable[Latest]):
+    """Account for new indicators with one upsert (caller commits)"""
+    add_groups(db, _group(indicators))
+
+
+def add_groups(db: Session, groups: Dict[Tuple, dict]):
+    """
+    Account for groups of new indicators, {"value_count", "value_sum",
+    "latest": Latest} per (zone_id, type, parameter), with one upsert (caller
+    commits)
+    """
+    if not groups:
+        return
+
+    table = models.LatestIndicator.__table__
+    stmt = dialect_insert(db.bind, table)
+    excluded = stmt.excluded
+    newer = excluded.timestamp >= table.c.timestamp
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["zone_id", "type", "parameter"],
+        set_={
+            "value_count": table.c.value_count + excluded.value_count,
+            "value_sum": table.c.value_sum + excluded.value_sum,
+            **{field: case((newer, excluded[field]), else_=table.c[field]) for field in LATEST_FIELDS},
+        }
+    )
+    db.execute(stmt, [_row(key, group) for key, group in groups.items()])
+
+
+def remove_indicators(db: Session, indicators: Iterable[Latest]):
+    """
+    Take indicators out of their rows (caller commits).
+
+    The indicator rows must already be deleted or updated and flushed. Count
+    and sum are decremented; the most recent indicator is only looked up
+    again in the series where a removed one may have been it.
+    """
+    groups = _group(indicators)
+    if not groups:
+        return
+
+    table = models.LatestIndicator.__table__
+    key_clause = and_(table.c.zone_id == bindparam("k_zone_id"), table.c.type == bindparam("k_type"),
+                      table.c.parameter == bindparam("k_parameter"))
+    keys = [{"k_zone_id": key[0], "k_type": key[1], "k_parameter": key[2]} for key in groups]
+    stored = {
+        (row.zone_id, row.type, row.parameter): row.timestamp
+        for row in db.execute(select(table.c.zone_id, table.c.type, table.c.parameter, table.c.timestamp).where(
+            tuple_(table.c.zone_id, table.c.type, table.c.parameter).in_(list(groups))
+        ))
+    }
+    db.execute(
+        update(table).where(key_clause).values(
+            value_count=table.c.value_count - bindparam("d_count"),
+            value_sum=table.c.value_sum - bindparam("d_sum"),
+        ),
+        [dict(params, d_count=group["value_count"], d_sum=group["value_sum"])
+         for params, group in zip(keys, groups.values())]
+    )
+    db.execute(delete(table).where(key_clause, table.c.value_count <= 0), keys)
+
+    indicator = models.Indicator
+    for (zone_id, type_, parameter), group in groups.items():
+        timestamp = stored.get((zone_id, type_, parameter))
+        if timestamp is None or group["latest"].timestamp < timestamp:
+            continue
+        row = db.execute(
+            select(indicator.zone_id, indicator.type, indicator.parameter, indicator.timestamp,
+                   indicator.value, indicator.unit, indicator.source_id)
+            .where(
+                indicator.zone_id == zone_id,
+                indicator.type == type_,
+                func.coalesce(indicator.parameter, "") == parameter,
+            )
+            .order_by(indicator.timestamp.desc(), indicator.id.desc())
+            .limit(1)
+        ).one_or_none()
+        if row is not None:
+            db.execute(
+                update(table).where(
+                    table.c.zone_id == zone_id, table.c.type == type_, table.c.parameter == parameter
+                ).values({field: getattr(row, field) for field in LATEST_FIELDS})
+            )
+
+
+def rebuild_latest(db: Session, batch_size: int = 10000) -> int:
+    """Recompute latest_indicators from the indicators table, returns the number of rows"""
+    indicator = models.Indicator
+    table = models.LatestIndicator.__table__
+
+    db.execute(delete(table))
+
+    # In insertion order, so timestamp ties resolve like the incremental path
+    rows = db.execute(
+        select(indicator.zone_id, indicator.type, indicator.parameter, indicator.timestamp,
+               indicator.value, indicator.unit, indicator.source_id)
+        .order_by(indicator.id)
+        .execution_options(yield_per=batch_size)
+    )
+    groups = _group(latest_of(row) for row in rows)
+
+    items = [_row(key, group) for key, group in groups.items()]
+    for start in range(0, len(items), batch_size):
+        db.execute(table.insert(), items[start:start + batch_size])
+    # The /zones/latest responses may change, invalidate their ETags
+    bump_generation(db, "indicators")
+    db.commit()
+    return len(items)
+
+
+def latest_values(db: Session, types: Optional[Sequence[str]] = None,
+                  zone_ids: Optional[Sequence[int]] = None):
+    """latest_indicators rows, optionally restricted to types and zones"""
+    latest = models.LatestIndicator
+    query = select(latest).order_by(latest.zone_id, latest.type, latest.parameter)
+    if types:
+        query = query.where(latest.type.in_(types))
+    if zone_ids:
+        query = query.where(latest.zone_id.in_(zone_ids))
+    return db.execute(query).scalars().all()
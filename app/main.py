@@ -1,10 +1,32 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import auth, users, indicators, zones, stats, sources
-from app.database import engine, Base
+from app.database import SessionLocal, async_engine, upgrade_schema
+from app import crud, hashing, latest, rollups
+from app.auth import AuthenticatedUser, get_current_admin_user
+from app.cache import user_cache
+from app.hotwindow import hot_window
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+# Create database tables (and columns/indexes added since the database was created)
+added = upgrade_schema()
+if "indicators.parameter" in added:
+    with SessionLocal() as db:
+        crud.backfill_indicator_parameters(db)
+if "uq_indicators_natural_key" in added:
+    with SessionLocal() as db:
+        crud.deduplicate_indicators(db)
+if "zones.latitude" in added:
+    with SessionLocal() as db:
+        crud.backfill_zone_coordinates(db)
+if "indicator_rollups" in added or "indicator_sketch_bins" in added:
+    with SessionLocal() as db:
+        rollups.rebuild_rollups(db)
+if "latest_indicators" in added:
+    with SessionLocal() as db:
+        latest.rebuild_latest(db)
+if hot_window.enabled:
+    with SessionLocal() as db:
+        hot_window.load(db)
 
 app = FastAPI(
     title="EcoTrack API",
@@ -21,6 +43,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Stop the password hashing workers with the server
+app.add_event_handler("shutdown", hashing.shutdown_pool)
+# Close pooled async connections, the aiosqlite ones each hold a thread that keeps the process alive
+app.add_event_handler("shutdown", async_engine.dispose)
+
 # Include routers
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(users.router, prefix="/users", tags=["Users"])
@@ -41,3 +68,8 @@ def health_check():
         "service": "EcoTrack API",
         "version": "1.0.0"
     }
+
+@app.get("/health/caches")
+def cache_stats(current_user: AuthenticatedUser = Depends(get_current_admin_user)):
+    """In-process cache statistics of this worker (admin only)"""
+    return {"users": user_cache.stats(), "hot_window": hot_window.stats()}
@@ -1,5 +1,6 @@
-from sqlalchemy import String, Float, DateTime, ForeignKey, Boolean, JSON
-from sqlalchemy.orm import relationship, Mapped, mapped_column
+import json
+from sqlalchemy import String, Float, DateTime, ForeignKey, Boolean, JSON, Index, UniqueConstraint
+from sqlalchemy.orm import relationship, Mapped, mapped_column, validates
 from app.database import Base
 from datetime import datetime
 from typing import Optional, List
@@ -22,10 +23,72 @@ class Zone(Base):
     name: Mapped[str] = mapped_column(String, index=True)
     postal_code: Mapped[Optional[str]] = mapped_column(String, index=True, nullable=True)
     geom: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # Can store GeoJSON or coordinates
+    # Parsed from geom: the point, or the centre of the bounding box of other geometries
+    latitude: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    longitude: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    # Bounding box of non-point geometries
+    min_lat: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    min_lon: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    max_lat: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    max_lon: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Relationship
     indicators: Mapped[List["Indicator"]] = relationship(back_populates="zone")
+    
+    @validates("geom")
+    def _sync_coordinates(self, key, geom):
+        for field, value in coordinates_of(geom).items():
+            setattr(self, field, value)
+        return geom
+    
+    @property
+    def bbox(self) -> Optional[List[float]]:
+        """[west, south, east, north] of non-point geometries"""
+        if self.min_lat is None:
+            return None
+        return [self.min_lon, self.min_lat, self.max_lon, self.max_lat]
+
+
+def _positions(coordinates):
+    # Nested GeoJSON coordinate arrays down to [lon, lat(, alt)] positions
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates
+    else:
+        for item in coordinates or ():
+            yield from _positions(item)
+
+
+def coordinates_of(geom: Optional[str]) -> dict:
+    """
+    Zone position columns parsed from geom, a "lat,lon" string or a GeoJSON
+    geometry/feature. All None when geom is empty or cannot be parsed.
+    """
+    empty = dict.fromkeys(("latitude", "longitude", "min_lat", "min_lon", "max_lat", "max_lon"))
+    if not geom or not geom.strip():
+        return empty
+    try:
+        if geom.lstrip().startswith("{"):
+            geometry = json.loads(geom)
+            if geometry.get("type") == "Feature":
+                geometry = geometry.get("geometry") or {}
+            positions = [(float(p[1]), float(p[0])) for p in _positions(geometry.get("coordinates"))]
+        else:
+            lat, lon = (float(part) for part in geom.split(","))
+            positions = [(lat, lon)]
+    except (ValueError, TypeError, AttributeError, IndexError):
+        return empty
+    if not positions or not all(-90 <= lat <= 90 and -180 <= lon <= 180 for lat, lon in positions):
+        return empty
+    
+    if len(positions) == 1:
+        return dict(empty, latitude=positions[0][0], longitude=positions[0][1])
+    lats = [lat for lat, _ in positions]
+    lons = [lon for _, lon in positions]
+    return {
+        "latitude": (min(lats) + max(lats)) / 2, "longitude": (min(lons) + max(lons)) / 2,
+        "min_lat": min(lats), "min_lon": min(lons), "max_lat": max(lats), "max_lon": max(lons),
+    }
 
 class Source(Base):
     __tablename__ = "sources"
@@ -41,15 +104,28 @@ class Source(Base):
     # Relationship
     indicators: Mapped[List["Indicator"]] = relationship(back_populates="source")
 
+# Identifies a reading: indicators without parameter never conflict (NULLs are distinct)
+NATURAL_KEY = ("zone_id", "source_id", "type", "timestamp", "parameter")
+
 class Indicator(Base):
     __tablename__ = "indicators"
+    __table_args__ = (
+        # Stats aggregates filter on type, then zone and time range; value makes them covering
+        Index("ix_indicators_type_zone_timestamp", "type", "zone_id", "timestamp", "value"),
+        # Same aggregates and listings when filtered on a zone first
+        Index("ix_indicators_zone_type_timestamp", "zone_id", "type", "timestamp", "value"),
+        # One reading per natural key, the conflict target of ingestion upserts (see crud.upsert_indicators)
+        Index("uq_indicators_natural_key", *NATURAL_KEY, unique=True),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    type: Mapped[str] = mapped_column(String, index=True)  # e.g., "air_quality", "co2", "energy"
+    type: Mapped[str] = mapped_column(String)  # e.g., "air_quality", "co2", "energy"
     value: Mapped[float] = mapped_column(Float)
     unit: Mapped[str] = mapped_column(String)  # e.g., "µg/m³", "kg", "kWh"
     timestamp: Mapped[datetime] = mapped_column(DateTime, index=True)
     extra_data: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)  # Additional data as JSON
+    # Copy of extra_data["parameter"] (e.g. "PM2.5") so it can be indexed and grouped on
+    parameter: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     
     # Foreign keys
     zone_id: Mapped[int] = mapped_column(ForeignKey("zones.id"))
@@ -60,3 +136,116 @@ class Indicator(Base):
     source: Mapped["Source"] = relationship(back_populates="indicators")
     
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    
+    @validates("extra_data")
+    def _sync_parameter(self, key, extra_data):
+        self.parameter = parameter_of(extra_data)
+        return extra_data
+
+
+def parameter_of(extra_data: Optional[dict]) -> Optional[str]:
+    """The measured parameter stored in an indicator's extra_data, if any"""
+    if isinstance(extra_data, dict) and extra_data.get("parameter") is not None:
+        return str(extra_data["parameter"])
+    return None
+
+class WriteGeneration(Base):
+    __tablename__ = "write_generations"
+    
+    # One row per tracked table, bumped in the same transaction as every write
+    table_name: Mapped[str] = mapped_column(String, primary_key=True)
+    generation: Mapped[int] = mapped_column(default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class IndicatorRollup(Base):
+    __tablename__ = "indicator_rollups"
+    __table_args__ = (
+        UniqueConstraint("granularity", "type", "zone_id", "bucket", "parameter", name="uq_indicator_rollups_key"),
+        Index("ix_indicator_rollups_zone", "granularity", "zone_id", "type", "bucket"),
+    )
+    
+    # Aggregates of indicators per (zone, type, parameter) and hour or day bucket,
+    # maintained by app.rollups in the same transaction as indicator writes
+    id: Mapped[int] = mapped_column(primary_key=True)
+    granularity: Mapped[str] = mapped_column(String)  # "hour" or "day"
+    bucket: Mapped[datetime] = mapped_column(DateTime)  # Start of the hour/day
+    zone_id: Mapped[int] = mapped_column(ForeignKey("zones.id"))
+    type: Mapped[str] = mapped_column(String)
+    parameter: Mapped[str] = mapped_column(String, default="")  # "" when the indicator has none
+    value_count: Mapped[int] = mapped_column(default=0)
+    value_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    value_min: Mapped[float] = mapped_column(Float)
+    value_max: Mapped[float] = mapped_column(Float)
+
+class LatestIndicator(Base):
+    __tablename__ = "latest_indicators"
+    __table_args__ = (
+        UniqueConstraint("zone_id", "type", "parameter", name="uq_latest_indicators_key"),
+    )
+    
+    # Most recent indicator and running count/sum per (zone, type, parameter),
+    # maintained by app.latest in the same transaction as indicator writes
+    id: Mapped[int] = mapped_column(primary_key=True)
+    zone_id: Mapped[int] = mapped_column(ForeignKey("zones.id"))
+    type: Mapped[str] = mapped_column(String)
+    parameter: Mapped[str] = mapped_column(String, default="")  # "" when the indicator has none
+    value: Mapped[float] = mapped_column(Float)
+    unit: Mapped[str] = mapped_column(String)
+    timestamp: Mapped[datetime] = mapped_column(DateTime)
+    source_id: Mapped[int] = mapped_column(ForeignKey("sources.id"))
+    value_count: Mapped[int] = mapped_column(default=0)
+    value_sum: Mapped[float] = mapped_column(Float, default=0.0)
+
+class IndicatorSketchBin(Base):
+    __tablename__ = "indicator_sketch_bins"
+    __table_args__ = (
+        UniqueConstraint("granularity", "type", "zone_id", "bucket", "parameter", "sign", "bin",
+                         name="uq_indicator_sketch_bins_key"),
+        Index("ix_indicator_sketch_bins_zone", "granularity", "zone_id", "type", "bucket"),
+    )
+    
+    # DDSketch bin counts of indicator values per rollup bucket (see app.sketches),
+    # maintained with the rollups in the same transaction as indicator writes
+    id: Mapped[int] = mapped_column(primary_key=True)
+    granularity: Mapped[str] = mapped_column(String)  # "hour" or "day"
+    bucket: Mapped[datetime] = mapped_column(DateTime)
+    zone_id: Mapped[int] = mapped_column(ForeignKey("zones.id"))
+    type: Mapped[str] = mapped_column(String)
+    parameter: Mapped[str] = mapped_column(String, default="")
+    sign: Mapped[int] = mapped_column()  # -1, 0 (zero) or 1
+    bin: Mapped[int] = mapped_column()  # Log-scale bin index of the absolute value
+    count: Mapped[int] = mapped_column(default=0)
+
+class IngestionWatermark(Base):
+    __tablename__ = "ingestion_watermarks"
+    __table_args__ = (
+        UniqueConstraint("source_id", "zone_id", "parameter", name="uq_ingestion_watermarks_key"),
+    )
+    
+    # Last timestamp covered by an ingested upstream response per (source, zone,
+    # parameter): the ingestion scripts only request what comes after it (see
+    # ingestion/watermarks.py)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    source_id: Mapped[int] = mapped_column(ForeignKey("sources.id"))
+    zone_id: Mapped[int] = mapped_column(ForeignKey("zones.id"))
+    parameter: Mapped[str] = mapped_column(String)
+    watermark: Mapped[datetime] = mapped_column(DateTime)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # The watermark ends a response cut by a page limit: the next request resumes at it, without overlap
+    truncated: Mapped[Optional[bool]] = mapped_column(Boolean, default=False, nullable=True)
+
+class IngestionRun(Base):
+    __tablename__ = "ingestion_runs"
+    __table_args__ = (
+        Index("ix_ingestion_runs_source_started", "source", "started_at"),
+    )
+    
+    # One run of an ingestion source by the scheduler (see ingestion/scheduler.py),
+    # its duration kept for capacity planning
+    id: Mapped[int] = mapped_column(primary_key=True)
+    source: Mapped[str] = mapped_column(String)
+    started_at: Mapped[datetime] = mapped_column(DateTime)
+    duration: Mapped[float] = mapped_column(Float)  # Seconds
+    status: Mapped[str] = mapped_column(String)  # "success" or "failed"
+    error: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    failures: Mapped[int] = mapped_column(default=0)  # Consecutive failures, this run included
@@ -0,0 +1,350 @@
+"""
+Hourly and daily rollups of indicators
+
+indicator_rollups holds count/sum/min/max of indicator values per
+(zone, type, parameter) and hour or day bucket. The crud write paths call
+add_readings/remove_readings in the same transaction as the indicator write,
+so the rollups never drift from the raw table, and aggregate() answers range
+queries from them at a cost proportional to the number of buckets. The same
+calls maintain the quantile sketches of each bucket (see app.sketches).
+
+Run "python rebuild_rollups.py" to rebuild them from existing indicators.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+from sqlalchemy import and_, bindparam, case, delete, func, select, update
+from sqlalchemy.orm import Session
+from app import models, sketches
+from app.cache import bump_generation
+from app.database import dialect_insert, naive_datetime
+
+GRANULARITIES = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+GROUP_FIELDS = ("zone_id", "type", "parameter")
+
+
+class Reading(NamedTuple):
+    """The part of an indicator that rollups depend on"""
+    zone_id: int
+    type: str
+    parameter: str
+    timestamp: datetime
+    value: float
+
+
+@dataclass
+class Agg:
+    """Mergeable count/sum/min/max aggregate"""
+    count: int = 0
+    sum: float = 0.0
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+    def add(self, value: float):
+        self.merge(1, value, value, value)
+
+    def merge(self, count: int, total: float, low: float, high: float):
+        if not count:
+            return
+        self.count += count
+        self.sum += total
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    @property
+    def average(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+
+def reading_of(indicator) -> Reading:
+    """Reading of an Indicator model, a row with the same attributes, or a dict of its columns"""
+    if isinstance(indicator, dict):
+        return Reading(
+            indicator["zone_id"],
+            indicator["type"],
+            indicator.get("parameter") or "",
+            naive_datetime(indicator["timestamp"]),
+            float(indicator["value"])
+        )
+    return Reading(
+        indicator.zone_id,
+        indicator.type,
+        indicator.parameter or "",
+        naive_datetime(indicator.timestamp),
+        float(indicator.value)
+    )
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    """Start of the hour or day bucket containing timestamp"""
+    timestamp = naive_datetime(timestamp)
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _bucket_ceil(timestamp: datetime, granularity: str) -> datetime:
+    start = bucket_start(timestamp, granularity)
+    return start if start == timestamp else start + GRANULARITIES[granularity]
+
+
+def _group(readings: Iterable[Reading]) -> Dict[Tuple, Agg]:
+    """Aggregate readings per rollup key (granularity, type, zone_id, bucket, parameter)"""
+    groups: Dict[Tuple, Agg] = defaultdict(Agg)
+    for reading in readings:
+        for granularity in GRANULARITIES:
+            key = (granularity, reading.type, reading.zone_id,
+                   bucket_start(reading.timestamp, granularity), reading.parameter)
+            groups[key].add(reading.value)
+    return groups
+
+
+def _key_params(key: Tuple) -> dict:
+    granularity, type_, zone_id, bucket, parameter = key
+    return {"k_granularity": granularity, "k_type": type_, "k_zone_id": zone_id,
+            "k_bucket": bucket, "k_parameter": parameter}
+
+
+def _key_clause(table):
+    return and_(
+        table.c.granularity == bindparam("k_granularity"),
+        table.c.type == bindparam("k_type"),
+        table.c.zone_id == bindparam("k_zone_id"),
+        table.c.bucket == bindparam("k_bucket"),
+        table.c.parameter == bindparam("k_parameter"),
+    )
+
+
+def add_readings(db: Session, readings: Iterable[Reading]):
+    """Add readings to the rollups with one upsert (caller commits)"""
+    readings = list(readings)
+    sketches.add_readings(db, readings)
+    add_aggregates(db, _group(readings))
+
+
+def add_aggregates(db: Session, groups: Dict[Tuple, Agg]):
+    """
+    Add aggregates per rollup key (granularity, type, zone_id, bucket,
+    parameter) with one upsert (caller commits), for bulk loaders that
+    aggregate their readings themselves; they add the sketch bins too.
+    """
+    if not groups:
+        return
+
+    table = models.IndicatorRollup.__table__
+    stmt = dialect_insert(db.bind, table)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["granularity", "type", "zone_id", "bucket", "parameter"],
+        set_={
+            "value_count": table.c.value_count + excluded.value_count,
+            "value_sum": table.c.value_sum + excluded.value_sum,
+            "value_min": case((excluded.value_min < table.c.value_min, excluded.value_min), else_=table.c.value_min),
+            "value_max": case((excluded.value_max > table.c.value_max, excluded.value_max), else_=table.c.value_max),
+        }
+    )
+    db.execute(stmt, [
+        {
+            "granularity": key[0], "type": key[1], "zone_id": key[2], "bucket": key[3], "parameter": key[4],
+            "value_count": agg.count, "value_sum": agg.sum, "value_min": agg.min, "value_max": agg.max,
+        }
+        for key, agg in groups.items()
+    ])
+
+
+def remove_readings(db: Session, readings: Iterable[Reading]):
+    """
+    Remove readings from the rollups (caller commits).
+
+    The indicator rows must already be deleted or updated and flushed: min and
+    max cannot be decremented, so they are recomputed from the raw rows of each
+    touched bucket.
+    """
+    readings = list(readings)
+    groups = _group(readings)
+    if not groups:
+        return
+    sketches.remove_readings(db, readings)
+
+    table = models.IndicatorRollup.__table__
+    keys = [_key_params(key) for key in groups]
+
+    db.execute(
+        update(table).where(_key_clause(table)).values(
+            value_count=table.c.value_count - bindparam("d_count"),
+            value_sum=table.c.value_sum - bindparam("d_sum"),
+        ),
+        [dict(_key_params(key), d_count=agg.count, d_sum=agg.sum) for key, agg in groups.items()]
+    )
+    db.execute(delete(table).where(_key_clause(table), table.c.value_count <= 0), keys)
+
+    indicator = models.Indicator
+    for key in groups:
+        granularity, type_, zone_id, bucket, parameter = key
+        low, high = db.execute(
+            select(func.min(indicator.value), func.max(indicator.value)).where(
+                indicator.zone_id == zone_id,
+                indicator.type == type_,
+                indicator.timestamp >= bucket,
+                indicator.timestamp < bucket + GRANULARITIES[granularity],
+                func.coalesce(indicator.parameter, "") == parameter,
+            )
+        ).one()
+        if low is not None:
+            db.execute(update(table).where(_key_clause(table)).values(value_min=low, value_max=high),
+                       _key_params(key))
+
+
+def rebuild_rollups(db: Session, batch_size: int = 10000) -> int:
+    """Recompute all rollups and their sketches from the indicators table, returns the number of rollup rows"""
+    indicator = models.Indicator
+    table = models.IndicatorRollup.__table__
+
+    db.execute(delete(table))
+
+    rows = db.execute(
+        select(indicator.zone_id, indicator.type, indicator.parameter, indicator.timestamp, indicator.value)
+        .execution_options(yield_per=batch_size)
+    )
+    groups = _group(reading_of(row) for row in rows)
+
+    items = list(groups.items())
+    for start in range(0, len(items), batch_size):
+        db.execute(table.insert(), [
+            {
+                "granularity": key[0], "type": key[1], "zone_id": key[2], "bucket": key[3], "parameter": key[4],
+                "value_count": agg.count, "value_sum": agg.sum, "value_min": agg.min, "value_max": agg.max,
+            }
+            for key, agg in items[start:start + batch_size]
+        ])
+    sketches.rebuild_sketches(db, batch_size)
+    # The /stats responses may change, invalidate their ETags
+    bump_generation(db, "indicators")
+    db.commit()
+    return len(items)
+
+
+def _segments(from_date: Optional[datetime], to_date: Optional[datetime], bucket: Optional[str]):
+    """
+    Split [from_date, to_date] into (source, start, end) half-open segments.
+
+    source is "day" or "hour" for spans covered by whole rollup buckets and
+    "raw" for the partial hours at either end, which are read from indicators.
+    Unbounded ends are None. Day rollups are skipped when grouping by hour.
+    """
+    if to_date is not None:
+        # to is inclusive, segments are half-open
+        to_date = to_date + timedelta(microseconds=1)
+    use_days = bucket != "hour"
+
+    if from_date is None and to_date is None:
+        return [("day" if use_days else "hour", None, None)]
+
+    first_hour = _bucket_ceil(from_date, "hour") if from_date is not None else None
+    last_hour = bucket_start(to_date, "hour") if to_date is not None else None
+    if first_hour is not None and last_hour is not None and first_hour >= last_hour:
+        return [("raw", from_date, to_date)]
+
+    segments = []
+    if from_date is not None and from_date < first_hour:
+        segments.append(("raw", from_date, first_hour))
+    if to_date is not None and last_hour < to_date:
+        segments.append(("raw", last_hour, to_date))
+
+    if use_days:
+        first_day = _bucket_ceil(first_hour, "day") if first_hour is not None else None
+        last_day = bucket_start(last_hour, "day") if last_hour is not None else None
+        if first_day is None or last_day is None or first_day < last_day:
+            segments.append(("day", first_day, last_day))
+            if first_hour is not None and first_hour < first_day:
+                segments.append(("hour", first_hour, first_day))
+            if last_hour is not None and last_day < last_hour:
+                segments.append(("hour", last_day, last_hour))
+            return segments
+
+    segments.append(("hour", first_hour, last_hour))
+    return segments
+
+
+def aggregate(
+    db: Session,
+    group_by: Sequence[str] = (),
+    bucket: Optional[str] = None,
+    types: Optional[Sequence[str]] = None,
+    zone_ids: Optional[Sequence[int]] = None,
+    parameters: Optional[Sequence[str]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+) -> Dict[Tuple, Agg]:
+    """
+    Aggregate indicator values from the rollups.
+
+    group_by is a subset of zone_id/type/parameter; with bucket ("hour" or
+    "day") the bucket start is appended to each key. The range is inclusive on
+    both ends like the indicator filters; partial hours at its edges are read
+    from the raw table, so results match an aggregate over indicators exactly.
+    """
+    for field in group_by:
+        if field not in GROUP_FIELDS:
+            raise ValueError(f"Cannot group by {field}")
+    from_date = naive_datetime(from_date) if from_date else None
+    to_date = naive_datetime(to_date) if to_date else None
+
+    results: Dict[Tuple, Agg] = defaultdict(Agg)
+    rollup = models.IndicatorRollup
+    indicator = models.Indicator
+
+    for source, start, end in _segments(from_date, to_date, bucket):
+        if source == "raw":
+            query = select(indicator.zone_id, indicator.type,
+                           func.coalesce(indicator.parameter, "").label("parameter"),
+                           indicator.timestamp, indicator.value)
+            query = query.where(indicator.timestamp >= start, indicator.timestamp < end)
+            if types:
+                query = query.where(indicator.type.in_(types))
+            if zone_ids:
+                query = query.where(indicator.zone_id.in_(zone_ids))
+            if parameters:
+                query = query.where(func.coalesce(indicator.parameter, "").in_(parameters))
+            for row in db.execute(query):
+                key = tuple(getattr(row, field) for field in group_by)
+                if bucket:
+                    key += (bucket_start(row.timestamp, bucket),)
+                results[key].add(float(row.value))
+            continue
+
+        columns = [getattr(rollup, field) for field in group_by]
+        if bucket:
+            columns.append(rollup.bucket)
+        query = select(
+            *columns,
+            func.sum(rollup.value_count).label("count"),
+            func.sum(rollup.value_sum).label("sum"),
+            func.min(rollup.value_min).label("min"),
+            func.max(rollup.value_max).label("max"),
+        ).where(rollup.granularity == source)
+        if types:
+            query = query.where(rollup.type.in_(types))
+        if zone_ids:
+            query = query.where(rollup.zone_id.in_(zone_ids))
+        if parameters:
+            query = query.where(rollup.parameter.in_(parameters))
+        if start is not None:
+            query = query.where(rollup.bucket >= start)
+        if end is not None:
+            query = query.where(rollup.bucket < end)
+        if columns:
+            query = query.group_by(*columns)
+
+        for row in db.execute(query):
+            if not row.count:
+                continue
+            key = tuple(getattr(row, field) for field in group_by)
+            if bucket:
+                key += (bucket_start(row.bucket, bucket),)
+            results[key].merge(row.count, row.sum, row.min, row.max)
+
+    return dict(results)
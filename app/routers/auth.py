@@ -1,39 +1,53 @@
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from app import crud, schemas
-from app.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import async_crud, schemas
+from app.database import get_async_db
 from app.auth import (
-    verify_password,
     create_access_token,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
+from app.hashing import HashingBusy, hash_password_async, needs_rehash, verify_password_async
 
 router = APIRouter()
 
+def _hashing_busy():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many authentication requests, retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
 @router.post("/register", response_model=schemas.UserResponse)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Public registration endpoint"""
     # Check if user already exists
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await async_crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    db_user = crud.get_user_by_username(db, username=user.username)
+    db_user = await async_crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already taken")
     
-    return crud.create_user(db=db, user=user)
+    try:
+        return await async_crud.create_user(db=db, user=user)
+    except HashingBusy:
+        raise _hashing_busy()
 
 @router.post("/login", response_model=schemas.Token)
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Login endpoint - returns JWT token"""
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await async_crud.get_user_by_username(db, username=form_data.username)
+    try:
+        verified = user is not None and await verify_password_async(form_data.password, user.hashed_password)
+    except HashingBusy:
+        raise _hashing_busy()
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -43,6 +57,15 @@ def login(
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     
+    # Upgrade hashes made with a previous BCRYPT_ROUNDS while the password is at hand
+    if needs_rehash(user.hashed_password):
+        try:
+            hashed_password = await hash_password_async(form_data.password)
+        except HashingBusy:
+            pass  # Not worth failing the login, the next one will retry
+        else:
+            await async_crud.update_password_hash(db, user.id, hashed_password)
+    
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username, "role": user.role},
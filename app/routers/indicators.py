@@ -1,27 +1,45 @@
+import json
+import os
 from typing import List, Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from app import crud, schemas, models
-from app.database import get_db
-from app.auth import get_current_active_user, get_current_admin_user
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, ValidationError
+from app import async_crud, crud, events, schemas, models, export
+from app.database import get_async_db, SessionLocal
+from app.auth import (
+    AuthenticatedUser, get_current_active_user, get_current_active_stream_user, get_current_admin_user
+)
+from app.conditional import not_modified
 
 router = APIRouter()
 
+# Largest accepted POST /indicators/bulk batch; the body size is capped accordingly
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "5000"))
+BULK_MAX_BYTES = BULK_MAX_ITEMS * 2048
+
+DUPLICATE_DETAIL = "An indicator with the same zone, source, type, timestamp and parameter already exists"
+
+# Comment line sent on idle event streams so proxies keep the connection open
+STREAM_KEEPALIVE_SECONDS = 15
+
 
 class PaginatedIndicatorResponse(BaseModel):
     """Response model for paginated indicators"""
     items: List[schemas.IndicatorResponse]
-    total: int
+    total: Optional[int]
+    total_strategy: str = "exact"
     skip: int
     limit: int
     has_next: bool
     has_prev: bool
+    next_cursor: Optional[str] = None
 
 
 @router.get("/", response_model=PaginatedIndicatorResponse)
-def read_indicators(
+async def read_indicators(
     skip: int = 0,
     limit: int = 100,
     type: Optional[str] = None,
@@ -30,8 +48,14 @@ def read_indicators(
     to_date: Optional[datetime] = Query(None, alias="to"),
     sort_by: Optional[str] = Query("timestamp", description="Sort by field: timestamp, value, type, created_at"),
     order: Optional[str] = Query("desc", description="Sort order: asc or desc"),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous page's next_cursor"),
+    paginate: Optional[str] = Query("offset", description="Pagination mode: offset or cursor"),
+    count: Optional[str] = Query(
+        None, description="Total count strategy: exact, cached, estimate or none (default exact, none with cursors)"
+    ),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    unchanged: None = Depends(not_modified("indicators"))
 ):
     """
     List indicators with optional filters and pagination:
@@ -41,62 +65,250 @@ def read_indicators(
     - sort_by: sort by field (timestamp, value, type, created_at)
     - order: sort order (asc, desc)
     - skip/limit: pagination
+    - paginate=cursor / cursor: keyset pagination, pass next_cursor back to get the next page
+    - count: how total is computed (exact, cached, estimate, none); none by default with cursors
+    
+    Answers 304 to If-None-Match / If-Modified-Since while no indicator was written.
     """
-    result = crud.get_indicators(
-        db,
-        skip=skip,
-        limit=limit,
-        type=type,
-        zone_id=zone_id,
-        from_date=from_date,
-        to_date=to_date,
-        sort_by=sort_by,
-        order=order
-    )
+    try:
+        result = await async_crud.get_indicators(
+            db,
+            skip=skip,
+            limit=limit,
+            type=type,
+            zone_id=zone_id,
+            from_date=from_date,
+            to_date=to_date,
+            sort_by=sort_by,
+            order=order,
+            cursor=cursor,
+            use_cursor=paginate == "cursor",
+            count=count
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return result
 
+@router.get("/export")
+def export_indicators(
+    format: str = Query("ndjson", description="Export format: ndjson, csv, arrow (Arrow IPC stream) or parquet"),
+    type: Optional[str] = None,
+    zone_id: Optional[int] = None,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+):
+    """
+    Stream all indicators matching the filters (same filters as the listing),
+    ordered by timestamp. Rows are read with a server-side cursor and written
+    as they arrive, so exports of any size use constant memory. arrow and
+    parquet are typed, columnar formats written one record batch / row group
+    at a time, for loading straight into pandas or other analytics tools.
+    """
+    if format not in export.EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format, expected one of: {', '.join(export.EXPORT_FORMATS)}"
+        )
+    missing = export.missing_dependency(format)
+    if missing:
+        raise HTTPException(status_code=501, detail=f"The {format} export requires the {missing} package")
+    writer, media_type, extension, batch_size, _ = export.EXPORT_FORMATS[format]
+    
+    def stream():
+        # The stream outlives the request's dependencies, so it owns its session
+        db = SessionLocal()
+        try:
+            batches = crud.iter_indicator_rows(
+                db, type=type, zone_id=zone_id, from_date=from_date, to_date=to_date,
+                batch_size=batch_size
+            )
+            yield from writer(batches)
+        finally:
+            db.close()
+    
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="indicators.{extension}"'}
+    )
+
+async def indicator_events(types: Optional[List[str]] = None, zone_ids: Optional[List[int]] = None,
+                           keepalive: float = STREAM_KEEPALIVE_SECONDS):
+    """
+    Server-Sent Events of new indicators matching the filters, until the
+    client disconnects. The subscription is made on the first iteration, so
+    a response closed before it starts leaves none behind.
+    """
+    subscription = events.broker.subscribe(types=types, zone_ids=zone_ids)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            batch = await subscription.get(timeout=keepalive)
+            if batch is None:
+                yield ": keepalive\n\n"
+            elif batch == events.RESYNC:
+                yield events.sse_message("resync", {})
+            else:
+                yield events.sse_message("indicators", batch)
+                yield events.sse_message("summary", events.summary_delta(batch))
+    finally:
+        events.broker.unsubscribe(subscription)
+
+@router.get("/stream")
+async def stream_indicators(
+    type: Optional[List[str]] = Query(None, description="Only push these indicator types"),
+    zone_id: Optional[List[int]] = Query(None, description="Only push indicators of these zones"),
+    current_user: AuthenticatedUser = Depends(get_current_active_stream_user)
+):
+    """
+    Push new indicators as Server-Sent Events
+    
+    Each batch of created indicators matching the filters is sent as an
+    "indicators" event (a JSON array of indicators), followed by a "summary"
+    event with its per-type count/sum/min/max, to merge into /stats/summary.
+    A "resync" event means events were dropped because the client fell
+    behind: reload the data. EventSource clients pass the token as access_token.
+    """
+    return StreamingResponse(
+        indicator_events(type, zone_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/{indicator_id}", response_model=schemas.IndicatorResponse)
-def read_indicator(
+async def read_indicator(
     indicator_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
 ):
     """Get specific indicator"""
-    db_indicator = crud.get_indicator(db, indicator_id=indicator_id)
+    db_indicator = await async_crud.get_indicator(db, indicator_id=indicator_id)
     if db_indicator is None:
         raise HTTPException(status_code=404, detail="Indicator not found")
     return db_indicator
 
 @router.post("/", response_model=schemas.IndicatorResponse)
-def create_indicator(
+async def create_indicator(
     indicator: schemas.IndicatorCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
 ):
     """Create new indicator (admin only)"""
-    return crud.create_indicator(db=db, indicator=indicator)
+    try:
+        return await async_crud.create_indicator(db=db, indicator=indicator)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail=DUPLICATE_DETAIL)
+
+async def _read_limited_body(request: Request, max_bytes: int) -> bytes:
+    """Read the request body, failing with 413 as soon as it exceeds max_bytes"""
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Request body larger than {max_bytes} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'item'}: {err['msg']}"
+        for err in error.errors()
+    )
+
+
+@router.post("/bulk", response_model=schemas.BulkIndicatorResult)
+async def create_indicators_bulk(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
+):
+    """
+    Create many indicators at once (admin only)
+    
+    The body is either a JSON array of indicators or NDJSON (one indicator per
+    line, Content-Type: application/x-ndjson). Invalid items are reported in
+    errors by position and the valid ones are inserted in a single transaction;
+    readings already stored (same natural key) are skipped and counted.
+    """
+    body = await _read_limited_body(request, BULK_MAX_BYTES)
+    content_type = request.headers.get("content-type", "")
+    
+    errors = []
+    raw_items = []
+    if "ndjson" in content_type or "jsonl" in content_type:
+        for index, line in enumerate(body.splitlines()):
+            if not line.strip():
+                continue
+            try:
+                raw_items.append((index, json.loads(line)))
+            except ValueError as e:
+                errors.append({"index": index, "detail": f"Invalid JSON: {e}"})
+    else:
+        try:
+            payload = json.loads(body or b"[]")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of indicators")
+        raw_items = list(enumerate(payload))
+    
+    if len(raw_items) + len(errors) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ITEMS} indicators per request")
+    
+    # Validate every item in one pass
+    valid = []
+    for index, raw in raw_items:
+        try:
+            valid.append((index, schemas.IndicatorCreate.model_validate(raw)))
+        except ValidationError as e:
+            errors.append({"index": index, "detail": _format_validation_error(e)})
+    
+    # Foreign keys are checked with one query per table rather than per item
+    zone_ids = await async_crud.get_existing_ids(db, models.Zone, [item.zone_id for _, item in valid])
+    source_ids = await async_crud.get_existing_ids(db, models.Source, [item.source_id for _, item in valid])
+    to_insert = []
+    for index, item in valid:
+        if item.zone_id not in zone_ids:
+            errors.append({"index": index, "detail": f"Zone {item.zone_id} not found"})
+        elif item.source_id not in source_ids:
+            errors.append({"index": index, "detail": f"Source {item.source_id} not found"})
+        else:
+            to_insert.append(item)
+    result = await async_crud.upsert_indicators(db, to_insert)
+    
+    return {
+        "inserted": result["inserted"],
+        "skipped": result["skipped"],
+        "errors": sorted(errors, key=lambda err: err["index"])
+    }
 
 @router.put("/{indicator_id}", response_model=schemas.IndicatorResponse)
-def update_indicator(
+async def update_indicator(
     indicator_id: int,
     indicator_update: schemas.IndicatorUpdate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
 ):
     """Update indicator (admin only)"""
-    db_indicator = crud.update_indicator(db, indicator_id=indicator_id, indicator_update=indicator_update)
+    try:
+        db_indicator = await async_crud.update_indicator(db, indicator_id=indicator_id, indicator_update=indicator_update)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail=DUPLICATE_DETAIL)
     if db_indicator is None:
         raise HTTPException(status_code=404, detail="Indicator not found")
     return db_indicator
 
 @router.delete("/{indicator_id}")
-def delete_indicator(
+async def delete_indicator(
     indicator_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
 ):
     """Delete indicator (admin only)"""
-    db_indicator = crud.delete_indicator(db, indicator_id=indicator_id)
+    db_indicator = await async_crud.delete_indicator(db, indicator_id=indicator_id)
     if db_indicator is None:
         raise HTTPException(status_code=404, detail="Indicator not found")
     return {"message": "Indicator deleted successfully"}
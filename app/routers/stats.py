@@ -1,104 +1,268 @@
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app import models
-from app.database import get_db
-from app.auth import get_current_active_user
+from app import crud, downsampling, models, rollups, schemas, sketches, timeseries
+from app.database import get_async_db
+from app.auth import AuthenticatedUser, get_current_active_user
+from app.conditional import not_modified
+from app.hotwindow import hot_window
 
 router = APIRouter()
 
+# Label of a day bucket for each co2 trend period (same formats as SQLite's date/strftime)
+PERIOD_FORMATS = {"daily": "%Y-%m-%d", "weekly": "%Y-%W", "monthly": "%Y-%m"}
+
+
+def _aggregates(db: Session, with_quantiles: bool = False, **filters):
+    """
+    Aggregates keyed like rollups.aggregate, and quantile sketches with
+    with_quantiles: from the hot window when it holds the whole range (its
+    quantiles are exact), else from the rollups.
+    """
+    window = hot_window.snapshot(db, filters.get("from_date"))
+    if window is not None:
+        return window.aggregate(with_quantiles=with_quantiles, **filters)
+    results = rollups.aggregate(db, **filters)
+    return results, sketches.sketches(db, **filters) if with_quantiles else None
+
+
+def _air_averages(results, zone_names) -> dict:
+    """Labels/series of air quality averages from aggregates keyed by (zone_id,)"""
+    # Group by zone name, as zones may share a name
+    by_name = {}
+    for (zone,), agg in results.items():
+        by_name.setdefault(zone_names.get(zone), rollups.Agg()).merge(agg.count, agg.sum, agg.min, agg.max)
+    names = sorted(name for name in by_name if name is not None)
+    
+    return {
+        "labels": names,
+        "series": [by_name[name].average for name in names]
+    }
+
+
+def _co2_trend(results, period: str, max_points: Optional[int] = None, downsample: str = "lttb") -> dict:
+    """Labels/series of co2 totals per period from aggregates keyed by (day,), downsampled to max_points"""
+    label_format = PERIOD_FORMATS.get(period, PERIOD_FORMATS["monthly"])
+    
+    # Group day buckets by period
+    totals = {}
+    for (day,), agg in results.items():
+        label = day.strftime(label_format)
+        totals[label] = totals.get(label, 0.0) + agg.sum
+    labels = sorted(totals)
+    series = [float(totals[label]) for label in labels]
+    
+    if max_points is not None:
+        keep = downsampling.select_points(range(len(labels)), [series], max_points, downsample)
+        if keep is not None:
+            labels = [labels[index] for index in keep]
+            series = [series[index] for index in keep]
+    
+    return {
+        "labels": labels,
+        "series": series
+    }
+
+
+def _summary(results, type_sketches=None, quantiles=()) -> list:
+    """Per-type statistics from aggregates keyed by (type,), with quantiles read from sketches keyed the same way"""
+    summary = []
+    for key, agg in sorted(results.items()):
+        item = {
+            "type": key[0],
+            "count": agg.count,
+            "average": float(agg.average),
+            "min": float(agg.min),
+            "max": float(agg.max)
+        }
+        if quantiles:
+            sketch = (type_sketches or {}).get(key)
+            item["quantiles"] = {
+                sketches.quantile_label(q): sketch.quantile(q, agg.min, agg.max) if sketch else None
+                for q in quantiles
+            }
+        summary.append(item)
+    return summary
+
+
 @router.get("/air/averages")
-def get_air_quality_averages(
+async def get_air_quality_averages(
     from_date: Optional[datetime] = Query(None, alias="from"),
     to_date: Optional[datetime] = Query(None, alias="to"),
     zone_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    unchanged: None = Depends(not_modified("indicators", "zones"))
 ):
     """Get average air quality indicators"""
-    query = db.query(
-        models.Zone.name.label("zone"),
-        func.avg(models.Indicator.value).label("average")
-    ).join(models.Indicator).filter(
-        models.Indicator.type == "air_quality"
+    results, _ = await db.run_sync(
+        _aggregates,
+        group_by=("zone_id",),
+        types=["air_quality"],
+        zone_ids=[zone_id] if zone_id else None,
+        from_date=from_date,
+        to_date=to_date
     )
     
-    if from_date:
-        query = query.filter(models.Indicator.timestamp >= from_date)
-    if to_date:
-        query = query.filter(models.Indicator.timestamp <= to_date)
-    if zone_id:
-        query = query.filter(models.Indicator.zone_id == zone_id)
-    
-    results = query.group_by(models.Zone.name).all()
-    
-    return {
-        "labels": [r.zone for r in results],
-        "series": [float(r.average) for r in results]
-    }
+    zone_names = dict((await db.execute(
+        select(models.Zone.id, models.Zone.name)
+        .where(models.Zone.id.in_([key[0] for key in results]))
+    )).all())
+    return _air_averages(results, zone_names)
 
 @router.get("/co2/trend")
-def get_co2_trend(
+async def get_co2_trend(
     zone_id: Optional[int] = None,
     period: str = "monthly",  # daily, weekly, monthly
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    max_points: Optional[int] = Query(None, ge=2, description="Downsample longer trends to about this many points"),
+    downsample: str = Query("lttb", description="Downsampling method: lttb or minmax"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    unchanged: None = Depends(not_modified("indicators"))
 ):
     """Get CO2 emission trends"""
-    # Group by period
-    if period == "daily":
-        time_group = func.date(models.Indicator.timestamp)
-    elif period == "weekly":
-        time_group = func.strftime('%Y-%W', models.Indicator.timestamp)
-    else:  # monthly
-        time_group = func.strftime('%Y-%m', models.Indicator.timestamp)
-    
-    query = db.query(
-        time_group.label("period"),
-        func.sum(models.Indicator.value).label("total")
-    ).filter(
-        models.Indicator.type == "co2"
+    if downsample not in downsampling.METHODS:
+        raise HTTPException(status_code=400, detail=f"Invalid downsampling method, expected one of: {', '.join(downsampling.METHODS)}")
+    results = await db.run_sync(
+        rollups.aggregate,
+        bucket="day",
+        types=["co2"],
+        zone_ids=[zone_id] if zone_id else None
     )
-    
-    if zone_id:
-        query = query.filter(models.Indicator.zone_id == zone_id)
-    
-    results = query.group_by(time_group).order_by(time_group).all()
-    
-    return {
-        "labels": [r.period for r in results],
-        "series": [float(r.total) for r in results]
-    }
+    return _co2_trend(results, period, max_points, downsample)
 
 @router.get("/summary")
-def get_summary_stats(
+async def get_summary_stats(
     zone_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    quantiles: Optional[str] = Query(None, description="Comma-separated quantiles, e.g. 0.5,0.95,0.99"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    unchanged: None = Depends(not_modified("indicators"))
 ):
-    """Get summary statistics for all indicator types"""
-    query = db.query(
-        models.Indicator.type,
-        func.count(models.Indicator.id).label("count"),
-        func.avg(models.Indicator.value).label("average"),
-        func.min(models.Indicator.value).label("min"),
-        func.max(models.Indicator.value).label("max")
+    """
+    Get summary statistics for all indicator types
+    
+    With quantiles, each type also gets approximate percentiles (within 1% of
+    the exact value) merged from the rollup sketches of the range, or exact
+    ones when the range is in the hot window.
+    """
+    try:
+        requested = sketches.parse_quantiles(quantiles) if quantiles else []
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filters = dict(
+        group_by=("type",),
+        zone_ids=[zone_id] if zone_id else None,
+        from_date=from_date,
+        to_date=to_date
     )
+    results, type_sketches = await db.run_sync(_aggregates, bool(requested), **filters)
+    return _summary(results, type_sketches, requested)
+
+
+@router.get("/timeseries")
+async def get_timeseries(
+    bucket: str = Query("1d", description="Bucket width from 5min to 1mo: e.g. 5min, 15min, 1h, 6h, 1d, 1w, 1mo"),
+    agg: str = Query("avg", description="Aggregation: avg, sum, min, max, count or a percentile such as p95"),
+    type: Optional[List[str]] = Query(None),
+    zone_id: Optional[List[int]] = Query(None),
+    parameter: Optional[List[str]] = Query(None),
+    group_by: str = Query("type", description="Comma-separated fields with one series each: zone_id, type, parameter"),
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    fill: str = Query("none", description="Gap filling: none, null or zero"),
+    max_points: Optional[int] = Query(None, ge=2, description="Downsample longer series to about this many points"),
+    downsample: str = Query("lttb", description="Downsampling method: lttb or minmax"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    unchanged: None = Depends(not_modified("indicators"))
+):
+    """
+    Indicator values aggregated per time bucket, one series per group.
+    
+    Returns labels (bucket starts) and series aligned on them. Ranges in the
+    hot window are aggregated in memory; otherwise buckets of whole hours,
+    days, weeks or months are read from the rollups.
+    """
+    try:
+        width = timeseries.parse_bucket(bucket)
+        return await db.run_sync(
+            timeseries.series,
+            width,
+            aggregation=agg,
+            group_by=tuple(field.strip() for field in group_by.split(",") if field.strip()),
+            types=type,
+            zone_ids=zone_id,
+            parameters=parameter,
+            from_date=from_date,
+            to_date=to_date,
+            fill=fill,
+            max_points=max_points,
+            downsample=downsample
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _dashboard(db: Session, zone_id: Optional[int], period: str, recent: int) -> dict:
+    zone_ids = [zone_id] if zone_id else None
     
-    if zone_id:
-        query = query.filter(models.Indicator.zone_id == zone_id)
+    # One pass over the rollups yields the summary, the air averages and the zone comparison
+    by_zone_type = rollups.aggregate(db, group_by=("zone_id", "type"), zone_ids=zone_ids)
+    co2_days = rollups.aggregate(db, bucket="day", types=["co2"], zone_ids=zone_ids)
+    zone_names = dict(db.execute(select(models.Zone.id, models.Zone.name)).all())
+    recent_indicators = crud.get_indicators(
+        db, limit=recent, zone_id=zone_id, sort_by="timestamp", order="desc", count="none"
+    )["items"]
     
-    results = query.group_by(models.Indicator.type).all()
+    by_type = {}
+    air_by_zone = {}
+    by_zone = {}
+    for (zone, type_), agg in by_zone_type.items():
+        by_type.setdefault((type_,), rollups.Agg()).merge(agg.count, agg.sum, agg.min, agg.max)
+        if type_ == "air_quality":
+            air_by_zone[(zone,)] = agg
+        by_zone.setdefault(zone, {})[type_] = agg
     
-    return [
+    zone_comparison = [
         {
-            "type": r.type,
-            "count": r.count,
-            "average": float(r.average),
-            "min": float(r.min),
-            "max": float(r.max)
+            "zone_id": zone,
+            "name": zone_names.get(zone),
+            "count": sum(agg.count for agg in types.values()),
+            "averages": {type_: agg.average for type_, agg in sorted(types.items())}
         }
-        for r in results
+        for zone, types in by_zone.items()
     ]
+    zone_comparison.sort(key=lambda item: (item["name"] or "", item["zone_id"]))
+    
+    return {
+        "summary": _summary(by_type),
+        "co2_trend": _co2_trend(co2_days, period),
+        "air_averages": _air_averages(air_by_zone, zone_names),
+        "zone_comparison": zone_comparison,
+        "recent_indicators": [schemas.IndicatorResponse.model_validate(item) for item in recent_indicators],
+        "zone_count": len(zone_names) if zone_id is None else int(zone_id in zone_names),
+    }
+
+@router.get("/dashboard")
+async def get_dashboard(
+    zone_id: Optional[int] = None,
+    period: str = "daily",  # co2 trend period: daily, weekly, monthly
+    recent: int = Query(10, ge=0, le=100, description="Number of most recent indicators"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    unchanged: None = Depends(not_modified("indicators", "zones"))
+):
+    """
+    Everything the dashboard shows, in one request: summary, co2 trend, air
+    quality averages, per-zone comparison (indicator count and average per
+    type) and the most recent indicators. Same values as the individual
+    /stats endpoints, from two rollup queries, one zone lookup and one
+    indicator query on a single session.
+    """
+    return await db.run_sync(_dashboard, zone_id, period, recent)
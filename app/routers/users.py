@@ -1,61 +1,68 @@
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app import crud, schemas, models
-from app.database import get_db
-from app.auth import get_current_admin_user, get_current_active_user
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import async_crud, schemas
+from app.database import get_async_db
+from app.auth import AuthenticatedUser, get_current_admin_user, get_current_active_user
 
 router = APIRouter()
 
 @router.get("/me", response_model=schemas.UserResponse)
-def read_users_me(current_user: models.User = Depends(get_current_active_user)):
+async def read_users_me(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+):
     """Get current user info"""
-    return current_user
+    # The auth dependencies only carry id/role/is_active, load the full profile
+    db_user = await async_crud.get_user(db, user_id=current_user.id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
 
 @router.get("/", response_model=List[schemas.UserResponse])
-def read_users(
+async def read_users(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
 ):
     """List all users (admin only)"""
-    users = crud.get_users(db, skip=skip, limit=limit)
+    users = await async_crud.get_users(db, skip=skip, limit=limit)
     return users
 
 @router.get("/{user_id}", response_model=schemas.UserResponse)
-def read_user(
+async def read_user(
     user_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
 ):
     """Get specific user (admin only)"""
-    db_user = crud.get_user(db, user_id=user_id)
+    db_user = await async_crud.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 @router.put("/{user_id}", response_model=schemas.UserResponse)
-def update_user(
+async def update_user(
     user_id: int,
     user_update: schemas.UserUpdate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
 ):
     """Update user (admin only)"""
-    db_user = crud.update_user(db, user_id=user_id, user_update=user_update)
+    db_user = await async_crud.update_user(db, user_id=user_id, user_update=user_update)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 @router.delete("/{user_id}")
-def delete_user(
+async def delete_user(
     user_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
 ):
     """Delete user (admin only)"""
-    db_user = crud.delete_user(db, user_id=user_id)
+    db_user = await async_crud.delete_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully"}
@@ -1,10 +1,12 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from app import crud, schemas, models
-from app.database import get_db
-from app.auth import get_current_active_user, get_current_admin_user
+from app import async_crud, schemas
+from app.spatial import parse_bbox
+from app.database import get_async_db
+from app.auth import AuthenticatedUser, get_current_active_user, get_current_admin_user
+from app.conditional import not_modified
 
 router = APIRouter()
 
@@ -12,7 +14,8 @@ router = APIRouter()
 class PaginatedZoneResponse(BaseModel):
     """Response model for paginated zones"""
     items: List[schemas.ZoneResponse]
-    total: int
+    total: Optional[int]
+    total_strategy: str = "exact"
     skip: int
     limit: int
     has_next: bool
@@ -20,58 +23,97 @@ class PaginatedZoneResponse(BaseModel):
 
 
 @router.get("/", response_model=PaginatedZoneResponse)
-def read_zones(
+async def read_zones(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    count: str = Query("exact", description="Total count strategy: exact, cached, estimate or none"),
+    bbox: Optional[str] = Query(None, description="Only zones intersecting west,south,east,north"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    unchanged: None = Depends(not_modified("zones"))
 ):
     """List all zones with pagination"""
-    result = crud.get_zones(db, skip=skip, limit=limit)
+    try:
+        result = await async_crud.get_zones(
+            db, skip=skip, limit=limit, count=count, bbox=parse_bbox(bbox) if bbox else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return result
 
+@router.get("/nearest", response_model=List[schemas.ZoneDistance])
+async def read_nearest_zones(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(5, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    unchanged: None = Depends(not_modified("zones"))
+):
+    """The k zones closest to a point, nearest first, with their distance in km"""
+    return await async_crud.get_nearest_zones(db, latitude=lat, longitude=lon, k=k)
+
+@router.get("/latest", response_model=List[schemas.ZoneLatest])
+async def read_zones_latest(
+    type: Optional[str] = None,
+    bbox: Optional[str] = Query(None, description="Only zones intersecting west,south,east,north"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    unchanged: None = Depends(not_modified("indicators", "zones"))
+):
+    """
+    All zones with the latest indicator per type and parameter, and the
+    indicator count and average, for the map. Read from the maintained
+    latest values, so the cost does not depend on the number of indicators.
+    """
+    try:
+        bounds = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await async_crud.get_zones_latest(db, type=type, bbox=bounds)
+
 @router.get("/{zone_id}", response_model=schemas.ZoneResponse)
-def read_zone(
+async def read_zone(
     zone_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
 ):
     """Get specific zone"""
-    db_zone = crud.get_zone(db, zone_id=zone_id)
+    db_zone = await async_crud.get_zone(db, zone_id=zone_id)
     if db_zone is None:
         raise HTTPException(status_code=404, detail="Zone not found")
     return db_zone
 
 @router.post("/", response_model=schemas.ZoneResponse)
-def create_zone(
+async def create_zone(
     zone: schemas.ZoneCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
 ):
     """Create new zone (admin only)"""
-    return crud.create_zone(db=db, zone=zone)
+    return await async_crud.create_zone(db=db, zone=zone)
 
 @router.put("/{zone_id}", response_model=schemas.ZoneResponse)
-def update_zone(
+async def update_zone(
     zone_id: int,
     zone_update: schemas.ZoneUpdate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
 ):
     """Update zone (admin only)"""
-    db_zone = crud.update_zone(db, zone_id=zone_id, zone_update=zone_update)
+    db_zone = await async_crud.update_zone(db, zone_id=zone_id, zone_update=zone_update)
     if db_zone is None:
         raise HTTPException(status_code=404, detail="Zone not found")
     return db_zone
 
 @router.delete("/{zone_id}")
-def delete_zone(
+async def delete_zone(
     zone_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_admin_user)
 ):
     """Delete zone (admin only)"""
-    db_zone = crud.delete_zone(db, zone_id=zone_id)
+    db_zone = await async_crud.delete_zone(db, zone_id=zone_id)
     if db_zone is None:
         raise HTTPException(status_code=404, detail="Zone not found")
     return {"message": "Zone deleted successfully"}
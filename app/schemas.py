@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 # User Schemas
 class UserBase(BaseModel):
@@ -50,11 +50,33 @@ class ZoneUpdate(BaseModel):
 
 class ZoneResponse(ZoneBase):
     id: int
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    bbox: Optional[List[float]] = None  # [west, south, east, north] of polygon geometries
     created_at: datetime
     
     class Config:
         from_attributes = True
 
+class ZoneDistance(ZoneResponse):
+    distance_km: float
+
+class LatestValue(BaseModel):
+    """Most recent indicator of a (type, parameter) series in a zone"""
+    type: str
+    parameter: Optional[str] = None
+    value: float
+    unit: str
+    timestamp: datetime
+    source_id: int
+    count: int
+    average: float
+
+class ZoneLatest(ZoneResponse):
+    count: int
+    average: Optional[float] = None
+    latest: List[LatestValue]
+
 # Source Schemas
 class SourceBase(BaseModel):
     name: str
@@ -108,3 +130,12 @@ class IndicatorResponse(IndicatorBase):
     
     class Config:
         from_attributes = True
+
+class BulkIndicatorError(BaseModel):
+    index: int  # Position of the item in the submitted array / NDJSON line number (0-based)
+    detail: str
+
+class BulkIndicatorResult(BaseModel):
+    inserted: int
+    skipped: int = 0  # Readings already stored (same zone, source, type, timestamp and parameter)
+    errors: List[BulkIndicatorError]
@@ -0,0 +1,250 @@
+"""
+Quantile sketches of indicator values per rollup bucket
+
+Values are counted in DDSketch bins: the bin of a value v is
+ceil(log(|v|) / log(gamma)) with gamma = (1 + a) / (1 - a), so any quantile
+read back from the bins is within a relative error a (RELATIVE_ACCURACY) of
+the exact one. indicator_sketch_bins holds one count per (rollup key, sign,
+bin); the rollup write paths add and subtract counts in the same transaction
+as the indicator write. Bins of the same index merge by adding their counts,
+so the sketch of any range is a SUM ... GROUP BY over its buckets, and deletes
+are exact.
+"""
+
+import math
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import and_, bindparam, delete, func, select, update
+from sqlalchemy.orm import Session
+from app import models, rollups
+from app.database import dialect_insert, naive_datetime
+
+RELATIVE_ACCURACY = float(os.getenv("SKETCH_RELATIVE_ACCURACY", "0.01"))
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+
+# Smaller absolute values are counted as zero
+MIN_VALUE = 1e-9
+
+KEY_FIELDS = ("granularity", "type", "zone_id", "bucket", "parameter", "sign", "bin")
+
+
+def bins_of(values: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """(signs, bins) of many values, as int64 arrays"""
+    values = np.asarray(values, dtype=np.float64)
+    magnitudes = np.abs(values)
+    zero = magnitudes < MIN_VALUE
+    signs = np.where(zero, 0, np.sign(values)).astype(np.int64)
+    bins = np.where(zero, 0, np.ceil(np.log(np.where(zero, 1, magnitudes)) / _LOG_GAMMA)).astype(np.int64)
+    return signs, bins
+
+
+def bin_of(value: float) -> Tuple[int, int]:
+    """(sign, bin) of a value"""
+    signs, bins = bins_of([value])
+    return int(signs[0]), int(bins[0])
+
+
+def value_of(sign: int, bin: int) -> float:
+    """Representative value of a bin, within RELATIVE_ACCURACY of every value it holds"""
+    if sign == 0:
+        return 0.0
+    return sign * 2 * GAMMA ** bin / (GAMMA + 1)
+
+
+def parse_quantiles(value: str) -> List[float]:
+    """Parse comma-separated quantiles such as "0.5,0.95,0.99", raises ValueError"""
+    try:
+        quantiles = [float(part) for part in value.split(",") if part.strip()]
+    except ValueError:
+        raise ValueError("quantiles must be comma-separated numbers between 0 and 1")
+    if not quantiles or not all(0 <= q <= 1 for q in quantiles):
+        raise ValueError("quantiles must be comma-separated numbers between 0 and 1")
+    return quantiles
+
+
+def quantile_label(q: float) -> str:
+    """p50, p95, p99.9..."""
+    return f"p{q * 100:g}"
+
+
+class Sketch:
+    """Mergeable DDSketch of a set of values"""
+
+    def __init__(self):
+        self.bins: Dict[Tuple[int, int], int] = defaultdict(int)
+        self.count = 0
+
+    def add(self, value: float):
+        self.add_bin(*bin_of(value), 1)
+
+    def add_bin(self, sign: int, bin: int, count: int):
+        self.bins[(sign, bin)] += count
+        self.count += count
+
+    def merge(self, other: "Sketch"):
+        for key, count in other.bins.items():
+            self.add_bin(*key, count)
+
+    def quantile(self, q: float, low: Optional[float] = None, high: Optional[float] = None) -> Optional[float]:
+        """Approximate q-quantile, clamped to the exact [low, high] range when known"""
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # Ascending values: negative bins by decreasing magnitude, zero, positive bins
+        for sign, bin in sorted(self.bins, key=lambda key: (key[0], key[0] * key[1])):
+            seen += self.bins[(sign, bin)]
+            if seen > rank:
+                value = value_of(sign, bin)
+                break
+        else:
+            value = value_of(*max(self.bins, key=lambda key: (key[0], key[0] * key[1])))
+        if low is not None:
+            value = max(value, low)
+        if high is not None:
+            value = min(value, high)
+        return value
+
+
+def _group(readings: Iterable["rollups.Reading"]) -> Dict[Tuple, int]:
+    """Count readings per sketch bin key (granularity, type, zone_id, bucket, parameter, sign, bin)"""
+    groups: Dict[Tuple, int] = defaultdict(int)
+    readings = list(readings)
+    signs, bins = bins_of([reading.value for reading in readings])
+    for reading, sign, bin in zip(readings, signs.tolist(), bins.tolist()):
+        for granularity in rollups.GRANULARITIES:
+            key = (granularity, reading.type, reading.zone_id,
+                   rollups.bucket_start(reading.timestamp, granularity), reading.parameter, sign, bin)
+            groups[key] += 1
+    return groups
+
+
+def add_readings(db: Session, readings: Iterable["rollups.Reading"]):
+    """Count readings in their sketch bins with one upsert (caller commits)"""
+    add_counts(db, _group(readings))
+
+
+def add_counts(db: Session, groups: Dict[Tuple, int]):
+    """Add counts per sketch bin key (granularity, type, zone_id, bucket, parameter, sign, bin) (caller commits)"""
+    if not groups:
+        return
+
+    table = models.IndicatorSketchBin.__table__
+    stmt = dialect_insert(db.bind, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(KEY_FIELDS),
+        set_={"count": table.c["count"] + stmt.excluded["count"]}
+    )
+    db.execute(stmt, [dict(zip(KEY_FIELDS, key), count=count) for key, count in groups.items()])
+
+
+def remove_readings(db: Session, readings: Iterable["rollups.Reading"]):
+    """Uncount readings from their sketch bins (caller commits)"""
+    groups = _group(readings)
+    if not groups:
+        return
+
+    table = models.IndicatorSketchBin.__table__
+    key_clause = and_(*(table.c[field] == bindparam(f"k_{field}") for field in KEY_FIELDS))
+    keys = [{f"k_{field}": value for field, value in zip(KEY_FIELDS, key)} for key in groups]
+    db.execute(
+        update(table).where(key_clause).values(count=table.c["count"] - bindparam("d_count")),
+        [dict(params, d_count=count) for params, count in zip(keys, groups.values())]
+    )
+    db.execute(delete(table).where(key_clause, table.c["count"] <= 0), keys)
+
+
+def rebuild_sketches(db: Session, batch_size: int = 10000) -> int:
+    """Recompute all sketch bins from the indicators table (caller commits), returns the number of rows"""
+    indicator = models.Indicator
+    table = models.IndicatorSketchBin.__table__
+
+    db.execute(delete(table))
+
+    rows = db.execute(
+        select(indicator.zone_id, indicator.type, indicator.parameter, indicator.timestamp, indicator.value)
+        .execution_options(yield_per=batch_size)
+    )
+    groups = _group(rollups.reading_of(row) for row in rows)
+
+    items = [dict(zip(KEY_FIELDS, key), count=count) for key, count in groups.items()]
+    for start in range(0, len(items), batch_size):
+        db.execute(table.insert(), items[start:start + batch_size])
+    return len(items)
+
+
+def sketches(
+    db: Session,
+    group_by: Sequence[str] = (),
+    bucket: Optional[str] = None,
+    types: Optional[Sequence[str]] = None,
+    zone_ids: Optional[Sequence[int]] = None,
+    parameters: Optional[Sequence[str]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+) -> Dict[Tuple, Sketch]:
+    """
+    Sketches of indicator values with the same grouping, bucketing and range
+    rules as rollups.aggregate: whole buckets are merged from the stored bins
+    in SQL, the partial hours at the edges of the range from raw values.
+    """
+    for field in group_by:
+        if field not in rollups.GROUP_FIELDS:
+            raise ValueError(f"Cannot group by {field}")
+    from_date = naive_datetime(from_date) if from_date else None
+    to_date = naive_datetime(to_date) if to_date else None
+
+    results: Dict[Tuple, Sketch] = defaultdict(Sketch)
+    bins = models.IndicatorSketchBin
+    indicator = models.Indicator
+
+    for source, start, end in rollups._segments(from_date, to_date, bucket):
+        if source == "raw":
+            query = select(indicator.zone_id, indicator.type,
+                           func.coalesce(indicator.parameter, "").label("parameter"),
+                           indicator.timestamp, indicator.value)
+            query = query.where(indicator.timestamp >= start, indicator.timestamp < end)
+            if types:
+                query = query.where(indicator.type.in_(types))
+            if zone_ids:
+                query = query.where(indicator.zone_id.in_(zone_ids))
+            if parameters:
+                query = query.where(func.coalesce(indicator.parameter, "").in_(parameters))
+            for row in db.execute(query):
+                key = tuple(getattr(row, field) for field in group_by)
+                if bucket:
+                    key += (rollups.bucket_start(row.timestamp, bucket),)
+                results[key].add(float(row.value))
+            continue
+
+        columns = [getattr(bins, field) for field in group_by]
+        if bucket:
+            columns.append(bins.bucket)
+        query = select(
+            *columns, bins.sign, bins.bin, func.sum(bins.count).label("count")
+        ).where(bins.granularity == source)
+        if types:
+            query = query.where(bins.type.in_(types))
+        if zone_ids:
+            query = query.where(bins.zone_id.in_(zone_ids))
+        if parameters:
+            query = query.where(bins.parameter.in_(parameters))
+        if start is not None:
+            query = query.where(bins.bucket >= start)
+        if end is not None:
+            query = query.where(bins.bucket < end)
+        query = query.group_by(*columns, bins.sign, bins.bin)
+
+        for row in db.execute(query):
+            if not row.count:
+                continue
+            key = tuple(getattr(row, field) for field in group_by)
+            if bucket:
+                key += (rollups.bucket_start(row.bucket, bucket),)
+            results[key].add_bin(row.sign, row.bin, row.count)
+
+    return dict(results)
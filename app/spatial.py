@@ -0,0 +1,212 @@
+"""
+In-memory spatial index of zones
+
+Zones store their parsed position (latitude/longitude, and the bounding box of
+polygon geometries) next to geom. ZoneGrid buckets them in fixed-size
+latitude/longitude cells, so bounding box and nearest-zone lookups only visit
+the cells around the query instead of every zone. zone_index keeps one grid per
+process and rebuilds it when the write generation of zones changes, like the
+count cache (see app.cache).
+"""
+
+import math
+from collections import defaultdict
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app import models
+from app.cache import get_generations
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Cell size in degrees (about 55 km of latitude)
+GRID_CELL_DEGREES = 0.5
+
+
+class ZonePosition(NamedTuple):
+    id: int
+    latitude: float
+    longitude: float
+    south: float
+    west: float
+    north: float
+    east: float
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_bbox(value: str) -> Tuple[float, float, float, float]:
+    """Parse "west,south,east,north" (GeoJSON order), raises ValueError"""
+    try:
+        west, south, east, north = (float(part) for part in value.split(","))
+    except ValueError:
+        raise ValueError("bbox must be west,south,east,north")
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("bbox out of range, expected -180 <= west, east <= 180 and -90 <= south <= north <= 90")
+    return west, south, east, north
+
+
+class ZoneGrid:
+    """Uniform grid over latitude/longitude holding zone positions"""
+
+    def __init__(self, positions: Iterable[ZonePosition], cell_degrees: float = GRID_CELL_DEGREES):
+        self.cell = cell_degrees
+        self.lon_cells = math.ceil(360 / cell_degrees)
+        self.lat_cells = math.ceil(180 / cell_degrees)
+        self.positions: Dict[int, ZonePosition] = {}
+        # Zones per cell overlapped by their bounding box, and per cell of their centre
+        self._extents: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self._points: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for position in positions:
+            self.positions[position.id] = position
+            self._points[self._cell_of(position.latitude, position.longitude)].append(position.id)
+            for cell in self._cells(position.west, position.south, position.east, position.north):
+                self._extents[cell].append(position.id)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def _row(self, latitude: float) -> int:
+        return min(int((latitude + 90) // self.cell), self.lat_cells - 1)
+
+    def _column(self, longitude: float) -> int:
+        return int((longitude + 180) // self.cell) % self.lon_cells
+
+    def _cell_of(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return self._row(latitude), self._column(longitude)
+
+    def _columns(self, west: float, east: float) -> Iterable[int]:
+        first, last = self._column(west), self._column(east)
+        if west > east:
+            # Crosses the antimeridian
+            return list(range(first, self.lon_cells)) + list(range(0, last + 1))
+        if last < first:
+            # east == 180 wraps to column 0
+            last = self.lon_cells - 1
+        return range(first, last + 1)
+
+    def _cells(self, west: float, south: float, east: float, north: float) -> Iterable[Tuple[int, int]]:
+        columns = list(self._columns(west, east))
+        for row in range(self._row(south), self._row(north) + 1):
+            for column in columns:
+                yield row, column
+
+    def in_bbox(self, west: float, south: float, east: float, north: float) -> List[int]:
+        """Ids of the zones whose extent intersects the box, in id order"""
+        # Longitude spans of the box, two when it crosses the antimeridian
+        spans = [(west, 180.0), (-180.0, east)] if west > east else [(west, east)]
+        found: Set[int] = set()
+        for row, column in self._cells(west, south, east, north):
+            for zone_id in self._extents.get((row, column), ()):
+                if zone_id in found:
+                    continue
+                position = self.positions[zone_id]
+                if position.south > north or position.north < south:
+                    continue
+                if any(position.west <= span_east and position.east >= span_west
+                       for span_west, span_east in spans):
+                    found.add(zone_id)
+        return sorted(found)
+
+    def _ring(self, row: int, column: int, radius: int) -> Iterable[Tuple[int, int]]:
+        """Cells at Chebyshev distance radius from (row, column), longitude wraps around"""
+        columns = range(column - radius, column + radius + 1)
+        seen: Set[Tuple[int, int]] = set()
+        for r in range(row - radius, row + radius + 1):
+            if not 0 <= r < self.lat_cells:
+                continue
+            edge = r in (row - radius, row + radius)
+            for c in (columns if edge else (column - radius, column + radius)):
+                cell = (r, c % self.lon_cells)
+                if cell not in seen:
+                    seen.add(cell)
+                    yield cell
+
+    def nearest(self, latitude: float, longitude: float, k: int = 5) -> List[Tuple[int, float]]:
+        """
+        The k zones closest to a point, as (id, distance_km) sorted by distance.
+
+        Rings of cells are visited outwards from the point's cell until the
+        k-th distance found is smaller than anything the next ring can hold.
+        """
+        if k <= 0 or not self.positions:
+            return []
+        row, column = self._cell_of(latitude, longitude)
+        candidates: List[Tuple[float, int]] = []
+        visited = 0
+        max_radius = max(self.lat_cells, self.lon_cells // 2 + 1)
+        for radius in range(max_radius + 1):
+            for cell in self._ring(row, column, radius):
+                for zone_id in self._points.get(cell, ()):
+                    position = self.positions[zone_id]
+                    candidates.append((haversine_km(latitude, longitude, position.latitude, position.longitude), zone_id))
+                    visited += 1
+            if visited == len(self.positions):
+                break
+            if len(candidates) >= k:
+                candidates.sort()
+                del candidates[k:]
+                # Zones outside this ring are at least radius cells away in latitude or in
+                # longitude; the latter is bounded by the distance to that meridian
+                spread = radius * self.cell
+                lat_bound = spread * KM_PER_DEGREE
+                lon_bound = EARTH_RADIUS_KM * math.asin(
+                    math.cos(math.radians(latitude)) * math.sin(math.radians(min(spread, 90.0)))
+                )
+                if candidates[-1][0] <= min(lat_bound, lon_bound):
+                    break
+        candidates.sort()
+        return [(zone_id, distance) for distance, zone_id in candidates[:k]]
+
+
+def _load_positions(db: Session) -> List[ZonePosition]:
+    zone = models.Zone
+    rows = db.execute(
+        select(zone.id, zone.latitude, zone.longitude, zone.min_lat, zone.min_lon, zone.max_lat, zone.max_lon)
+        .where(zone.latitude.is_not(None))
+    )
+    return [
+        ZonePosition(row.id, row.latitude, row.longitude,
+                     row.min_lat if row.min_lat is not None else row.latitude,
+                     row.min_lon if row.min_lon is not None else row.longitude,
+                     row.max_lat if row.max_lat is not None else row.latitude,
+                     row.max_lon if row.max_lon is not None else row.longitude)
+        for row in rows
+    ]
+
+
+class ZoneIndex:
+    """The current process's ZoneGrid, rebuilt when zones are written"""
+
+    def __init__(self):
+        self._grid: Optional[ZoneGrid] = None
+        self._version: Optional[Tuple[int, Optional[datetime]]] = None
+        self._lock = Lock()
+
+    def get(self, db: Session) -> ZoneGrid:
+        # The write time tells a recreated database apart from the one the grid was built from
+        version = get_generations(db, ["zones"])["zones"]
+        with self._lock:
+            if self._grid is not None and self._version == version:
+                return self._grid
+        grid = ZoneGrid(_load_positions(db))
+        with self._lock:
+            self._grid, self._version = grid, version
+        return grid
+
+    def clear(self):
+        with self._lock:
+            self._grid, self._version = None, None
+
+
+zone_index = ZoneIndex()
@@ -0,0 +1,340 @@
+"""
+Time-bucketed series of indicator values
+
+series() aggregates indicators into buckets of any width from 5 minutes to one
+month, per (zone, type, parameter) group. Bucket widths that are whole hours
+or days (and months) are merged from the hour/day rollups; shorter ones are
+grouped in SQL on the raw table with a bucket expression that compiles on
+SQLite and PostgreSQL (see app.database.epoch_seconds).
+
+Buckets are aligned on 1970-01-01 for fixed widths, on Mondays for weeks and
+on the first of the month for months. Quantile aggregations (p50, p95...) are
+read from the sketches stored with the rollups (see app.sketches). Ranges
+held by the hot window (see app.hotwindow) are aggregated from it instead.
+"""
+
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app import downsampling, models, rollups, sketches
+from app.hotwindow import hot_window
+from app.database import epoch_seconds, naive_datetime
+
+AGGREGATIONS = ("avg", "sum", "min", "max", "count")
+FILLS = ("none", "null", "zero")
+
+EPOCH = datetime(1970, 1, 1)
+# First Monday after the epoch, weeks start on Mondays
+WEEK_ORIGIN = datetime(1970, 1, 5)
+
+MIN_WIDTH = timedelta(minutes=5)
+MAX_WIDTH = timedelta(days=31)
+# Upper bound on the number of buckets returned, gap filling included
+MAX_BUCKETS = 10000
+
+_UNITS = {"min": timedelta(minutes=1), "h": timedelta(hours=1), "d": timedelta(days=1), "w": timedelta(weeks=1)}
+_BUCKET_PATTERN = re.compile(r"^(\d+)(min|h|d|w|mo)$")
+_QUANTILE_PATTERN = re.compile(r"^p(\d+(\.\d+)?)$")
+
+
+class Bucket(NamedTuple):
+    """Bucket width: a fixed timedelta, or a number of calendar months"""
+    spec: str
+    width: Optional[timedelta]
+    months: int = 0
+
+    def floor(self, timestamp: datetime) -> datetime:
+        if self.months:
+            index = (timestamp.year * 12 + timestamp.month - 1) // self.months * self.months
+            return datetime(index // 12, index % 12 + 1, 1)
+        origin = WEEK_ORIGIN if self.width % timedelta(weeks=1) == timedelta(0) else EPOCH
+        return timestamp - (timestamp - origin) % self.width
+
+    def next(self, start: datetime) -> datetime:
+        if self.months:
+            index = start.year * 12 + start.month - 1 + self.months
+            return datetime(index // 12, index % 12 + 1, 1)
+        return start + self.width
+
+    @property
+    def source(self) -> str:
+        """Where buckets of this width are computed from: "day", "hour" or "raw" """
+        if self.months or self.width % timedelta(days=1) == timedelta(0):
+            return "day"
+        if self.width % timedelta(hours=1) == timedelta(0):
+            return "hour"
+        return "raw"
+
+
+def parse_bucket(spec: str) -> Bucket:
+    """Parse a bucket width such as 5min, 15min, 1h, 6h, 1d, 1w or 1mo, raises ValueError"""
+    match = _BUCKET_PATTERN.match(spec.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError("bucket must be a number followed by min, h, d, w or mo (e.g. 15min, 1h, 1d, 1mo)")
+    count, unit = int(match.group(1)), match.group(2)
+    if unit == "mo":
+        if count != 1:
+            raise ValueError("bucket cannot be wider than 1mo")
+        return Bucket(spec, None, months=1)
+    width = count * _UNITS[unit]
+    if width < MIN_WIDTH or width > MAX_WIDTH:
+        raise ValueError("bucket must be between 5min and 1mo")
+    if width % MIN_WIDTH:
+        raise ValueError("bucket must be a multiple of 5min")
+    return Bucket(spec, width)
+
+
+def quantile_of(aggregation: str) -> Optional[float]:
+    """The quantile of a pNN aggregation (p95 -> 0.95), None for other aggregations"""
+    match = _QUANTILE_PATTERN.match(aggregation)
+    if not match or float(match.group(1)) > 100:
+        return None
+    return float(match.group(1)) / 100
+
+
+def _raw_columns(group_by: Sequence[str]) -> list:
+    indicator = models.Indicator
+    fields = {
+        "zone_id": indicator.zone_id,
+        "type": indicator.type,
+        "parameter": func.coalesce(indicator.parameter, ""),
+    }
+    return [fields[field].label(field) for field in group_by]
+
+
+def _raw_filters(types, zone_ids, parameters, from_date, to_date) -> list:
+    indicator = models.Indicator
+    filters = []
+    if types:
+        filters.append(indicator.type.in_(types))
+    if zone_ids:
+        filters.append(indicator.zone_id.in_(zone_ids))
+    if parameters:
+        filters.append(func.coalesce(indicator.parameter, "").in_(parameters))
+    if from_date is not None:
+        filters.append(indicator.timestamp >= from_date)
+    if to_date is not None:
+        filters.append(indicator.timestamp <= to_date)
+    return filters
+
+
+def _raw_buckets(
+    db: Session,
+    bucket: Bucket,
+    group_by: Sequence[str],
+    types: Optional[Sequence[str]],
+    zone_ids: Optional[Sequence[int]],
+    parameters: Optional[Sequence[str]],
+    from_date: Optional[datetime],
+    to_date: Optional[datetime],
+) -> Dict[Tuple, rollups.Agg]:
+    """Aggregate indicators into sub-hour buckets in SQL"""
+    indicator = models.Indicator
+    width = int(bucket.width.total_seconds())
+    seconds = epoch_seconds(indicator.timestamp)
+    start = (seconds - seconds % width).label("bucket_start")
+    columns = _raw_columns(group_by)
+
+    query = select(
+        *columns,
+        start,
+        func.count().label("count"),
+        func.sum(indicator.value).label("sum"),
+        func.min(indicator.value).label("min"),
+        func.max(indicator.value).label("max"),
+    ).where(*_raw_filters(types, zone_ids, parameters, from_date, to_date)).group_by(*columns, start)
+
+    results: Dict[Tuple, rollups.Agg] = {}
+    for row in db.execute(query):
+        key = tuple(getattr(row, field) for field in group_by)
+        results[key + (EPOCH + timedelta(seconds=row.bucket_start),)] = rollups.Agg(
+            row.count, float(row.sum), float(row.min), float(row.max)
+        )
+    return results
+
+
+def aggregate_buckets(
+    db: Session,
+    bucket: Bucket,
+    group_by: Sequence[str] = ("type",),
+    types: Optional[Sequence[str]] = None,
+    zone_ids: Optional[Sequence[int]] = None,
+    parameters: Optional[Sequence[str]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+) -> Dict[Tuple, Dict[datetime, rollups.Agg]]:
+    """Aggregates per group key (fields of group_by) and bucket start"""
+    for field in group_by:
+        if field not in rollups.GROUP_FIELDS:
+            raise ValueError(f"Cannot group by {field}")
+    if bucket.source == "raw":
+        flat = _raw_buckets(db, bucket, group_by, types, zone_ids, parameters, from_date, to_date)
+    else:
+        flat = rollups.aggregate(
+            db, group_by=group_by, bucket=bucket.source, types=types, zone_ids=zone_ids,
+            parameters=parameters, from_date=from_date, to_date=to_date
+        )
+
+    # Merge hour/day buckets into the requested width
+    groups: Dict[Tuple, Dict[datetime, rollups.Agg]] = defaultdict(dict)
+    for key, agg in flat.items():
+        start = bucket.floor(key[-1])
+        target = groups[key[:-1]].get(start)
+        if target is None:
+            target = groups[key[:-1]][start] = rollups.Agg()
+        target.merge(agg.count, agg.sum, agg.min, agg.max)
+    return dict(groups)
+
+
+def bucket_sketches(
+    db: Session,
+    bucket: Bucket,
+    group_by: Sequence[str] = ("type",),
+    types: Optional[Sequence[str]] = None,
+    zone_ids: Optional[Sequence[int]] = None,
+    parameters: Optional[Sequence[str]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+) -> Dict[Tuple, Dict[datetime, sketches.Sketch]]:
+    """Quantile sketches per group key and bucket start, like aggregate_buckets"""
+    if bucket.source == "raw":
+        indicator = models.Indicator
+        query = select(*_raw_columns(group_by), indicator.timestamp, indicator.value).where(*_raw_filters(types, zone_ids, parameters, from_date, to_date))
+        flat: Dict[Tuple, sketches.Sketch] = defaultdict(sketches.Sketch)
+        for row in db.execute(query):
+            key = tuple(getattr(row, field) for field in group_by)
+            flat[key + (bucket.floor(row.timestamp),)].add(float(row.value))
+    else:
+        flat = sketches.sketches(
+            db, group_by=group_by, bucket=bucket.source, types=types, zone_ids=zone_ids,
+            parameters=parameters, from_date=from_date, to_date=to_date
+        )
+
+    groups: Dict[Tuple, Dict[datetime, sketches.Sketch]] = defaultdict(dict)
+    for key, sketch in flat.items():
+        start = bucket.floor(key[-1])
+        target = groups[key[:-1]].get(start)
+        if target is None:
+            target = groups[key[:-1]][start] = sketches.Sketch()
+        target.merge(sketch)
+    return dict(groups)
+
+
+def _split(flat: Dict[Tuple, object]) -> Dict[Tuple, Dict[datetime, object]]:
+    """{group key + (bucket start,): value} to {group key: {bucket start: value}}"""
+    groups: Dict[Tuple, Dict[datetime, object]] = defaultdict(dict)
+    for key, value in flat.items():
+        groups[key[:-1]][key[-1]] = value
+    return dict(groups)
+
+
+def _value(agg: Optional[rollups.Agg], aggregation: str, fill: str,
+           sketch: Optional[sketches.Sketch] = None, quantile: Optional[float] = None):
+    if agg is None or not agg.count:
+        return 0 if fill == "zero" else None
+    if quantile is not None:
+        return sketch.quantile(quantile, agg.min, agg.max) if sketch is not None else None
+    if aggregation == "avg":
+        return agg.average
+    return getattr(agg, aggregation)
+
+
+def series(
+    db: Session,
+    bucket: Bucket,
+    aggregation: str = "avg",
+    group_by: Sequence[str] = ("type",),
+    types: Optional[Sequence[str]] = None,
+    zone_ids: Optional[Sequence[int]] = None,
+    parameters: Optional[Sequence[str]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    fill: str = "none",
+    max_points: Optional[int] = None,
+    downsample: str = "lttb",
+) -> dict:
+    """
+    Bucketed series, one per group, aligned on shared labels (bucket starts).
+
+    With fill "none" labels are the buckets where any series has data and
+    series hold null elsewhere; "null" and "zero" list every bucket of the
+    range (from/to, or the data when unbounded) and fill the gaps with
+    null or 0. With max_points, longer series are downsampled with the
+    downsample method (see app.downsampling) and keep shared labels.
+    Raises ValueError on invalid arguments or too many buckets.
+    """
+    quantile = quantile_of(aggregation)
+    if aggregation not in AGGREGATIONS and quantile is None:
+        raise ValueError(f"Invalid aggregation, expected one of: {', '.join(AGGREGATIONS)} or a percentile such as p95")
+    if fill not in FILLS:
+        raise ValueError(f"Invalid fill, expected one of: {', '.join(FILLS)}")
+    if downsample not in downsampling.METHODS:
+        raise ValueError(f"Invalid downsampling method, expected one of: {', '.join(downsampling.METHODS)}")
+    if max_points is not None and max_points < 2:
+        raise ValueError("max_points must be at least 2")
+    from_date = naive_datetime(from_date) if from_date else None
+    to_date = naive_datetime(to_date) if to_date else None
+
+    window = hot_window.snapshot(db, from_date)
+    if window is not None:
+        flat, values = window.aggregate(group_by, bucket, types, zone_ids, parameters, from_date, to_date,
+                                        with_quantiles=quantile is not None)
+        groups, quantile_sketches = _split(flat), _split(values or {})
+        source = "memory"
+    else:
+        groups = aggregate_buckets(db, bucket, group_by, types, zone_ids, parameters, from_date, to_date)
+        quantile_sketches = {}
+        if quantile is not None:
+            quantile_sketches = bucket_sketches(db, bucket, group_by, types, zone_ids, parameters, from_date, to_date)
+        source = bucket.source
+
+    starts = sorted({start for buckets in groups.values() for start in buckets})
+    if fill != "none" and (starts or (from_date and to_date)):
+        first = bucket.floor(from_date) if from_date else starts[0]
+        last = bucket.floor(to_date) if to_date else starts[-1]
+        starts = []
+        start = first
+        while start <= last:
+            starts.append(start)
+            if len(starts) > MAX_BUCKETS:
+                break
+            start = bucket.next(start)
+    if len(starts) > MAX_BUCKETS:
+        raise ValueError(f"More than {MAX_BUCKETS} buckets, use a wider bucket or a shorter range")
+
+    result_series: List[dict] = []
+    for key in sorted(groups, key=lambda key: tuple(str(part) for part in key)):
+        buckets = groups[key]
+        item = dict(zip(group_by, key))
+        if "parameter" in item:
+            item["parameter"] = item["parameter"] or None
+        key_sketches = quantile_sketches.get(key, {})
+        item["data"] = [
+            _value(buckets.get(start), aggregation, fill, key_sketches.get(start), quantile)
+            for start in starts
+        ]
+        result_series.append(item)
+
+    downsampled = False
+    if max_points is not None:
+        seconds = (np.array(starts, dtype="datetime64[us]") - np.datetime64(EPOCH, "us")) / np.timedelta64(1, "s")
+        keep = downsampling.select_points(seconds, [item["data"] for item in result_series], max_points, downsample)
+        if keep is not None:
+            downsampled = True
+            starts = [starts[index] for index in keep]
+            for item in result_series:
+                item["data"] = [item["data"][index] for index in keep]
+
+    return {
+        "bucket": bucket.spec,
+        "aggregation": aggregation,
+        "group_by": list(group_by),
+        "source": source,
+        "downsampling": downsample if downsampled else None,
+        "labels": [start.isoformat() for start in starts],
+        "series": result_series,
+    }
@@ -0,0 +1,192 @@
+"""
+Benchmark Authenticated Request Latency
+
+Starts the API with uvicorn in a subprocess and fires concurrent authenticated
+GET requests at it, then prints latency percentiles. With --mode blocking the
+user lookup of get_current_user is swapped for the former synchronous query
+run directly on the event loop, to compare both implementations on the same
+database.
+
+A local SQLite query takes microseconds, which hides what blocking the loop
+costs against a database over the network; --db-latency adds a delay to every
+statement, in the thread that runs it, to model that round trip.
+
+By default each of the concurrent clients sends its next request as soon as
+the previous one returns, which measures throughput but not tail latency: a
+faster server gets more requests, and on a machine shared with the client more
+client work competes with it. --rate sends requests at a fixed rate instead
+(still over at most --concurrency connections), the same load for both modes,
+and measures each latency from the time its request was due.
+
+Usage:
+    python benchmark_auth.py [--mode async|blocking] [--requests 2000] [--concurrency 50]
+                             [--rate REQ_PER_S] [--path /users/me] [--db-latency MS] [--port 8765]
+"""
+
+import sys
+import os
+import argparse
+import asyncio
+import statistics
+import subprocess
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import Depends, HTTPException, status
+from jose import JWTError, jwt
+from sqlalchemy import event
+from app.database import SessionLocal, engine, async_engine, upgrade_schema
+from app.models import User
+from app.auth import ALGORITHM, SECRET_KEY, create_access_token, get_current_user, oauth2_scheme
+
+BENCH_USERNAME = "bench_user"
+
+
+async def blocking_get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    """The previous get_current_user: a sync query on the event loop"""
+    try:
+        username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        username = None
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+    finally:
+        db.close()
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    return user
+
+
+def add_db_latency(latency: float):
+    """Delay every SQLite statement by latency seconds, on the thread executing it"""
+    def delay(statement):
+        time.sleep(latency)
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.set_trace_callback(delay)
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def on_async_connect(dbapi_connection, connection_record):
+        # aiosqlite runs statements on its own thread, the delay must happen there too
+        connection = dbapi_connection.driver_connection
+        dbapi_connection.await_(connection._execute(connection._conn.set_trace_callback, delay))
+
+    # Connections opened at import time (schema upgrade) would not get the delay
+    engine.dispose()
+
+
+def ensure_user():
+    """Create the benchmark user if needed"""
+    upgrade_schema()
+    db = SessionLocal()
+    try:
+        if not db.query(User).filter(User.username == BENCH_USERNAME).first():
+            db.add(User(email="bench@example.com", username=BENCH_USERNAME, hashed_password="x"))
+            db.commit()
+    finally:
+        db.close()
+
+
+def serve(args):
+    """Run the API in this process (the --serve side of the benchmark)"""
+    import uvicorn
+    from app.main import app
+
+    if args.db_latency:
+        add_db_latency(args.db_latency / 1000)
+    if args.mode == "blocking":
+        app.dependency_overrides[get_current_user] = blocking_get_current_user
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+async def run(base_url: str, path: str, total: int, concurrency: int, rate: float = 0.0):
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': BENCH_USERNAME})}"}
+    latencies = []
+    remaining = iter(range(total))
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker(count=None):
+            # Closed loop: each worker sends its next request as soon as the previous one returns
+            for _ in (range(count) if count else remaining):
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        async def request_at(due: float):
+            # Open loop: a request waiting for a connection is late, its latency counts from when it was due
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            response = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - due)
+            response.raise_for_status()
+
+        # Warm up connections
+        await asyncio.gather(*(worker(1) for _ in range(concurrency)))
+        latencies.clear()
+
+        started = time.perf_counter()
+        if rate:
+            await asyncio.gather(*(request_at(started + i / rate) for i in range(total)))
+        else:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return latencies, elapsed
+
+
+def wait_for_server(base_url: str, server: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The API server exited during startup")
+        try:
+            httpx.get(base_url + "/health", timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError("The API server did not start in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark authenticated request latency")
+    parser.add_argument("--mode", choices=("async", "blocking"), default="async")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=0.0, help="Requests per second (open loop), 0 for closed loop")
+    parser.add_argument("--path", default="/users/me")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="Delay per SQL statement, in ms")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    ensure_user()
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", *sys.argv[1:]])
+    try:
+        wait_for_server(base_url, server)
+        latencies, elapsed = asyncio.run(run(base_url, args.path, args.requests, args.concurrency, args.rate))
+    finally:
+        server.terminate()
+        server.wait()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    load = f"{args.rate:g} req/s" if args.rate else "closed loop"
+    print(f"📊 {args.mode}: {args.requests} x GET {args.path}, concurrency {args.concurrency}, {load}, "
+          f"db latency {args.db_latency:g} ms")
+    print(f"   throughput: {args.requests / elapsed:.0f} req/s")
+    print(f"   p50: {quantiles[49] * 1000:.1f} ms   p95: {quantiles[94] * 1000:.1f} ms   "
+          f"p99: {quantiles[98] * 1000:.1f} ms   max: {max(latencies) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
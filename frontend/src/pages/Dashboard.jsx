@@ -113,7 +113,7 @@ const COLORS = ['#3b82f6', '#ef4444', '#f59e0b', '#10b981', '#8b5cf6', '#ec4899'
 
 export default function Dashboard() {
     const [stats, setStats] = useState([]);
-    const [zones, setZones] = useState([]);
+    const [zoneCount, setZoneCount] = useState(0);
     const [co2Trend, setCo2Trend] = useState([]);
     const [airQualityTrend, setAirQualityTrend] = useState([]);
     const [zoneComparison, setZoneComparison] = useState([]);
@@ -124,54 +124,34 @@ export default function Dashboard() {
     useEffect(() => {
         const fetchData = async () => {
             try {
-                // Fetch all data in parallel
-                const [
-                    summaryRes,
-                    zonesRes,
-                    co2TrendRes,
-                    airQualityRes,
-                    zoneComparisonRes,
-                    indicatorsRes
-                ] = await Promise.all([
-                    api.get('/stats/summary'),
-                    api.get('/zones/', { params: { limit: 1000 } }),
-                    api.get('/stats/co2/trend?period=daily'),
-                    api.get('/stats/air/averages'),
-                    api.get('/stats/air/averages'),
-                    api.get('/indicators/?limit=10&sort_by=timestamp&order=desc')
-                ]);
+                // Everything the dashboard shows in one request
+                const { data } = await api.get('/stats/dashboard', { params: { period: 'daily', recent: 10 } });
 
-                setStats(summaryRes.data);
-                // Handle paginated zones response
-                const zonesData = zonesRes.data;
-                if (zonesData.items) {
-                    setZones(zonesData.items);
-                } else {
-                    setZones(Array.isArray(zonesData) ? zonesData : []);
-                }
+                setStats(data.summary);
+                setZoneCount(data.zone_count);
 
                 // Format CO2 trend data
-                const co2Data = co2TrendRes.data.labels.map((label, index) => ({
+                const co2Data = data.co2_trend.labels.map((label, index) => ({
                     name: label,
-                    value: co2TrendRes.data.series[index] || 0
+                    value: data.co2_trend.series[index] || 0
                 }));
                 setCo2Trend(co2Data.slice(-30)); // Last 30 days
 
                 // Format air quality trend (use same data but different format)
-                const airData = airQualityRes.data.labels.map((label, index) => ({
+                const airData = data.air_averages.labels.map((label, index) => ({
                     name: label,
-                    value: airQualityRes.data.series[index] || 0
+                    value: data.air_averages.series[index] || 0
                 }));
                 setAirQualityTrend(airData);
 
                 // Zone comparison data
-                setZoneComparison(zoneComparisonRes.data.labels.map((label, index) => ({
+                setZoneComparison(data.air_averages.labels.map((label, index) => ({
                     name: label,
-                    value: zoneComparisonRes.data.series[index] || 0
+                    value: data.air_averages.series[index] || 0
                 })));
 
                 // Type distribution for pie chart
-                const distribution = summaryRes.data.map(stat => ({
+                const distribution = data.summary.map(stat => ({
                     name: stat.type.replace('_', ' ').toUpperCase(),
                     value: stat.count,
                     average: stat.average
@@ -179,8 +159,7 @@ export default function Dashboard() {
                 setTypeDistribution(distribution);
 
                 // Recent indicators
-                const indicatorsData = indicatorsRes.data.items || indicatorsRes.data;
-                setRecentIndicators(indicatorsData.slice(0, 10));
+                setRecentIndicators(data.recent_indicators);
             } catch (error) {
                 console.error('Error fetching dashboard data:', error);
             } finally {
@@ -279,7 +258,7 @@ export default function Dashboard() {
                     <div className="flex items-center justify-between">
                         <div>
                             <p className="text-sm font-semibold text-gray-600 mb-1">Total Zones</p>
-                            <p className="text-3xl font-bold text-gray-900">{zones.length}</p>
+                            <p className="text-3xl font-bold text-gray-900">{zoneCount}</p>
                         </div>
                         <Globe className="h-10 w-10 text-blue-500" />
                     </div>
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { MapContainer, TileLayer, Marker, Popup, Circle } from 'react-leaflet';
+import { MapContainer, TileLayer, Marker, Popup, Circle, useMapEvents } from 'react-leaflet';
 import { Icon } from 'leaflet';
 import 'leaflet/dist/leaflet.css';
 import api from '../api/axios';
@@ -35,63 +35,74 @@ const getIndicatorIcon = (type) => {
     return iconConfig[type] || { color: '#6b7280', icon: Activity };
 };
 
+// Visible area as the API's bbox (west,south,east,north), null when the whole world is in view
+const toBbox = (bounds) => {
+    const west = bounds.getWest();
+    const east = bounds.getEast();
+    if (east - west >= 360) return null;
+    const wrap = (lon) => ((((lon + 180) % 360) + 360) % 360) - 180;
+    const south = Math.max(-90, bounds.getSouth());
+    const north = Math.min(90, bounds.getNorth());
+    return [wrap(west), south, wrap(east), north].map(v => v.toFixed(4)).join(',');
+};
+
+// Reports the visible area whenever the map stops moving
+function ViewportWatcher({ onChange }) {
+    useMapEvents({
+        moveend: (e) => onChange(toBbox(e.target.getBounds())),
+    });
+    return null;
+}
+
 export default function Map() {
     const [zones, setZones] = useState([]);
-    const [indicators, setIndicators] = useState([]);
     const [zoneStats, setZoneStats] = useState({});
     const [loading, setLoading] = useState(true);
     const [selectedType, setSelectedType] = useState('');
     const [mapReady, setMapReady] = useState(false);
+    // Only the zones in view are loaded once the map has been moved
+    const [bbox, setBbox] = useState(null);
+    const [center, setCenter] = useState(null);
 
     useEffect(() => {
         fetchData();
         // Set map ready after a short delay to ensure DOM is ready
         const timer = setTimeout(() => setMapReady(true), 100);
         return () => clearTimeout(timer);
-    }, [selectedType]);
+    }, [selectedType, bbox]);
 
     const fetchData = async () => {
         setLoading(true);
         try {
-            const [zonesRes, indicatorsRes] = await Promise.all([
-                api.get('/zones/', { params: { limit: 1000 } }),
-                api.get('/indicators/', { 
-                    params: { 
-                        limit: 1000,
-                        sort_by: 'timestamp',
-                        order: 'desc',
-                        ...(selectedType && { type: selectedType })
-                    } 
-                })
-            ]);
-
-            // Handle zones
-            const zonesData = zonesRes.data;
-            const zonesList = zonesData.items || (Array.isArray(zonesData) ? zonesData : []);
+            // Zones with their latest indicator per type and parameter, computed server-side
+            const { data: zonesList } = await api.get('/zones/latest', {
+                params: {
+                    ...(selectedType && { type: selectedType }),
+                    ...(bbox && { bbox })
+                }
+            });
             setZones(zonesList);
 
-            // Handle indicators
-            const indicatorsData = indicatorsRes.data.items || indicatorsRes.data || [];
-            setIndicators(indicatorsData);
+            // Center the map on the first zone with coordinates, once
+            const first = zonesList.find(zone => zone.latitude !== null);
+            if (first) {
+                setCenter(current => current || [first.latitude, first.longitude]);
+            }
 
-            // Calculate zone statistics
             const stats = {};
             zonesList.forEach(zone => {
-                const zoneIndicators = indicatorsData.filter(ind => ind.zone_id === zone.id);
+                // Latest reading per type, across its parameters
                 const latestByType = {};
-                
-                zoneIndicators.forEach(ind => {
+                zone.latest.forEach(ind => {
                     if (!latestByType[ind.type] || new Date(ind.timestamp) > new Date(latestByType[ind.type].timestamp)) {
                         latestByType[ind.type] = ind;
                     }
                 });
                 
                 stats[zone.id] = {
-                    total: zoneIndicators.length,
+                    total: zone.count,
                     byType: latestByType,
-                    average: zoneIndicators.length > 0 
-                        ? zoneIndicators.reduce((sum, ind) => sum + ind.value, 0) / zoneIndicators.length 
-                        : 0
+                    average: zone.average ?? 0
                 };
             });
             setZoneStats(stats);
@@ -103,16 +114,6 @@ export default function Map() {
         }
     };
 
-    const parseCoordinates = (geom) => {
-        if (!geom) return null;
-        const parts = geom.split(',');
-        if (parts.length !== 2) return null;
-        const lat = parseFloat(parts[0].trim());
-        const lon = parseFloat(parts[1].trim());
-        if (isNaN(lat) || isNaN(lon)) return null;
-        return [lat, lon];
-    };
-
     const getZoneColor = (zoneId) => {
         const stats = zoneStats[zoneId];
         if (!stats || stats.total === 0) return '#9ca3af'; // gray
@@ -129,12 +130,10 @@ export default function Map() {
         return '#3b82f6'; // default blue
     };
 
-    const validZones = zones.filter(zone => parseCoordinates(zone.geom) !== null);
-    const center = validZones.length > 0 
-        ? parseCoordinates(validZones[0].geom) 
-        : [48.8566, 2.3522]; // Default to Paris
+    // Positions are parsed from geom by the API
+    const validZones = zones.filter(zone => zone.latitude !== null && zone.longitude !== null);
 
-    if (loading && zones.length === 0) {
+    if (loading && center === null) {
         return (
             <div className="flex items-center justify-center h-full">
                 <div className="text-center">
@@ -191,7 +190,7 @@ export default function Map() {
 
             {/* Map Container */}
             <div className="bg-white shadow-sm rounded-xl border border-gray-200 overflow-hidden relative" style={{ height: '600px', width: '100%' }}>
-                {validZones.length === 0 ? (
+                {center === null ? (
                     <div className="flex items-center justify-center h-full">
                         <div className="text-center">
                             <MapIcon className="h-16 w-16 text-gray-400 mx-auto mb-4" />
@@ -206,16 +205,15 @@ export default function Map() {
                         center={center}
                         zoom={6}
                         style={{ height: '100%', width: '100%', zIndex: 0 }}
-                        key={`map-${validZones.length}`}
                     >
+                        <ViewportWatcher onChange={setBbox} />
                         <TileLayer
                             attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
                             url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
                         />
                         
                         {validZones.map((zone) => {
-                            const coords = parseCoordinates(zone.geom);
-                            if (!coords) return null;
+                            const coords = [zone.latitude, zone.longitude];
                             
                             const stats = zoneStats[zone.id] || {};
                             const color = getZoneColor(zone.id);
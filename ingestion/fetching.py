@@ -0,0 +1,114 @@
+"""
+Concurrent fetching for the ingestion scripts
+
+fetch_and_ingest() downloads a list of upstream requests over one
+httpx.AsyncClient, so every request reuses the same keep-alive connection
+pool, with at most INGESTION_CONCURRENCY requests in flight. Responses go
+through a bounded queue to a single writer that runs the database writes in a
+worker thread, one at a time (the session is not thread-safe): the next
+responses are fetched while the previous ones are written, and fetching
+pauses when the writer falls QUEUE_SIZE responses behind.
+
+Paginated requests set next_page: their pages are fetched one after the
+other on the same worker and handed to the writer together, as a list.
+"""
+
+import asyncio
+import os
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional
+import httpx
+
+FETCH_CONCURRENCY = int(os.getenv("INGESTION_CONCURRENCY", "8"))
+FETCH_TIMEOUT = float(os.getenv("INGESTION_TIMEOUT", "30"))
+QUEUE_SIZE = 16
+
+_DONE = object()
+
+
+class FetchJob(NamedTuple):
+    """One upstream request; key is handed back to the writer with the response"""
+    key: Any
+    url: str
+    params: Dict[str, Any]
+    headers: Optional[Dict[str, str]] = None
+    label: str = ""
+    # Params of the page after (params, payload), None after the last page
+    next_page: Optional[Callable[[Dict[str, Any], Any], Optional[Dict[str, Any]]]] = None
+    max_pages: int = 1
+
+
+async def _fetch_worker(client: httpx.AsyncClient, jobs: asyncio.Queue, results: asyncio.Queue):
+    while True:
+        job = await jobs.get()
+        if job is _DONE:
+            return
+        try:
+            pages = []
+            params = job.params
+            while params is not None and len(pages) < max(1, job.max_pages):
+                response = await client.get(job.url, params=params, headers=job.headers)
+                response.raise_for_status()
+                pages.append(response.json())
+                params = job.next_page(params, pages[-1]) if job.next_page else None
+            payload = pages if job.next_page else pages[0]
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"❌ Error fetching {job.label or job.url}: {e}")
+            payload = None
+        await results.put((job, payload))
+
+
+async def fetch_and_ingest_async(
+    jobs: Iterable[FetchJob],
+    write: Callable[[Any, Optional[Any]], Any],
+    concurrency: int = FETCH_CONCURRENCY,
+    timeout: float = FETCH_TIMEOUT,
+    queue_size: int = QUEUE_SIZE,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> int:
+    """
+    Fetch every job and call write(job.key, payload) in a worker thread for
+    each response, in completion order. payload is the decoded JSON (the
+    list of decoded pages when the job has next_page), or None when a request
+    failed. Returns the number of jobs written; an
+    exception raised by write stops the fetches and is re-raised.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return 0
+    concurrency = max(1, min(concurrency, len(jobs)))
+
+    pending: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        pending.put_nowait(job)
+    for _ in range(concurrency):
+        pending.put_nowait(_DONE)
+    results: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits, transport=transport) as client:
+        workers = [asyncio.create_task(_fetch_worker(client, pending, results)) for _ in range(concurrency)]
+
+        async def close_queue():
+            await asyncio.gather(*workers)
+            await results.put(_DONE)
+
+        closer = asyncio.create_task(close_queue())
+        written = 0
+        try:
+            while True:
+                item = await results.get()
+                if item is _DONE:
+                    break
+                job, payload = item
+                await asyncio.to_thread(write, job.key, payload)
+                written += 1
+        finally:
+            for task in workers + [closer]:
+                task.cancel()
+            await asyncio.gather(*workers, closer, return_exceptions=True)
+    return written
+
+
+def fetch_and_ingest(jobs: Iterable[FetchJob], write: Callable[[Any, Optional[Any]], Any], **options) -> int:
+    """Synchronous entry point of fetch_and_ingest_async for the ingestion scripts"""
+    return asyncio.run(fetch_and_ingest_async(jobs, write, **options))
@@ -3,27 +3,85 @@ Mock Data Ingestion Script
 
 Generates realistic mock environmental data for testing purposes.
 Use this when you don't have API keys or want to quickly populate the database.
+
+Any number of zones (the five cities below, then generated ones across France),
+date span and sampling interval can be generated, e.g. for load testing:
+
+    python ingestion/mock_data_ingestion.py --zones 2000 --days 365 --interval 1h
+
+Values are computed with NumPy, one array per series (zone and parameter):
+a daily and a yearly cycle around a base level, times lognormal noise. Each
+series draws from its own generator seeded with (seed, metric, zone), so a
+given seed always produces the same data whatever the batch size.
+
+Rows are written in batches of BATCH_SIZE, each in one transaction with its
+rollups, sketch bins and latest values. Those are aggregated per batch with
+NumPy too and added with one upsert per table (rollups.add_aggregates,
+sketches.add_counts, latest.add_groups): per-reading Python objects would
+cost more than the inserts. Readings already stored are left as they are,
+so re-running with the same arguments adds nothing.
 """
 
-import random
+import math
+import time
 from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 import sys
 import os
 
+import numpy as np
+
 # Add parent directory to path to import app modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.database import SessionLocal, engine, Base
-from app import models, crud, schemas
+from app.database import SessionLocal
+from app import models, crud, latest, rollups, schemas, sketches
+from app.cache import bump_generation
+from app.timeseries import parse_bucket
 
-# Cities and their characteristics
+# Cities and their characteristics (scale: relative size, for energy and CO2)
 CITIES = [
-    {"name": "Paris", "coords": "48.8566,2.3522", "postal": "75000"},
-    {"name": "Lyon", "coords": "45.7640,4.8357", "postal": "69000"},
-    {"name": "Marseille", "coords": "43.2965,5.3698", "postal": "13000"},
-    {"name": "Toulouse", "coords": "43.6047,1.4442", "postal": "31000"},
-    {"name": "Nice", "coords": "43.7102,7.2620", "postal": "06000"},
+    {"name": "Paris", "coords": "48.8566,2.3522", "postal": "75000", "scale": 2.5},
+    {"name": "Lyon", "coords": "45.7640,4.8357", "postal": "69000", "scale": 1.0},
+    {"name": "Marseille", "coords": "43.2965,5.3698", "postal": "13000", "scale": 0.9},
+    {"name": "Toulouse", "coords": "43.6047,1.4442", "postal": "31000", "scale": 0.75},
+    {"name": "Nice", "coords": "43.7102,7.2620", "postal": "06000", "scale": 0.6},
+]
+
+# Generated zones are spread over mainland France
+FRANCE_BOUNDS = {"south": 42.5, "north": 51.0, "west": -4.5, "east": 8.0}
+
+BATCH_SIZE = 50000
+
+
+class Metric(NamedTuple):
+    """One generated parameter: base level per day (or per reading), daily and yearly cycles, noise"""
+    type: str
+    parameter: str
+    unit: str
+    source: int  # Index in create_sources()
+    base: float
+    diurnal: float  # Relative amplitude of the daily cycle
+    peak_hour: float
+    seasonal: float  # Relative amplitude of the yearly cycle, peaking on January 1st (negative: in July)
+    noise: float  # Standard deviation of the log of the noise
+    extra: Dict
+    per_day: bool = False  # base is a daily total, scaled to the sampling interval
+    scaled: bool = False  # base is multiplied by the zone's size
+
+
+METRICS = [
+    Metric("air_quality", "PM2.5", "µg/m³", 0, 18.0, 0.30, 8, 0.35, 0.35, {}),
+    Metric("air_quality", "PM10", "µg/m³", 0, 30.0, 0.25, 8, 0.25, 0.30, {}),
+    Metric("air_quality", "O3", "µg/m³", 0, 60.0, 0.45, 15, -0.35, 0.20, {}),
+    Metric("air_quality", "NO2", "µg/m³", 0, 32.0, 0.40, 8, 0.20, 0.30, {}),
+    Metric("air_quality", "SO2", "µg/m³", 0, 6.0, 0.15, 10, 0.30, 0.40, {}),
+    Metric("energy", "residential", "kWh", 1, 2000.0, 0.35, 19, 0.25, 0.05, {"sector": "residential"},
+           per_day=True, scaled=True),
+    Metric("co2", "transport", "kg", 2, 320.0, 0.30, 8, 0.15, 0.07, {"source": "transport"},
+           per_day=True, scaled=True),
 ]
 
 
@@ -52,205 +110,307 @@ def create_sources(db: Session):
             "limitations": "Mock data for testing only"
         }
     ]
-    
+
     sources = []
     for source_data in sources_data:
         existing = db.query(models.Source).filter(
             models.Source.name == source_data["name"]
         ).first()
-        
+
         if not existing:
             source = crud.create_source(db, schemas.SourceCreate(**source_data))
             print(f"✅ Created source: {source.name}")
             sources.append(source)
         else:
             sources.append(existing)
-    
+
     return sources
 
 
-def create_zones(db: Session):
-    """Create zones for cities"""
-    zones = []
-    for city in CITIES:
-        existing = db.query(models.Zone).filter(
-            models.Zone.name == city["name"]
-        ).first()
-        
-        if not existing:
-            zone_data = schemas.ZoneCreate(
-                name=city["name"],
-                postal_code=city["postal"],
-                geom=city["coords"]
-            )
-            zone = crud.create_zone(db, zone_data)
-            print(f"✅ Created zone: {zone.name}")
-            zones.append(zone)
-        else:
-            zones.append(existing)
-    
-    return zones
-
-
-def generate_air_quality_data(db: Session, zones: list, source: models.Source, days: int = 30):
-    """Generate mock air quality data"""
-    print("\n🌫️  Generating air quality data...")
-    
-    parameters = ["PM2.5", "PM10", "O3", "NO2", "SO2"]
-    count = 0
-    
-    for zone in zones:
-        # Generate hourly data for the past N days
-        for day in range(days):
-            date = datetime.now() - timedelta(days=day)
-            
-            for hour in range(0, 24, 3):  # Every 3 hours
-                timestamp = date.replace(hour=hour, minute=0, second=0, microsecond=0)
-                
-                for param in parameters:
-                    # Generate realistic values based on parameter
-                    if param == "PM2.5":
-                        value = random.uniform(5, 50)  # µg/m³
-                    elif param == "PM10":
-                        value = random.uniform(10, 80)
-                    elif param == "O3":
-                        value = random.uniform(20, 120)
-                    elif param == "NO2":
-                        value = random.uniform(10, 60)
-                    else:  # SO2
-                        value = random.uniform(1, 20)
-                    
-                    indicator_data = schemas.IndicatorCreate(
-                        type="air_quality",
-                        value=round(value, 2),
-                        unit="µg/m³",
-                        timestamp=timestamp,
-                        zone_id=zone.id,
-                        source_id=source.id,
-                        extra_data={"parameter": param}
-                    )
-                    
-                    crud.create_indicator(db, indicator_data)
-                    count += 1
-    
-    print(f"✅ Generated {count} air quality indicators")
-
-
-def generate_energy_data(db: Session, zones: list, source: models.Source, days: int = 30):
-    """Generate mock energy consumption data"""
-    print("\n⚡ Generating energy consumption data...")
-    
-    count = 0
-    
-    for zone in zones:
-        # Generate daily data
-        for day in range(days):
-            date = datetime.now() - timedelta(days=day)
-            timestamp = date.replace(hour=12, minute=0, second=0, microsecond=0)
-            
-            # Energy consumption varies by city size
-            base_consumption = {
-                "Paris": 5000,
-                "Lyon": 2000,
-                "Marseille": 1800,
-                "Toulouse": 1500,
-                "Nice": 1200
-            }
-            
-            base = base_consumption.get(zone.name, 1000)
-            value = base + random.uniform(-200, 200)
-            
-            indicator_data = schemas.IndicatorCreate(
-                type="energy",
-                value=round(value, 2),
-                unit="kWh",
-                timestamp=timestamp,
-                zone_id=zone.id,
-                source_id=source.id,
-                extra_data={"sector": "residential"}
-            )
-            
-            crud.create_indicator(db, indicator_data)
-            count += 1
-    
-    print(f"✅ Generated {count} energy consumption indicators")
-
-
-def generate_co2_data(db: Session, zones: list, source: models.Source, days: int = 30):
-    """Generate mock CO2 emissions data"""
-    print("\n🏭 Generating CO2 emissions data...")
-    
-    count = 0
-    
-    for zone in zones:
-        # Generate daily data
-        for day in range(days):
-            date = datetime.now() - timedelta(days=day)
-            timestamp = date.replace(hour=12, minute=0, second=0, microsecond=0)
-            
-            # CO2 emissions vary by city
-            base_emissions = {
-                "Paris": 800,
-                "Lyon": 400,
-                "Marseille": 350,
-                "Toulouse": 300,
-                "Nice": 250
-            }
-            
-            base = base_emissions.get(zone.name, 200)
-            value = base + random.uniform(-50, 50)
-            
-            indicator_data = schemas.IndicatorCreate(
-                type="co2",
-                value=round(value, 2),
-                unit="kg",
-                timestamp=timestamp,
-                zone_id=zone.id,
-                source_id=source.id,
-                extra_data={"source": "transport"}
-            )
-            
-            crud.create_indicator(db, indicator_data)
-            count += 1
-    
-    print(f"✅ Generated {count} CO2 emission indicators")
-
-
-def run_ingestion(days: int = 30):
-    """Main ingestion function"""
+def zone_specs(count: int, seed: int = 42) -> List[Dict]:
+    """The five cities, then generated zones at seeded positions across France"""
+    specs = [dict(city) for city in CITIES[:count]]
+    rng = np.random.default_rng([seed, 0xC17])
+    extra = max(0, count - len(CITIES))
+    latitudes = rng.uniform(FRANCE_BOUNDS["south"], FRANCE_BOUNDS["north"], extra)
+    longitudes = rng.uniform(FRANCE_BOUNDS["west"], FRANCE_BOUNDS["east"], extra)
+    scales = rng.lognormal(-0.5, 0.6, extra)
+    for i in range(extra):
+        specs.append({
+            "name": f"Zone {len(CITIES) + i + 1:05d}",
+            "coords": f"{latitudes[i]:.4f},{longitudes[i]:.4f}",
+            "postal": None,
+            "scale": float(scales[i]),
+        })
+    return specs
+
+
+def create_zones(db: Session, specs: Optional[List[Dict]] = None) -> List[models.Zone]:
+    """Create the zones of specs (the cities by default) that do not exist yet, in one transaction"""
+    specs = specs if specs is not None else CITIES
+    names = [spec["name"] for spec in specs]
+    existing = {}
+    for start in range(0, len(names), 1000):
+        chunk = names[start:start + 1000]
+        existing.update({zone.name: zone for zone in db.scalars(select(models.Zone).where(models.Zone.name.in_(chunk)))})
+
+    created = [
+        models.Zone(name=spec["name"], postal_code=spec["postal"], geom=spec["coords"])
+        for spec in specs if spec["name"] not in existing
+    ]
+    if created:
+        db.add_all(created)
+        bump_generation(db, "zones")
+        db.commit()
+        print(f"✅ Created {len(created)} zones")
+        existing.update({zone.name: zone for zone in created})
+    return [existing[name] for name in names]
+
+
+def _time_grid(start: datetime, end: datetime, interval: timedelta) -> np.ndarray:
+    """Timestamps from start (included) to end (excluded), every interval"""
+    step = np.timedelta64(int(interval.total_seconds()), "s")
+    return np.arange(np.datetime64(start, "s"), np.datetime64(end, "s"), step)
+
+
+def metric_values(metric: Metric, times: np.ndarray, scale: float, interval: timedelta,
+                  rng: np.random.Generator) -> np.ndarray:
+    """Values of one series at times (datetime64), rounded to 2 decimals"""
+    hours = (times - times.astype("datetime64[D]")) / np.timedelta64(1, "h")
+    days = (times - times.astype("datetime64[Y]")) / np.timedelta64(1, "D")
+    level = metric.base * (scale if metric.scaled else 1.0)
+    if metric.per_day:
+        level *= interval / timedelta(days=1)
+    shape = (
+        (1 + metric.diurnal * np.cos(2 * math.pi * (hours - metric.peak_hour) / 24))
+        * (1 + metric.seasonal * np.cos(2 * math.pi * days / 365.25))
+    )
+    # Mean-preserving lognormal noise
+    noise = np.exp(metric.noise * rng.standard_normal(len(times)) - metric.noise ** 2 / 2)
+    return np.round(level * shape * noise, 2)
+
+
+def generate_batches(
+    zones: List[Tuple[int, float]],
+    start: datetime,
+    end: datetime,
+    interval: timedelta,
+    meter_interval: timedelta,
+    seed: int = 42,
+    batch_size: int = BATCH_SIZE,
+    metrics: List[Metric] = METRICS,
+) -> Iterator[Tuple[Metric, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Yield (metric, zone_ids, timestamps, values) blocks of about batch_size
+    readings. zones are (zone_id, scale) pairs; their position in the list
+    seeds their series, so keep the order to reproduce a dataset.
+    """
+    for metric_index, metric in enumerate(metrics):
+        step = meter_interval if metric.per_day else interval
+        times = _time_grid(start, end, step)
+        if not len(times):
+            continue
+        zones_per_batch = max(1, batch_size // len(times))
+        for first in range(0, len(zones), zones_per_batch):
+            block = zones[first:first + zones_per_batch]
+            values = np.concatenate([
+                metric_values(metric, times, scale, step, np.random.default_rng([seed, metric_index, first + offset]))
+                for offset, (_, scale) in enumerate(block)
+            ])
+            zone_ids = np.repeat([zone_id for zone_id, _ in block], len(times))
+            yield metric, zone_ids, np.tile(times, len(block)), values
+
+
+def _reduce(keys: List[np.ndarray], values: np.ndarray):
+    """Unique rows of the key columns with the count, sum, min, max and last index of their values"""
+    order = np.lexsort(keys[::-1])
+    sorted_keys = [key[order] for key in keys]
+    changes = np.zeros(len(order), dtype=bool)
+    changes[0] = True
+    for key in sorted_keys:
+        changes[1:] |= key[1:] != key[:-1]
+    starts = np.flatnonzero(changes)
+    ends = np.append(starts[1:], len(order)) - 1
+    ordered = values[order]
+    return (
+        [key[starts] for key in sorted_keys],
+        np.diff(np.append(starts, len(order))),
+        np.add.reduceat(ordered, starts),
+        np.minimum.reduceat(ordered, starts),
+        np.maximum.reduceat(ordered, starts),
+        order[ends],
+    )
+
+
+def _to_datetimes(timestamps: np.ndarray) -> list:
+    return timestamps.astype("datetime64[us]").tolist()
+
+
+def aggregate_block(metric: Metric, source_id: int, zone_ids: np.ndarray, timestamps: np.ndarray,
+                    values: np.ndarray) -> Tuple[Dict, Dict, Dict]:
+    """Rollup aggregates, sketch bin counts and latest values of a block, keyed like app.rollups/sketches/latest"""
+    signs, bins = sketches.bins_of(values)
+
+    aggregates, counts = {}, {}
+    for granularity, unit in (("hour", "h"), ("day", "D")):
+        buckets = timestamps.astype(f"datetime64[{unit}]")
+        (zones, starts), count, total, low, high, _ = _reduce([zone_ids, buckets.view(np.int64)], values)
+        starts = _to_datetimes(starts.astype(f"datetime64[{unit}]"))
+        for zone_id, start, *agg in zip(zones.tolist(), starts, count.tolist(), total.tolist(),
+                                        low.tolist(), high.tolist()):
+            aggregates[(granularity, metric.type, zone_id, start, metric.parameter)] = rollups.Agg(*agg)
+
+        (zones, starts, bin_signs, bin_indexes), count, *_ = _reduce(
+            [zone_ids, buckets.view(np.int64), signs, bins], values
+        )
+        starts = _to_datetimes(starts.astype(f"datetime64[{unit}]"))
+        for zone_id, start, sign, index, count_ in zip(zones.tolist(), starts, bin_signs.tolist(),
+                                                       bin_indexes.tolist(), count.tolist()):
+            counts[(granularity, metric.type, zone_id, start, metric.parameter, sign, index)] = count_
+
+    # Latest per zone: its last reading, blocks are in timestamp order per zone
+    (zones,), count, total, _, _, last = _reduce([zone_ids], values)
+    latest_groups = {
+        (zone_id, metric.type, metric.parameter): {
+            "value_count": count_, "value_sum": total_,
+            "latest": latest.Latest(zone_id, metric.type, metric.parameter, timestamp, value, metric.unit, source_id),
+        }
+        for zone_id, count_, total_, timestamp, value in zip(
+            zones.tolist(), count.tolist(), total.tolist(), _to_datetimes(timestamps[last]), values[last].tolist()
+        )
+    }
+    return aggregates, counts, latest_groups
+
+
+def write_batch(db: Session, metric: Metric, source_id: int, zone_ids: np.ndarray,
+                timestamps: np.ndarray, values: np.ndarray) -> int:
+    """Insert one block in one transaction, skipping readings already stored; returns the number of rows inserted"""
+    table = models.Indicator.__table__
+    start, end = timestamps.min(), timestamps.max()
+    stored = db.execute(
+        select(table.c.zone_id, table.c.timestamp).where(
+            table.c.type == metric.type,
+            table.c.parameter == metric.parameter,
+            table.c.source_id == source_id,
+            table.c.zone_id.in_(np.unique(zone_ids).tolist()),
+            table.c.timestamp >= start.astype("datetime64[us]").item(),
+            table.c.timestamp <= end.astype("datetime64[us]").item(),
+        )
+    ).all()
+    if stored:
+        def codes(zones, times):
+            return np.asarray(zones, dtype=np.int64) << 32 | np.asarray(times, dtype="datetime64[s]").view(np.int64)
+        new = ~np.isin(codes(zone_ids, timestamps), codes(*zip(*stored)))
+        zone_ids, timestamps, values = zone_ids[new], timestamps[new], values[new]
+    if not len(values):
+        return 0
+
+    extra_data = dict(metric.extra, parameter=metric.parameter)
+    created_at = datetime.utcnow()
+    rows = [
+        {
+            "type": metric.type, "value": value, "unit": metric.unit, "timestamp": timestamp,
+            "zone_id": zone_id, "source_id": source_id, "extra_data": extra_data,
+            "parameter": metric.parameter, "created_at": created_at,
+        }
+        for zone_id, timestamp, value in zip(zone_ids.tolist(), _to_datetimes(timestamps), values.tolist())
+    ]
+    # A plain insert: if another writer stored some of them meanwhile, the
+    # unique natural key fails the batch rather than the rollups drifting
+    db.execute(table.insert(), rows)
+
+    aggregates, counts, latest_groups = aggregate_block(metric, source_id, zone_ids, timestamps, values)
+    rollups.add_aggregates(db, aggregates)
+    sketches.add_counts(db, counts)
+    latest.add_groups(db, latest_groups)
+    bump_generation(db, "indicators")
+    db.commit()
+    return len(rows)
+
+
+def run_ingestion(
+    days: int = 30,
+    zones: int = len(CITIES),
+    interval: str = "3h",
+    meter_interval: str = "1d",
+    seed: int = 42,
+    end: Optional[datetime] = None,
+    batch_size: int = BATCH_SIZE,
+):
+    """
+    Main ingestion function
+
+    Args:
+        days: Number of days of data, ending at end
+        zones: Number of zones (the five cities first)
+        interval: Air quality sampling interval (5min to 31d, e.g. 15min, 1h, 3h)
+        meter_interval: Energy and CO2 sampling interval
+        seed: Random seed, the same arguments always produce the same data
+        end: End of the generated period (excluded), today at 00:00 UTC by default
+        batch_size: Readings per INSERT batch
+    """
     print("🎲 Starting mock data ingestion...")
-    print(f"📅 Generating {days} days of historical data\n")
-    
+    print(f"📅 Generating {days} days of historical data for {zones} zones\n")
+
+    interval_width = parse_bucket(interval).width
+    meter_width = parse_bucket(meter_interval).width
+    if interval_width is None or meter_width is None:
+        raise ValueError("Sampling intervals must be fixed widths (e.g. 15min, 1h, 1d)")
+    # Never in the future: readings after now would become the latest values
+    end = end or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+
     db = SessionLocal()
-    
+
     try:
         # Create sources
         sources = create_sources(db)
-        
+
         # Create zones
-        zones = create_zones(db)
-        
-        # Generate different types of data
-        generate_air_quality_data(db, zones, sources[0], days)
-        generate_energy_data(db, zones, sources[1], days)
-        generate_co2_data(db, zones, sources[2], days)
-        
+        specs = zone_specs(zones, seed)
+        zone_models = create_zones(db, specs)
+        zone_scales = [(zone.id, spec["scale"]) for zone, spec in zip(zone_models, specs)]
+
+        # Generate every metric in bulk batches
+        started = time.monotonic()
+        generated = inserted = 0
+        for metric, zone_ids, timestamps, values in generate_batches(
+            zone_scales, start, end, interval_width, meter_width, seed, batch_size
+        ):
+            for offset in range(0, len(values), batch_size):
+                part = slice(offset, offset + batch_size)
+                inserted += write_batch(db, metric, sources[metric.source].id,
+                                        zone_ids[part], timestamps[part], values[part])
+            generated += len(values)
+            elapsed = time.monotonic() - started
+            print(f"   {generated:,} readings ({generated / max(elapsed, 1e-9):,.0f}/s)", end="\r")
+        print(f"\n✅ Generated {generated:,} readings in {time.monotonic() - started:.1f}s "
+              f"({inserted:,} new, {generated - inserted:,} already stored)")
+
         print("\n✅ Mock data ingestion completed!")
-        print(f"📊 Database populated with realistic test data for {len(zones)} cities")
-    
+        print(f"📊 Database populated with realistic test data for {len(zone_models)} zones")
+
     except Exception as e:
         print(f"❌ Error during ingestion: {e}")
         db.rollback()
-    
+
     finally:
         db.close()
 
 
 if __name__ == "__main__":
     import argparse
-    
+
     parser = argparse.ArgumentParser(description="Generate mock environmental data")
     parser.add_argument("--days", type=int, default=30, help="Number of days of historical data to generate")
+    parser.add_argument("--zones", type=int, default=len(CITIES), help="Number of zones (the five cities first)")
+    parser.add_argument("--interval", default="3h", help="Air quality sampling interval, e.g. 15min, 1h, 3h")
+    parser.add_argument("--meter-interval", default="1d", help="Energy and CO2 sampling interval")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None,
+                        help="End of the period (excluded), e.g. 2025-12-01; today at 00:00 UTC by default")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Readings per insert batch")
     args = parser.parse_args()
-    
-    run_ingestion(days=args.days)
+
+    run_ingestion(days=args.days, zones=args.zones, interval=args.interval, meter_interval=args.meter_interval,
+                  seed=args.seed, end=args.end, batch_size=args.batch_size)
@@ -5,9 +5,15 @@ Fetches air quality data from OpenAQ API v3 and stores it in the database.
 API Documentation: https://docs.openaq.org/
 
 Note: You need to sign up for a free API key at https://explore.openaq.org/
+
+Cities are fetched concurrently and written while the next ones download
+(see ingestion/fetching.py). Each city is requested from its watermarks on,
+minus an overlap (see ingestion/watermarks.py), or over the last 7 days the
+first time. Measurements come oldest first, so a city with more than MAX_PAGES
+pages is covered up to its last fetched measurement and the next run resumes
+there.
 """
 
-import requests
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 import sys
@@ -19,6 +25,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from sqlalchemy.orm import Session
 from app.database import SessionLocal, engine, Base
 from app import models, crud, schemas
+from ingestion.fetching import FETCH_CONCURRENCY, FetchJob, fetch_and_ingest
+from ingestion.watermarks import WATERMARK_OVERLAP, advance_watermarks, fetch_start, get_watermarks
 
 # OpenAQ API Configuration
 OPENAQ_API_URL = "https://api.openaq.org/v3"
@@ -32,6 +40,13 @@ FRENCH_CITIES = [
     {"name": "Toulouse", "coordinates": {"latitude": 43.6047, "longitude": 1.4442}},
 ]
 
+# Window fetched for cities without watermarks
+DAYS_BACK = 7
+
+# Measurements per page, and pages fetched per city and run
+PAGE_LIMIT = 100
+MAX_PAGES = int(os.getenv("OPENAQ_MAX_PAGES", "10"))
+
 
 def get_or_create_source(db: Session) -> models.Source:
     """Get or create OpenAQ data source"""
@@ -67,57 +82,78 @@ def get_or_create_zone(db: Session, city: Dict) -> models.Zone:
     return zone
 
 
-def fetch_air_quality_data(latitude: float, longitude: float, radius: int = 25000) -> Optional[List[Dict]]:
+def air_quality_request(key, latitude: float, longitude: float, radius: int = 25000,
+                        date_from: Optional[datetime] = None) -> FetchJob:
     """
-    Fetch air quality measurements from OpenAQ API
+    Build the OpenAQ measurements request around a location
     
     Args:
+        key: Passed back with the response (the zone)
         latitude: Latitude of the location
         longitude: Longitude of the location
         radius: Radius in meters (default 25km)
+        date_from: Start of the measurements (UTC), 7 days ago by default
     
     Returns:
-        List of measurement data or None if error
+        FetchJob for fetch_and_ingest, paged: each page holds up to PAGE_LIMIT measurements in "results",
+        oldest first
     """
     headers = {
         "X-API-Key": OPENAQ_API_KEY
     }
     
+    now = datetime.utcnow()
     params = {
         "coordinates": f"{latitude},{longitude}",
         "radius": radius,
-        "limit": 100,
-        "date_from": (datetime.now() - timedelta(days=7)).isoformat(),
-        "date_to": datetime.now().isoformat()
+        "limit": PAGE_LIMIT,
+        "page": 1,
+        "order_by": "datetime",
+        "sort_order": "asc",
+        "date_from": (date_from or now - timedelta(days=DAYS_BACK)).isoformat() + "Z",
+        "date_to": now.isoformat() + "Z"
     }
     
-    try:
-        response = requests.get(
-            f"{OPENAQ_API_URL}/measurements",
-            headers=headers,
-            params=params,
-            timeout=30
-        )
-        response.raise_for_status()
-        data = response.json()
-        return data.get("results", [])
-    
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Error fetching data from OpenAQ: {e}")
+    return FetchJob(key, f"{OPENAQ_API_URL}/measurements", params, headers,
+                    label=f"OpenAQ data for {latitude},{longitude}",
+                    next_page=next_page, max_pages=MAX_PAGES)
+
+
+def next_page(params: Dict, payload: Dict) -> Optional[Dict]:
+    """Params of the page after a full one, None after the last page"""
+    if len(payload.get("results", [])) < params["limit"]:
         return None
+    return dict(params, page=params["page"] + 1)
 
 
-def ingest_air_quality_data(db: Session, zone: models.Zone, source: models.Source, measurements: List[Dict]):
+def is_truncated(pages: List[Dict]) -> bool:
+    """Whether the last fetched page was full, i.e. MAX_PAGES stopped the paging before the end"""
+    return len(pages[-1].get("results", [])) >= PAGE_LIMIT
+
+
+def ingest_air_quality_data(db: Session, zone: models.Zone, source: models.Source, measurements: List[Dict],
+                            complete: bool = True) -> int:
     """
     Ingest air quality measurements into database
     
+    All measurements are written with one upsert in a single transaction;
+    those already stored are skipped. The watermark of each parameter then
+    moves to its last measurement. A truncated response covers every
+    parameter of the zone up to its last measurement (pages are oldest
+    first), all watermarks move there and the next run resumes at it.
+    
     Args:
         db: Database session
         zone: Zone model instance
         source: Source model instance
         measurements: List of measurement dictionaries from OpenAQ
+        complete: Whether measurements holds every page of the request (False when MAX_PAGES cut it)
+    
+    Returns:
+        Number of indicators inserted
     """
-    count = 0
+    indicators = []
+    marks = {}
     
     for measurement in measurements:
         try:
@@ -132,21 +168,10 @@ def ingest_air_quality_data(db: Session, zone: models.Zone, source: models.Sourc
             
             # Parse timestamp
             timestamp = datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
+            if parameter not in marks or timestamp > marks[parameter]:
+                marks[parameter] = timestamp
             
-            # Check if measurement already exists
-            existing = db.query(models.Indicator).filter(
-                models.Indicator.zone_id == zone.id,
-                models.Indicator.source_id == source.id,
-                models.Indicator.type == "air_quality",
-                models.Indicator.timestamp == timestamp,
-                models.Indicator.extra_data["parameter"].astext == parameter
-            ).first()
-            
-            if existing:
-                continue
-            
-            # Create indicator
-            indicator_data = schemas.IndicatorCreate(
+            indicators.append(schemas.IndicatorCreate(
                 type="air_quality",
                 value=float(value),
                 unit=unit,
@@ -158,20 +183,38 @@ def ingest_air_quality_data(db: Session, zone: models.Zone, source: models.Sourc
                     "location": measurement.get("location", {}).get("name"),
                     "coordinates": measurement.get("coordinates")
                 }
-            )
-            
-            crud.create_indicator(db, indicator_data)
-            count += 1
+            ))
         
         except Exception as e:
             print(f"⚠️  Error processing measurement: {e}")
             continue
     
-    print(f"✅ Ingested {count} air quality measurements for {zone.name}")
+    result = crud.upsert_indicators(db, indicators)
+    print(f"✅ Ingested {result['inserted']} air quality measurements for {zone.name} ({result['skipped']} already stored)")
+    if complete:
+        advance_watermarks(db, source.id, zone.id, marks)
+    elif marks:
+        # Measurements at the last timestamp may continue on the next page, which resumes at it
+        covered = max(marks.values())
+        parameters = set(marks) | set(get_watermarks(db, source.id, zone.id))
+        advance_watermarks(db, source.id, zone.id, dict.fromkeys(parameters, covered), truncated=True)
+        print(f"⚠️  More than {MAX_PAGES} pages for {zone.name}, covered up to {covered}, the next run resumes there")
+    return result["inserted"]
 
 
-def run_ingestion():
-    """Main ingestion function"""
+def run_ingestion(cities: List[Dict] = FRENCH_CITIES, concurrency: int = FETCH_CONCURRENCY,
+                  overlap: timedelta = WATERMARK_OVERLAP):
+    """
+    Main ingestion function
+    
+    Args:
+        cities: Cities to fetch
+        concurrency: Maximum number of requests in flight
+        overlap: Hours fetched again before the watermarks, for late measurements
+    
+    Returns:
+        Number of city requests and of failed ones, None without API key
+    """
     print("🌍 Starting OpenAQ data ingestion...")
     
     # Check API key
@@ -189,29 +232,39 @@ def run_ingestion():
         # Get or create source
         source = get_or_create_source(db)
         
-        # Process each city
-        for city in FRENCH_CITIES:
-            print(f"\n📍 Processing {city['name']}...")
-            
-            # Get or create zone
+        # Get or create every zone first, the fetches then run concurrently
+        window_start = datetime.utcnow() - timedelta(days=DAYS_BACK)
+        jobs = []
+        for city in cities:
             zone = get_or_create_zone(db, city)
-            
-            # Fetch air quality data
-            measurements = fetch_air_quality_data(
+            jobs.append(air_quality_request(
+                zone,
                 city["coordinates"]["latitude"],
-                city["coordinates"]["longitude"]
-            )
-            
+                city["coordinates"]["longitude"],
+                date_from=fetch_start(db, source.id, zone.id, window_start, overlap=overlap)
+            ))
+        
+        failed = []
+        
+        def write(zone: models.Zone, pages: Optional[List[Dict]]):
+            print(f"\n📍 Processing {zone.name}...")
+            measurements = [measurement for page in pages or [] for measurement in page.get("results", [])]
             if measurements:
-                ingest_air_quality_data(db, zone, source, measurements)
+                ingest_air_quality_data(db, zone, source, measurements, complete=not is_truncated(pages))
             else:
-                print(f"⚠️  No data retrieved for {city['name']}")
+                print(f"⚠️  No data retrieved for {zone.name}")
+                if pages is None:
+                    failed.append(zone.name)
+        
+        fetch_and_ingest(jobs, write, concurrency=concurrency)
         
         print("\n✅ OpenAQ ingestion completed!")
+        return {"requests": len(jobs), "failed": len(failed)}
     
     except Exception as e:
         print(f"❌ Error during ingestion: {e}")
         db.rollback()
+        raise
     
     finally:
         db.close()
@@ -5,9 +5,13 @@ Fetches historical weather data from Open-Meteo API and stores it in the databas
 API Documentation: https://open-meteo.com/en/docs
 
 Note: No API key required! Completely free for non-commercial use.
+
+Cities are fetched concurrently and written while the next ones download
+(see ingestion/fetching.py). Each city is requested from its watermarks on,
+minus an overlap (see ingestion/watermarks.py), or over the last days_back
+days the first time.
 """
 
-import requests
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 import sys
@@ -19,6 +23,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from sqlalchemy.orm import Session
 from app.database import SessionLocal, engine, Base
 from app import models, crud, schemas
+from ingestion.fetching import FETCH_CONCURRENCY, FetchJob, fetch_and_ingest
+from ingestion.watermarks import WATERMARK_OVERLAP, advance_watermarks, fetch_start
 
 # Open-Meteo API Configuration
 OPENMETEO_API_URL = "https://api.open-meteo.com/v1/forecast"
@@ -32,6 +38,9 @@ FRENCH_CITIES = [
     {"name": "Toulouse", "latitude": 43.6047, "longitude": 1.4442},
 ]
 
+# Hourly variables stored as indicators (their extra_data parameter)
+WEATHER_PARAMETERS = ("temperature_2m", "precipitation")
+
 
 def get_or_create_source(db: Session) -> models.Source:
     """Get or create Open-Meteo data source"""
@@ -67,20 +76,23 @@ def get_or_create_zone(db: Session, city: Dict) -> models.Zone:
     return zone
 
 
-def fetch_weather_data(latitude: float, longitude: float, days_back: int = 7) -> Optional[Dict]:
+def weather_request(key, latitude: float, longitude: float, days_back: int = 7,
+                    start: Optional[datetime] = None) -> FetchJob:
     """
-    Fetch historical weather data from Open-Meteo API
+    Build the Open-Meteo archive request of a location
     
     Args:
+        key: Passed back with the response (the zone)
         latitude: Latitude of the location
         longitude: Longitude of the location
         days_back: Number of days of historical data to fetch
+        start: Fetch from this day instead (see fetch_start)
     
     Returns:
-        Weather data dictionary or None if error
+        FetchJob for fetch_and_ingest
     """
     end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=days_back)
+    start_date = start.date() if start else end_date - timedelta(days=days_back)
     
     params = {
         "latitude": latitude,
@@ -91,29 +103,25 @@ def fetch_weather_data(latitude: float, longitude: float, days_back: int = 7) ->
         "timezone": "Europe/Paris"
     }
     
-    try:
-        response = requests.get(
-            OPENMETEO_HISTORICAL_URL,
-            params=params,
-            timeout=30
-        )
-        response.raise_for_status()
-        return response.json()
-    
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Error fetching data from Open-Meteo: {e}")
-        return None
+    return FetchJob(key, OPENMETEO_HISTORICAL_URL, params, label=f"Open-Meteo data for {latitude},{longitude}")
 
 
-def ingest_weather_data(db: Session, zone: models.Zone, source: models.Source, weather_data: Dict):
+def ingest_weather_data(db: Session, zone: models.Zone, source: models.Source, weather_data: Dict) -> int:
     """
     Ingest weather data into database
     
+    All readings are written with one upsert in a single transaction; the
+    archive revises recent hours, so stored readings get the new values.
+    The watermark of each variable then moves to its last non-null hour.
+    
     Args:
         db: Database session
         zone: Zone model instance
         source: Source model instance
         weather_data: Weather data dictionary from Open-Meteo
+    
+    Returns:
+        Number of indicators inserted or updated
     """
     hourly = weather_data.get("hourly", {})
     times = hourly.get("time", [])
@@ -122,7 +130,7 @@ def ingest_weather_data(db: Session, zone: models.Zone, source: models.Source, w
     precipitation = hourly.get("precipitation", [])
     wind_speed = hourly.get("wind_speed_10m", [])
     
-    count = 0
+    indicators = []
     
     for i, time_str in enumerate(times):
         try:
@@ -130,7 +138,7 @@ def ingest_weather_data(db: Session, zone: models.Zone, source: models.Source, w
             
             # Temperature indicator
             if i < len(temperatures) and temperatures[i] is not None:
-                temp_data = schemas.IndicatorCreate(
+                indicators.append(schemas.IndicatorCreate(
                     type="temperature",
                     value=float(temperatures[i]),
                     unit="°C",
@@ -138,23 +146,11 @@ def ingest_weather_data(db: Session, zone: models.Zone, source: models.Source, w
                     zone_id=zone.id,
                     source_id=source.id,
                     extra_data={"parameter": "temperature_2m"}
-                )
-                
-                # Check if exists
-                existing = db.query(models.Indicator).filter(
-                    models.Indicator.zone_id == zone.id,
-                    models.Indicator.source_id == source.id,
-                    models.Indicator.type == "temperature",
-                    models.Indicator.timestamp == timestamp
-                ).first()
-                
-                if not existing:
-                    crud.create_indicator(db, temp_data)
-                    count += 1
+                ))
             
             # Precipitation indicator (can be used as water consumption proxy)
             if i < len(precipitation) and precipitation[i] is not None and precipitation[i] > 0:
-                precip_data = schemas.IndicatorCreate(
+                indicators.append(schemas.IndicatorCreate(
                     type="precipitation",
                     value=float(precipitation[i]),
                     unit="mm",
@@ -162,28 +158,40 @@ def ingest_weather_data(db: Session, zone: models.Zone, source: models.Source, w
                     zone_id=zone.id,
                     source_id=source.id,
                     extra_data={"parameter": "precipitation"}
-                )
-                
-                existing = db.query(models.Indicator).filter(
-                    models.Indicator.zone_id == zone.id,
-                    models.Indicator.source_id == source.id,
-                    models.Indicator.type == "precipitation",
-                    models.Indicator.timestamp == timestamp
-                ).first()
-                
-                if not existing:
-                    crud.create_indicator(db, precip_data)
-                    count += 1
+                ))
         
         except Exception as e:
             print(f"⚠️  Error processing weather data: {e}")
             continue
     
-    print(f"✅ Ingested {count} weather indicators for {zone.name}")
+    result = crud.upsert_indicators(db, indicators, update=True)
+    count = result["inserted"] + result["updated"]
+    print(f"✅ Ingested {count} weather indicators for {zone.name} ({result['skipped']} already up to date)")
+    
+    # Hours not yet in the archive are null, they are requested again next time
+    marks = {}
+    for parameter in WEATHER_PARAMETERS:
+        covered = [time_str for time_str, value in zip(times, hourly.get(parameter, [])) if value is not None]
+        if covered:
+            marks[parameter] = datetime.fromisoformat(max(covered))
+    advance_watermarks(db, source.id, zone.id, marks)
+    return count
 
 
-def run_ingestion():
-    """Main ingestion function"""
+def run_ingestion(cities: List[Dict] = FRENCH_CITIES, days_back: int = 7, concurrency: int = FETCH_CONCURRENCY,
+                  overlap: timedelta = WATERMARK_OVERLAP):
+    """
+    Main ingestion function
+    
+    Args:
+        cities: Cities to fetch
+        days_back: Window fetched for cities without watermarks
+        concurrency: Maximum number of requests in flight
+        overlap: Hours fetched again before the watermarks, for late revisions
+    
+    Returns:
+        Number of city requests and of failed ones
+    """
     print("🌤️  Starting Open-Meteo data ingestion...")
     
     db = SessionLocal()
@@ -192,30 +200,34 @@ def run_ingestion():
         # Get or create source
         source = get_or_create_source(db)
         
-        # Process each city
-        for city in FRENCH_CITIES:
-            print(f"\n📍 Processing {city['name']}...")
-            
-            # Get or create zone
+        # Get or create every zone first, the fetches then run concurrently
+        window_start = datetime.combine(datetime.now().date() - timedelta(days=days_back), datetime.min.time())
+        jobs = []
+        for city in cities:
             zone = get_or_create_zone(db, city)
-            
-            # Fetch weather data
-            weather_data = fetch_weather_data(
-                city["latitude"],
-                city["longitude"],
-                days_back=7
-            )
-            
+            start = fetch_start(db, source.id, zone.id, window_start, WEATHER_PARAMETERS, overlap)
+            jobs.append(weather_request(zone, city["latitude"], city["longitude"], days_back=days_back, start=start))
+        
+        failed = []
+        
+        def write(zone: models.Zone, weather_data: Optional[Dict]):
+            print(f"\n📍 Processing {zone.name}...")
             if weather_data:
                 ingest_weather_data(db, zone, source, weather_data)
             else:
-                print(f"⚠️  No data retrieved for {city['name']}")
+                print(f"⚠️  No data retrieved for {zone.name}")
+                if weather_data is None:
+                    failed.append(zone.name)
+        
+        fetch_and_ingest(jobs, write, concurrency=concurrency)
         
         print("\n✅ Open-Meteo ingestion completed!")
+        return {"requests": len(jobs), "failed": len(failed)}
     
     except Exception as e:
         print(f"❌ Error during ingestion: {e}")
         db.rollback()
+        raise
     
     finally:
         db.close()
@@ -1,7 +1,8 @@
 """
 Master Data Ingestion Script
 
-Runs all available data ingestion scripts in sequence.
+Runs all available data ingestion scripts in sequence, or with --daemon keeps
+running them, each on the frequency of its source (see ingestion/scheduler.py).
 """
 
 import sys
@@ -65,5 +66,57 @@ def main():
     print("\n✅ Data ingestion pipeline completed!")
 
 
+def scheduled_sources():
+    """Sources run by the daemon: Open-Meteo, and OpenAQ when its API key is set"""
+    from ingestion import openaq_ingestion, openmeteo_ingestion
+    from ingestion.scheduler import ScheduledSource
+    
+    sources = [ScheduledSource("Open-Meteo", openmeteo_ingestion.run_ingestion, "hourly")]
+    openaq_key = os.getenv("OPENAQ_API_KEY")
+    if openaq_key and openaq_key != "YOUR_API_KEY_HERE":
+        sources.append(ScheduledSource("OpenAQ", openaq_ingestion.run_ingestion, "hourly"))
+    else:
+        print("⚠️  Skipping OpenAQ (API key not set)")
+    return sources
+
+
+def run_daemon(slots: int):
+    """Run the sources on their frequency until interrupted"""
+    from ingestion.scheduler import Scheduler
+    
+    sources = scheduled_sources()
+    print(f"🕒 Scheduling {', '.join(source.name for source in sources)} with {slots} worker slots (Ctrl+C to stop)")
+    try:
+        # Runs in progress are completed before an interrupt gets here
+        Scheduler(sources, slots=slots).run()
+    except KeyboardInterrupt:
+        print("\n⏹️  Scheduler stopped")
+
+
+def print_report(days: int):
+    """Print run counts and durations per source"""
+    from ingestion.scheduler import report
+    
+    print(f"📊 Ingestion runs over the last {days} days")
+    print(f"{'Source':20s} {'Runs':>6s} {'Failed':>6s} {'p50 (s)':>8s} {'p95 (s)':>8s} {'max (s)':>8s}")
+    for row in report(days):
+        print(f"{row['source']:20s} {row['runs']:6d} {row['failed']:6d} "
+              f"{row['p50']:8.1f} {row['p95']:8.1f} {row['max']:8.1f}")
+
+
 if __name__ == "__main__":
-    main()
+    import argparse
+    from ingestion.scheduler import SCHEDULER_SLOTS
+    
+    parser = argparse.ArgumentParser(description="Run the EcoTrack ingestion scripts")
+    parser.add_argument("--daemon", action="store_true", help="Keep running each source on its frequency")
+    parser.add_argument("--slots", type=int, default=SCHEDULER_SLOTS, help="Sources run in parallel by the daemon")
+    parser.add_argument("--report", type=int, metavar="DAYS", help="Print run durations of the last DAYS days")
+    args = parser.parse_args()
+    
+    if args.report:
+        print_report(args.report)
+    elif args.daemon:
+        run_daemon(args.slots)
+    else:
+        main()
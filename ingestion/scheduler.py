@@ -0,0 +1,240 @@
+"""
+Ingestion scheduler
+
+Runs each ingestion source on its own cadence, taken from the frequency of its
+row in the sources table ("hourly", "daily", "weekly" or a width such as
+"30min" or "6h"), in a pool of SCHEDULER_SLOTS worker threads. A source never
+has two runs at once and the scheduling loop never waits for a run, so a slow
+source only holds its own slot: with at least as many slots as sources,
+the others keep their cadence.
+
+The next run of a source is one interval after the start of the previous one
+(immediately if that run took longer). A run fails when it raises or
+returns {"failed": n} with n > 0, i.e. some upstream requests failed; it is
+then retried after an exponential backoff, BACKOFF_BASE seconds doubled on
+every consecutive failure up to BACKOFF_MAX (or the source's interval if
+shorter), with equal jitter (a random half of the delay is dropped) so that
+sources failing together do not retry in lockstep.
+
+Every run is recorded in the ingestion_runs table with its duration; see
+report() for the per-source summary.
+"""
+
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+from sqlalchemy import select
+from app import models
+from app.database import SessionLocal
+from app.timeseries import parse_bucket
+
+FREQUENCIES = {"hourly": timedelta(hours=1), "daily": timedelta(days=1), "weekly": timedelta(weeks=1)}
+
+SCHEDULER_SLOTS = int(os.getenv("INGESTION_SLOTS", "4"))
+BACKOFF_BASE = float(os.getenv("INGESTION_BACKOFF_BASE", "60"))
+BACKOFF_MAX = float(os.getenv("INGESTION_BACKOFF_MAX", "3600"))
+
+
+class ScheduledSource(NamedTuple):
+    """An ingestion job; name is the sources row whose frequency sets its cadence"""
+    name: str
+    run: Callable[[], Any]
+    frequency: str = "daily"  # Until the source row exists
+
+
+class _State:
+    def __init__(self, next_run: float):
+        self.next_run = next_run
+        self.running = False
+        self.failures = 0
+
+
+def parse_frequency(frequency: Optional[str], default: str = "daily") -> timedelta:
+    """Interval of a source frequency, default for missing or unknown ones"""
+    for value in (frequency, default):
+        if not value:
+            continue
+        if value in FREQUENCIES:
+            return FREQUENCIES[value]
+        try:
+            width = parse_bucket(value).width
+        except ValueError:
+            continue
+        if width is not None:
+            return width
+    return FREQUENCIES["daily"]
+
+
+def backoff_delay(failures: int, base: float, cap: float, rng: random.Random = random) -> float:
+    """Seconds to wait after a number of consecutive failures: capped exponential with equal jitter"""
+    delay = min(cap, base * 2 ** (failures - 1))
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+class Scheduler:
+    """
+    Runs sources on their cadence until stop() is called
+
+    clock returns seconds and wait(event, timeout) blocks until the event is
+    set or timeout seconds have passed, so that tests can run the scheduler on
+    a virtual clock.
+    """
+
+    def __init__(
+        self,
+        sources: Iterable[ScheduledSource],
+        slots: int = SCHEDULER_SLOTS,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+        clock: Callable[[], float] = time.monotonic,
+        rng: random.Random = random,
+        wait: Callable[[threading.Event, float], Any] = threading.Event.wait,
+    ):
+        self.sources = list(sources)
+        self.slots = max(1, slots)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.clock = clock
+        self.rng = rng
+        self.wait = wait
+        # Every source is due at startup
+        now = clock()
+        self._states: Dict[str, _State] = {source.name: _State(now) for source in self.sources}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def interval(self, source: ScheduledSource) -> timedelta:
+        """Cadence of a source, read from its sources row on every run so that changes apply"""
+        db = SessionLocal()
+        try:
+            frequency = db.scalar(select(models.Source.frequency).where(models.Source.name == source.name))
+        finally:
+            db.close()
+        return parse_frequency(frequency, source.frequency)
+
+    def run(self, duration: Optional[float] = None):
+        """Schedule runs until stop() (or for duration seconds), then wait for the runs in progress"""
+        deadline = None if duration is None else self.clock() + duration
+        executor = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix="ingestion")
+        try:
+            while not self._stopped.is_set():
+                # Cleared before looking at the states: a run finishing from now on wakes the wait below
+                self._wake.clear()
+                now = self.clock()
+                if deadline is not None and now >= deadline:
+                    break
+                with self._lock:
+                    running = sum(state.running for state in self._states.values())
+                    due = sorted(
+                        (source for source in self.sources
+                         if not self._states[source.name].running and self._states[source.name].next_run <= now),
+                        key=lambda source: self._states[source.name].next_run,
+                    )
+                    for source in due[:self.slots - running]:
+                        self._states[source.name].running = True
+                        executor.submit(self._run, source)
+                        running += 1
+                    # With every slot taken only a finishing run can start another one
+                    upcoming = [] if running >= self.slots else [
+                        state.next_run for state in self._states.values() if not state.running
+                    ]
+                timeout = max(0.0, min(upcoming, default=now + 60) - now)
+                if deadline is not None:
+                    timeout = min(timeout, deadline - now)
+                self.wait(self._wake, timeout)
+        finally:
+            executor.shutdown(wait=True)
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _run(self, source: ScheduledSource):
+        started_at = datetime.utcnow()
+        start = self.clock()
+        error = None
+        try:
+            result = source.run()
+            if isinstance(result, dict) and result.get("failed"):
+                error = f"{result['failed']} of {result.get('requests', '?')} upstream requests failed"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        duration = self.clock() - start
+
+        try:
+            interval = self.interval(source)
+        except Exception as e:
+            print(f"⚠️  Cannot read the frequency of {source.name}: {e}")
+            interval = parse_frequency(None, source.frequency)
+        with self._lock:
+            state = self._states[source.name]
+            if error:
+                state.failures += 1
+                cap = min(self.backoff_max, interval.total_seconds())
+                state.next_run = self.clock() + backoff_delay(state.failures, self.backoff_base, cap, self.rng)
+            else:
+                state.failures = 0
+                state.next_run = max(start + interval.total_seconds(), self.clock())
+            failures = state.failures
+            next_in = state.next_run - self.clock()
+
+        if error:
+            print(f"❌ {source.name} failed after {duration:.1f}s ({error}), retrying in {next_in:.0f}s")
+        else:
+            print(f"✅ {source.name} completed in {duration:.1f}s, next run in {next_in:.0f}s")
+        try:
+            record_run(source.name, started_at, duration, error, failures)
+        except Exception as e:
+            print(f"⚠️  Cannot record the run of {source.name}: {e}")
+        finally:
+            with self._lock:
+                state.running = False
+                self._wake.set()
+
+
+def record_run(source: str, started_at: datetime, duration: float, error: Optional[str], failures: int):
+    """Store one run in ingestion_runs"""
+    db = SessionLocal()
+    try:
+        db.add(models.IngestionRun(
+            source=source, started_at=started_at, duration=duration,
+            status="failed" if error else "success", error=error, failures=failures,
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def report(days: int = 7) -> List[Dict]:
+    """Runs, failures and p50/p95/max duration in seconds per source over the last days"""
+    db = SessionLocal()
+    try:
+        runs = db.execute(
+            select(models.IngestionRun.source, models.IngestionRun.status, models.IngestionRun.duration)
+            .where(models.IngestionRun.started_at >= datetime.utcnow() - timedelta(days=days))
+        ).all()
+    finally:
+        db.close()
+
+    by_source: Dict[str, List] = {}
+    for run in runs:
+        by_source.setdefault(run.source, []).append(run)
+    rows = []
+    for source, source_runs in sorted(by_source.items()):
+        durations = sorted(run.duration for run in source_runs)
+        percentiles = statistics.quantiles(durations, n=20, method="inclusive") if len(durations) > 1 else durations * 19
+        rows.append({
+            "source": source,
+            "runs": len(source_runs),
+            "failed": sum(run.status == "failed" for run in source_runs),
+            "p50": percentiles[9],
+            "p95": percentiles[18],
+            "max": durations[-1],
+        })
+    return rows
@@ -0,0 +1,100 @@
+"""
+Incremental ingestion watermarks
+
+ingestion_watermarks holds, per (source, zone, parameter), the last timestamp
+covered by an ingested upstream response. The ingestors request data from
+WATERMARK_OVERLAP before the oldest watermark of a zone instead of a fixed
+window, so upstream traffic and deduplication scale with the new data; the
+overlap re-reads recent hours for late arrivals and revisions, which the
+natural key upsert absorbs.
+
+A watermark is advanced after the readings are written, so a failed write
+only means the same data is requested again. It records coverage rather than
+the last stored reading: Open-Meteo hours without precipitation store no
+reading but are covered all the same.
+
+A response cut by a page limit covers everything up to its last timestamp when
+its pages are sorted by date; its watermarks are stored as truncated and the
+next request resumes exactly there. The overlap only applies once a response
+is complete, so a window larger than one run can fetch still moves forward on
+every run.
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from sqlalchemy import case, select
+from sqlalchemy.orm import Session
+from app import models
+from app.database import dialect_insert, naive_datetime
+
+WATERMARK_OVERLAP = timedelta(hours=float(os.getenv("INGESTION_OVERLAP_HOURS", "24")))
+
+
+def get_watermarks(db: Session, source_id: int, zone_id: int) -> Dict[str, datetime]:
+    """Watermark of each parameter of a zone for a source"""
+    table = models.IngestionWatermark
+    return dict(db.execute(
+        select(table.parameter, table.watermark).where(table.source_id == source_id, table.zone_id == zone_id)
+    ).all())
+
+
+def fetch_start(
+    db: Session,
+    source_id: int,
+    zone_id: int,
+    window_start: datetime,
+    parameters: Optional[Iterable[str]] = None,
+    overlap: timedelta = WATERMARK_OVERLAP,
+) -> datetime:
+    """
+    Where the next request of a zone should start: overlap before its oldest
+    watermark (at it for a truncated one), never before window_start (the full
+    window fetched without watermarks).
+
+    Watermarks older than window_start are ignored, their parameter is no
+    longer reported. When parameters are given, a missing one means a full
+    window.
+    """
+    table = models.IngestionWatermark
+    rows = db.execute(
+        select(table.parameter, table.watermark, table.truncated)
+        .where(table.source_id == source_id, table.zone_id == zone_id)
+    ).all()
+    if parameters is not None and set(parameters) - {row.parameter for row in rows}:
+        return window_start
+    starts = [row.watermark if row.truncated else row.watermark - overlap
+              for row in rows if row.watermark >= window_start]
+    if not starts:
+        return window_start
+    return max(window_start, min(starts))
+
+
+def advance_watermarks(db: Session, source_id: int, zone_id: int, marks: Dict[str, datetime],
+                       truncated: bool = False):
+    """
+    Move the watermarks of a zone forward to marks (never backwards) and commit.
+
+    truncated marks them as the end of a response cut by a page limit,
+    whether they move or not.
+    """
+    if not marks:
+        return
+    table = models.IngestionWatermark.__table__
+    stmt = dialect_insert(db.bind, table)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["source_id", "zone_id", "parameter"],
+        set_={
+            "watermark": case((excluded.watermark > table.c.watermark, excluded.watermark), else_=table.c.watermark),
+            "updated_at": excluded.updated_at,
+            "truncated": excluded.truncated,
+        }
+    )
+    now = datetime.utcnow()
+    db.execute(stmt, [
+        {"source_id": source_id, "zone_id": zone_id, "parameter": parameter,
+         "watermark": naive_datetime(mark), "updated_at": now, "truncated": truncated}
+        for parameter, mark in marks.items()
+    ])
+    db.commit()
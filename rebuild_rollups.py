@@ -0,0 +1,51 @@
+"""
+Rebuild Indicator Rollups
+
+Recomputes the hourly and daily rollup tables used by the /stats endpoints
+and the latest values used by /zones/latest from the raw indicators table.
+The API keeps them up to date on every write; run this after loading
+indicators without going through app.crud (e.g. a database restore or manual
+SQL import).
+
+Usage:
+    python rebuild_rollups.py
+"""
+
+import sys
+import os
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal, upgrade_schema
+from app.latest import rebuild_latest
+from app.rollups import rebuild_rollups
+
+
+def main():
+    """Rebuild all rollups"""
+    print("🔄 Rebuilding indicator rollups...")
+    
+    upgrade_schema()
+    db = SessionLocal()
+    
+    try:
+        started = time.perf_counter()
+        count = rebuild_rollups(db)
+        print(f"✅ Rebuilt {count} rollup rows in {time.perf_counter() - started:.1f}s")
+        
+        started = time.perf_counter()
+        count = rebuild_latest(db)
+        print(f"✅ Rebuilt {count} latest value rows in {time.perf_counter() - started:.1f}s")
+    
+    except Exception as e:
+        print(f"❌ Error rebuilding rollups: {e}")
+        db.rollback()
+    
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Shared test configuration
+
+Points the app at a dedicated SQLite file and gives every test a fresh schema,
+so tests do not depend on each other or on the development database.
+"""
+
+import asyncio
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test_ecotrack.db")
+# Minimum bcrypt cost, the default one makes every fixture user take ~0.25s
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import pytest
+from app.database import async_engine, engine, Base
+from app import models  # noqa: F401  (registers tables on Base.metadata)
+from app.cache import count_cache, user_cache
+from app.spatial import zone_index
+from app.hotwindow import hot_window
+
+
+@pytest.fixture(autouse=True)
+def reset_database():
+    """Recreate all tables before each test"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    count_cache.clear()
+    user_cache.clear()
+    zone_index.clear()
+    hot_window.clear()
+    yield
+    # Pooled aiosqlite connections are bound to the event loops of this test's requests
+    asyncio.run(async_engine.dispose())
@@ -3,13 +3,18 @@ Integration tests for EcoTrack API endpoints
 Tests user creation, login, indicator CRUD, filtered retrieval, and statistics
 """
 
+import asyncio
+import json
 import pytest
 from httpx import AsyncClient
 from fastapi.testclient import TestClient
 from app.main import app
 from app.database import SessionLocal, engine, Base
-from app import models, crud, schemas
+from datetime import datetime, timedelta
+from sqlalchemy import event, func
+from app import models, crud, schemas, rollups, sketches, hotwindow, latest, spatial, timeseries, downsampling, hashing, events
 from app.auth import get_password_hash
+from app.routers.indicators import indicator_events
 
 # Create test database
 Base.metadata.create_all(bind=engine)
@@ -140,6 +145,33 @@ class TestAuthentication:
         )
         assert response.status_code == 401
     
+    def test_login_rehashes_password(self, db):
+        """Test that a hash made with another bcrypt cost is upgraded on login"""
+        user = models.User(
+            email="old@example.com",
+            username="olduser",
+            hashed_password=get_password_hash("oldpassword123", rounds=5)
+        )
+        db.add(user)
+        db.commit()
+
+        response = client.post("/auth/login", data={"username": "olduser", "password": "oldpassword123"})
+        assert response.status_code == 200
+
+        db.refresh(user)
+        assert not hashing.needs_rehash(user.hashed_password)
+        assert hashing.verify_password("oldpassword123", user.hashed_password)
+
+    def test_login_when_hashing_pool_is_full(self, test_user, monkeypatch):
+        """Test that logins are refused with 503 once the hashing queue is full"""
+        monkeypatch.setattr(hashing, "HASH_QUEUE_SIZE", 0)
+        response = client.post(
+            "/auth/login",
+            data={"username": "testuser", "password": "testpassword123"}
+        )
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+
     def test_protected_endpoint_without_token(self):
         """Test accessing protected endpoint without token"""
         response = client.get("/indicators/")
@@ -181,6 +213,36 @@ class TestUserManagement:
         assert response.status_code == 200
         assert response.json()["is_active"] == False
 
+    def test_user_cache(self, auth_token, admin_token, test_user):
+        """Test that resolved users are cached and user updates apply immediately"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        admin_headers = {"Authorization": f"Bearer {admin_token}"}
+
+        # Cache stats are for admins only, /health is a liveness check
+        assert "caches" not in client.get("/health").json()
+        assert client.get("/health/caches").status_code == 401
+        assert client.get("/health/caches", headers=headers).status_code == 403
+
+        client.get("/users/me", headers=headers)
+        before = client.get("/health/caches", headers=admin_headers).json()["users"]
+        response = client.get("/users/me", headers=headers)
+        assert response.status_code == 200
+        after = client.get("/health/caches", headers=admin_headers).json()["users"]
+        # The user, then the admin reading the stats
+        assert after["hits"] == before["hits"] + 2
+        assert after["misses"] == before["misses"]
+
+        # A role change invalidates the cached user
+        assert client.get("/users/", headers=headers).status_code == 403
+        client.put(f"/users/{test_user.id}", headers=admin_headers, json={"role": "admin"})
+        assert client.get("/users/", headers=headers).status_code == 200
+
+        # So does deactivation and deletion
+        client.put(f"/users/{test_user.id}", headers=admin_headers, json={"is_active": False})
+        assert client.get("/users/me", headers=headers).status_code == 400
+        client.delete(f"/users/{test_user.id}", headers=admin_headers)
+        assert client.get("/users/me", headers=headers).status_code == 401
+
 
 class TestIndicators:
     """Test indicator endpoints"""
@@ -340,6 +402,275 @@ class TestIndicators:
         get_response = client.get(f"/indicators/{indicator_id}", headers=headers)
         assert get_response.status_code == 404
 
+    def test_cursor_pagination(self, auth_token, admin_token, test_zone, test_source):
+        """Test keyset pagination walks every indicator exactly once"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        # Several indicators share a timestamp so the id tiebreak matters
+        for i in range(7):
+            indicator_data = {
+                "type": "co2",
+                "value": 400.0 + i,
+                "unit": "ppm",
+                "timestamp": f"2025-11-{18 + i // 3}T10:00:00",
+                "zone_id": test_zone.id,
+                "source_id": test_source.id
+            }
+            client.post("/indicators/", headers=headers, json=indicator_data)
+        
+        user_headers = {"Authorization": f"Bearer {auth_token}"}
+        seen = []
+        params = {"limit": 3, "paginate": "cursor"}
+        while True:
+            response = client.get("/indicators/", headers=user_headers, params=params)
+            assert response.status_code == 200
+            data = response.json()
+            # No page counts the whole set unless asked to
+            assert (data["total"], data["total_strategy"]) == (None, "none")
+            seen.extend(ind["id"] for ind in data["items"])
+            if not data["has_next"]:
+                assert data["next_cursor"] is None
+                break
+            params = {"limit": 3, "cursor": data["next_cursor"]}
+        
+        assert len(seen) == 7
+        assert len(set(seen)) == 7
+        response = client.get("/indicators/", headers=user_headers, params={"paginate": "cursor", "count": "exact"})
+        assert response.json()["total"] == 7
+    
+    def test_invalid_cursor(self, auth_token):
+        """Test that a malformed or mismatched cursor is rejected"""
+        user_headers = {"Authorization": f"Bearer {auth_token}"}
+        response = client.get("/indicators/?cursor=not-a-cursor", headers=user_headers)
+        assert response.status_code == 400
+
+        # Well-formed tokens whose sort value does not have the column's type
+        for sort_by, sort_value in [("timestamp", 123), ("timestamp", "yesterday"), ("timestamp", None),
+                                    ("value", [1, 2]), ("value", {"a": 1}), ("value", "10"), ("type", 5)]:
+            cursor = crud.encode_cursor(sort_by, "desc", sort_value, 1)
+            response = client.get(f"/indicators/?sort_by={sort_by}&order=desc&cursor={cursor}",
+                                  headers=user_headers)
+            assert response.status_code == 400, (sort_by, sort_value)
+            assert response.json()["detail"] == "Invalid cursor"
+
+    def test_count_strategies(self, auth_token, admin_token, test_zone, test_source):
+        """Test total count strategies and cache invalidation on writes"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        indicator_data = {
+            "type": "energy",
+            "value": 100.0,
+            "unit": "kWh",
+            "timestamp": "2025-11-20T10:00:00",
+            "zone_id": test_zone.id,
+            "source_id": test_source.id
+        }
+        client.post("/indicators/", headers=headers, json=indicator_data)
+        
+        user_headers = {"Authorization": f"Bearer {auth_token}"}
+        response = client.get("/indicators/?type=energy&count=cached", headers=user_headers)
+        data = response.json()
+        assert data["total"] == 1
+        assert data["total_strategy"] == "cached"
+        
+        # A write bumps the generation, so the cached count is not reused
+        client.post("/indicators/", headers=headers, json=indicator_data)
+        response = client.get("/indicators/?type=energy&count=cached", headers=user_headers)
+        assert response.json()["total"] == 2
+        
+        response = client.get("/indicators/?count=estimate", headers=user_headers)
+        data = response.json()
+        assert data["total"] == 2
+        assert data["total_strategy"] == "estimate"
+        
+        response = client.get("/indicators/?count=none&limit=1", headers=user_headers)
+        data = response.json()
+        assert data["total"] is None
+        assert data["has_next"] is True
+        
+        response = client.get("/indicators/?count=bogus", headers=user_headers)
+        assert response.status_code == 400
+
+    def test_bulk_create_indicators(self, auth_token, admin_token, test_zone, test_source):
+        """Test bulk insert with a JSON array, reporting per-item errors"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        items = [
+            {
+                "type": "air_quality",
+                "value": 10.0 + i,
+                "unit": "µg/m³",
+                "timestamp": f"2025-11-20T{i:02d}:00:00",
+                "zone_id": test_zone.id,
+                "source_id": test_source.id,
+                "extra_data": {"parameter": "PM2.5"}
+            }
+            for i in range(5)
+        ]
+        items.insert(2, {"type": "air_quality", "value": "not a number"})
+        items.append(dict(items[0], zone_id=999999))
+        
+        response = client.post("/indicators/bulk", headers=headers, json=items)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["inserted"] == 5
+        assert [err["index"] for err in data["errors"]] == [2, 6]
+        
+        # Bulk inserts are reflected in the stats rollups
+        user_headers = {"Authorization": f"Bearer {auth_token}"}
+        stats = client.get("/stats/summary", headers=user_headers).json()
+        assert stats == [{"type": "air_quality", "count": 5, "average": 12.0, "min": 10.0, "max": 14.0}]
+        
+        # Readings already stored are skipped, single creates of one are rejected
+        response = client.post("/indicators/bulk", headers=headers, json=items[:2] + items[3:6])
+        assert response.json() == {"inserted": 0, "skipped": 5, "errors": []}
+        response = client.post("/indicators/", headers=headers, json=items[0])
+        assert response.status_code == 409
+        assert client.get("/stats/summary", headers=user_headers).json() == stats
+    
+    def test_bulk_create_indicators_ndjson(self, admin_token, test_zone, test_source, monkeypatch):
+        """Test bulk insert with NDJSON and the batch size limit"""
+        from app.routers import indicators as indicators_router
+        
+        headers = {"Authorization": f"Bearer {admin_token}", "Content-Type": "application/x-ndjson"}
+        line = (
+            '{"type": "co2", "value": 400, "unit": "ppm", "timestamp": "2025-11-20T10:00:00", '
+            f'"zone_id": {test_zone.id}, "source_id": {test_source.id}}}'
+        )
+        body = "\n".join([line, "{not json", line]) + "\n"
+        
+        response = client.post("/indicators/bulk", headers=headers, content=body)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["inserted"] == 2
+        assert [err["index"] for err in data["errors"]] == [1]
+        
+        monkeypatch.setattr(indicators_router, "BULK_MAX_ITEMS", 2)
+        response = client.post("/indicators/bulk", headers=headers, content=body)
+        assert response.status_code == 413
+
+    def test_export_indicators(self, auth_token, admin_token, test_zone, test_source):
+        """Test streaming export as NDJSON and CSV with filters"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        for i, ind_type in enumerate(["co2", "energy", "co2"]):
+            indicator_data = {
+                "type": ind_type,
+                "value": 100.0 + i,
+                "unit": "test",
+                "timestamp": f"2025-11-2{i}T10:00:00",
+                "zone_id": test_zone.id,
+                "source_id": test_source.id,
+                "extra_data": {"parameter": "total"}
+            }
+            client.post("/indicators/", headers=headers, json=indicator_data)
+        
+        user_headers = {"Authorization": f"Bearer {auth_token}"}
+        response = client.get("/indicators/export?format=ndjson&type=co2", headers=user_headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row["value"] for row in rows] == [100.0, 102.0]
+        assert rows[0]["extra_data"] == {"parameter": "total"}
+        
+        response = client.get("/indicators/export?format=csv", headers=user_headers)
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert lines[0].startswith("id,type,value")
+        assert len(lines) == 4
+        
+        response = client.get("/indicators/export?format=xml", headers=user_headers)
+        assert response.status_code == 400
+
+    def test_export_indicators_columnar(self, auth_token, admin_token, test_zone, test_source):
+        """Test Arrow IPC and Parquet exports keep types and dictionary-encode parameter"""
+        pa = pytest.importorskip("pyarrow")
+        import io
+        import pyarrow.parquet as pq
+        
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        items = [
+            {
+                "type": "air_quality",
+                "value": float(i),
+                "unit": "µg/m³",
+                "timestamp": f"2025-11-20T{i:02d}:00:00",
+                "zone_id": test_zone.id,
+                "source_id": test_source.id,
+                "extra_data": {"parameter": "PM10" if i % 2 else "PM2.5"}
+            }
+            for i in range(4)
+        ]
+        client.post("/indicators/bulk", headers=headers, json=items)
+        
+        user_headers = {"Authorization": f"Bearer {auth_token}"}
+        response = client.get("/indicators/export?format=arrow", headers=user_headers)
+        assert response.status_code == 200
+        table = pa.ipc.open_stream(response.content).read_all()
+        assert table.num_rows == 4
+        assert pa.types.is_dictionary(table.schema.field("parameter").type)
+        assert pa.types.is_timestamp(table.schema.field("timestamp").type)
+        assert table.column("parameter").to_pylist() == ["PM2.5", "PM10", "PM2.5", "PM10"]
+        
+        response = client.get("/indicators/export?format=parquet", headers=user_headers)
+        assert response.status_code == 200
+        table = pq.read_table(io.BytesIO(response.content))
+        assert table.column("value").to_pylist() == [0.0, 1.0, 2.0, 3.0]
+
+    def test_indicator_stream(self, admin_token, test_zone, test_source):
+        """Test that created indicators are pushed to matching stream subscribers"""
+        assert client.get("/indicators/stream").status_code == 401
+        assert client.get("/indicators/stream?access_token=invalid").status_code == 401
+
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        indicator_data = {
+            "type": "co2",
+            "value": 10.0,
+            "unit": "tonnes",
+            "timestamp": "2025-11-20T10:00:00",
+            "zone_id": test_zone.id,
+            "source_id": test_source.id
+        }
+
+        async def next_event(stream):
+            while True:
+                message = await stream.__anext__()
+                if message.startswith("event:"):
+                    event, data = message.strip().split("\n")
+                    return event[len("event: "):], json.loads(data[len("data: "):])
+
+        async def scenario():
+            # A stream closed before its first chunk never subscribes
+            unstarted = indicator_events(["co2"], [test_zone.id])
+            await unstarted.aclose()
+            assert events.broker.subscriber_count == 0
+
+            stream = indicator_events(["co2"], [test_zone.id], keepalive=0.05)
+            assert await stream.__anext__() == "retry: 5000\n\n"
+            assert events.broker.subscriber_count == 1
+
+            # The API runs in the test client's thread, events cross over to this loop
+            await asyncio.to_thread(client.post, "/indicators/", headers=headers,
+                                    json=dict(indicator_data, type="temperature"))
+            await asyncio.to_thread(client.post, "/indicators/bulk", headers=headers,
+                                    json=[indicator_data, dict(indicator_data, value=30.0)])
+
+            event, data = await next_event(stream)
+            assert event == "indicators"
+            assert [item["value"] for item in data] == [10.0, 30.0]
+            assert all(item["id"] and item["type"] == "co2" for item in data)
+            event, data = await next_event(stream)
+            assert event == "summary"
+            assert data == [{"type": "co2", "count": 2, "sum": 40.0, "min": 10.0, "max": 30.0}]
+
+            await stream.aclose()
+            assert events.broker.subscriber_count == 0
+
+            # A subscriber that falls behind gets a resync instead of the backlog
+            lagging = events.Subscription(asyncio.get_running_loop(), maxsize=1)
+            for _ in range(3):
+                lagging._deliver([indicator_data])
+            assert await lagging.get() == events.RESYNC
+            assert await lagging.get(timeout=0.01) is None
+
+        asyncio.run(scenario())
+
 
 class TestStatistics:
     """Test statistics endpoints"""
@@ -366,7 +697,205 @@ class TestStatistics:
         stats = response.json()
         assert isinstance(stats, list)
         assert len(stats) >= 1
-    
+
+    def test_conditional_get(self, auth_token, admin_token, test_zone, test_source):
+        """Test ETag / Last-Modified revalidation of stats and listings"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        user_headers = {"Authorization": f"Bearer {auth_token}"}
+        indicator_data = {
+            "type": "co2",
+            "value": 10.0,
+            "unit": "test",
+            "timestamp": "2025-11-20T10:00:00",
+            "zone_id": test_zone.id,
+            "source_id": test_source.id
+        }
+        client.post("/indicators/", headers=headers, json=indicator_data)
+
+        for path in ("/stats/summary", "/stats/co2/trend", "/stats/air/averages", "/indicators/?limit=10"):
+            response = client.get(path, headers=user_headers)
+            assert response.status_code == 200
+            etag = response.headers["ETag"]
+            last_modified = response.headers["Last-Modified"]
+
+            response = client.get(path, headers={**user_headers, "If-None-Match": etag})
+            assert response.status_code == 304
+            assert response.content == b""
+            assert response.headers["ETag"] == etag
+            response = client.get(path, headers={**user_headers, "If-Modified-Since": last_modified})
+            assert response.status_code == 304
+
+        # Any indicator write changes the tag
+        client.post("/indicators/", headers=headers, json=dict(indicator_data, value=20.0))
+        response = client.get("/stats/summary", headers={**user_headers, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert response.json()[0]["count"] == 2
+
+        # Revalidation still requires authentication
+        response = client.get("/stats/summary", headers={"If-None-Match": response.headers["ETag"]})
+        assert response.status_code == 401
+
+    def test_dashboard(self, auth_token, admin_token, test_zone, test_source):
+        """Test the dashboard endpoint matches the individual stats endpoints"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        user_headers = {"Authorization": f"Bearer {auth_token}"}
+        for ind_type, value, day in [("air_quality", 20.0, 20), ("air_quality", 40.0, 21),
+                                     ("co2", 5.0, 20), ("co2", 7.0, 21), ("energy", 1.0, 21)]:
+            client.post("/indicators/", headers=headers, json={
+                "type": ind_type,
+                "value": value,
+                "unit": "test",
+                "timestamp": f"2025-11-{day}T10:00:00",
+                "zone_id": test_zone.id,
+                "source_id": test_source.id
+            })
+
+        response = client.get("/stats/dashboard?recent=3", headers=user_headers)
+        assert response.status_code == 200
+        assert "ETag" in response.headers
+        dashboard = response.json()
+        assert dashboard["summary"] == client.get("/stats/summary", headers=user_headers).json()
+        assert dashboard["co2_trend"] == client.get("/stats/co2/trend?period=daily", headers=user_headers).json()
+        assert dashboard["air_averages"] == client.get("/stats/air/averages", headers=user_headers).json()
+        assert dashboard["co2_trend"]["series"] == [5.0, 7.0]
+        assert dashboard["zone_count"] == 1
+        assert dashboard["zone_comparison"] == [{
+            "zone_id": test_zone.id,
+            "name": test_zone.name,
+            "count": 5,
+            "averages": {"air_quality": 30.0, "co2": 6.0, "energy": 1.0}
+        }]
+        recent = dashboard["recent_indicators"]
+        assert len(recent) == 3
+        assert [item["timestamp"] for item in recent] == sorted((item["timestamp"] for item in recent), reverse=True)
+
+        response = client.get("/stats/dashboard", headers={**user_headers, "If-None-Match": response.headers["ETag"]})
+        assert response.status_code == 304
+
+    def test_timeseries(self, db, auth_token, test_zone, test_source):
+        """Test bucketed series from raw rows and rollups, grouping and gap filling"""
+        start = datetime(2025, 11, 3)  # A Monday
+        for minutes, type_, value in [(0, "co2", 1.0), (7, "co2", 3.0), (20, "co2", 5.0), (65, "co2", 7.0),
+                                      (2 * 1440 + 30, "co2", 9.0), (10, "energy", 4.0), (40 * 1440, "co2", 2.0)]:
+            crud.create_indicator(db, schemas.IndicatorCreate(
+                type=type_, value=value, unit="u", timestamp=start + timedelta(minutes=minutes),
+                zone_id=test_zone.id, source_id=test_source.id
+            ))
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        response = client.get("/stats/timeseries?bucket=15min&agg=sum&type=co2&to=2025-11-04T00:00:00", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["source"] == "raw"
+        assert data["labels"] == ["2025-11-03T00:00:00", "2025-11-03T00:15:00", "2025-11-03T01:00:00"]
+        assert data["series"] == [{"type": "co2", "data": [4.0, 5.0, 7.0]}]
+        
+        response = client.get("/stats/timeseries?bucket=1h&agg=count&group_by=&fill=zero"
+                              "&from=2025-11-03T00:00:00&to=2025-11-03T03:59:00", headers=headers)
+        data = response.json()
+        assert data["source"] == "hour"
+        assert len(data["labels"]) == 4
+        assert data["series"] == [{"data": [4, 1, 0, 0]}]
+        
+        response = client.get("/stats/timeseries?bucket=1d&agg=max&type=co2&type=energy&fill=null"
+                              "&from=2025-11-03T00:00:00&to=2025-11-05T23:59:59", headers=headers)
+        data = response.json()
+        assert data["labels"] == ["2025-11-03T00:00:00", "2025-11-04T00:00:00", "2025-11-05T00:00:00"]
+        assert data["series"] == [{"type": "co2", "data": [7.0, None, 9.0]}, {"type": "energy", "data": [4.0, None, None]}]
+        
+        response = client.get("/stats/timeseries?bucket=1w&agg=avg&type=co2", headers=headers)
+        assert response.json()["labels"] == ["2025-11-03T00:00:00", "2025-12-08T00:00:00"]
+        assert response.json()["series"][0]["data"] == [5.0, 2.0]
+        response = client.get("/stats/timeseries?bucket=1mo&agg=sum&group_by=zone_id,type&fill=zero", headers=headers)
+        data = response.json()
+        assert data["source"] == "day"
+        assert data["labels"] == ["2025-11-01T00:00:00", "2025-12-01T00:00:00"]
+        assert data["series"][0] == {"zone_id": test_zone.id, "type": "co2", "data": [25.0, 2.0]}
+        
+        # Raw SQL buckets agree with the rollups
+        hourly = timeseries.parse_bucket("1h")
+        assert timeseries._raw_buckets(db, hourly, ("type",), None, None, None, None, None) == {
+            key + (bucket_start,): agg
+            for key, buckets in timeseries.aggregate_buckets(db, hourly).items()
+            for bucket_start, agg in buckets.items()
+        }
+        
+        for query in ("bucket=1min", "bucket=2mo", "bucket=32d", "bucket=7min", "agg=median", "fill=previous",
+                      "group_by=unit", "bucket=5min&from=2020-01-01T00:00:00&to=2025-01-01T00:00:00&fill=null"):
+            assert client.get(f"/stats/timeseries?{query}", headers=headers).status_code == 400, query
+
+    def test_downsampling(self, db, auth_token, test_zone, test_source):
+        """Test LTTB against a reference implementation, min/max envelopes and max_points on the endpoints"""
+        import numpy as np
+        
+        def reference_lttb(x, y, n):
+            size = len(x)
+            every = (size - 2) / (n - 2)
+            selected, a = [0], 0
+            for i in range(n - 2):
+                low, high = int(i * every) + 1, int((i + 1) * every) + 1
+                next_low, next_high = high, min(int((i + 2) * every) + 1, size - 1)
+                if next_low >= next_high:
+                    avg_x, avg_y = x[-1], y[-1]
+                else:
+                    avg_x = sum(x[next_low:next_high]) / (next_high - next_low)
+                    avg_y = sum(y[next_low:next_high]) / (next_high - next_low)
+                areas = [abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a])) for j in range(low, high)]
+                a = low + areas.index(max(areas))
+                selected.append(a)
+            return selected + [size - 1]
+        
+        rng = np.random.default_rng(3)
+        x = np.arange(1000, dtype=float)
+        y = np.cumsum(rng.normal(size=1000))
+        assert downsampling.lttb(x, y, 50).tolist() == reference_lttb(list(x), list(y), 50)
+        assert downsampling.lttb(x, y, 2000).tolist() == list(range(1000))
+        
+        picked = downsampling.minmax(x, y, 100)
+        assert len(picked) <= 100
+        assert int(np.argmax(y)) in picked and int(np.argmin(y)) in picked
+        assert list(picked) == sorted(picked)
+
+        # More series than max_points / 2 (some sparse) still keep at most max_points
+        columns = [[None if (i + k) % 7 == 0 else float(v) for i, v in enumerate(rng.normal(size=1000))] for k in range(300)]
+        for max_points in (10, 60, 100, 250):
+            for method in ("lttb", "minmax"):
+                keep = downsampling.select_points(list(x), columns, max_points, method)
+                assert 0 < len(keep) <= max_points
+                assert list(keep) == sorted(set(keep))
+        assert len(downsampling.select_points(list(x), [[None] * 1000] * 300, 10, "lttb")) == 0
+
+        crud.create_indicators_bulk(db, [
+            schemas.IndicatorCreate(
+                type=type_, value=float((hour * 37) % 101) + offset, unit="u",
+                timestamp=datetime(2025, 11, 1) + timedelta(hours=hour),
+                zone_id=test_zone.id, source_id=test_source.id
+            )
+            for hour in range(500)
+            for type_, offset in (("temperature", 0.0), ("co2", 1.0))
+        ])
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        full = client.get("/stats/timeseries?bucket=1h&type=temperature", headers=headers).json()
+        assert full["downsampling"] is None
+        assert len(full["labels"]) == 500
+        for method in ("lttb", "minmax"):
+            response = client.get(f"/stats/timeseries?bucket=1h&max_points=60&downsample={method}", headers=headers)
+            assert response.status_code == 200
+            data = response.json()
+            assert data["downsampling"] == method
+            assert len(data["labels"]) <= 60
+            # Kept points are original buckets with their original values
+            by_label = dict(zip(full["labels"], full["series"][0]["data"]))
+            temperature = next(item for item in data["series"] if item["type"] == "temperature")
+            assert all(by_label[label] == value for label, value in zip(data["labels"], temperature["data"]))
+        
+        response = client.get("/stats/co2/trend?period=daily&max_points=5", headers=headers)
+        assert len(response.json()["labels"]) == 5
+        assert client.get("/stats/timeseries?max_points=10&downsample=mean", headers=headers).status_code == 400
+        assert client.get("/stats/co2/trend?max_points=1", headers=headers).status_code == 422
+
     def test_air_quality_averages(self, auth_token, admin_token, test_zone, test_source):
         """Test air quality averages endpoint"""
         # Create air quality indicators
@@ -416,6 +945,277 @@ class TestStatistics:
         assert "series" in data
 
 
+
+class TestRollups:
+    """Test that rollups stay consistent with the raw indicators"""
+    
+    def raw_aggregate(self, db, from_date=None, to_date=None):
+        query = db.query(
+            models.Indicator.zone_id,
+            func.count(models.Indicator.id),
+            func.sum(models.Indicator.value),
+            func.min(models.Indicator.value),
+            func.max(models.Indicator.value)
+        )
+        if from_date:
+            query = query.filter(models.Indicator.timestamp >= from_date)
+        if to_date:
+            query = query.filter(models.Indicator.timestamp <= to_date)
+        return {
+            (zone_id,): (count, round(total, 6), low, high)
+            for zone_id, count, total, low, high in query.group_by(models.Indicator.zone_id).all()
+        }
+    
+    def rollup_aggregate(self, db, from_date=None, to_date=None):
+        results = rollups.aggregate(db, group_by=("zone_id",), from_date=from_date, to_date=to_date)
+        return {
+            key: (agg.count, round(agg.sum, 6), agg.min, agg.max)
+            for key, agg in results.items()
+        }
+    
+    def test_rollups_match_raw_aggregates(self, db, test_zone, test_source):
+        """Test rollup aggregates against raw SQL after creates, updates and deletes"""
+        start = datetime(2025, 11, 1)
+        created = []
+        for i in range(60):
+            created.append(crud.create_indicator(db, schemas.IndicatorCreate(
+                type="air_quality",
+                value=float((i * 7) % 23),
+                unit="µg/m³",
+                timestamp=start + timedelta(minutes=95 * i),
+                zone_id=test_zone.id,
+                source_id=test_source.id,
+                extra_data={"parameter": "PM10" if i % 2 else "PM2.5"}
+            )))
+        
+        # Delete a reading and move another one to a new bucket with a new maximum
+        crud.delete_indicator(db, created[3].id)
+        crud.update_indicator(db, created[10].id, schemas.IndicatorUpdate(
+            value=99.0, timestamp=start + timedelta(days=3, minutes=10)
+        ))
+        
+        ranges = [
+            (None, None),
+            (start + timedelta(hours=5, minutes=30), None),
+            (None, start + timedelta(days=2, hours=3, minutes=1)),
+            (start + timedelta(hours=5, minutes=30), start + timedelta(days=2, hours=3, minutes=1)),
+            (start + timedelta(hours=2), start + timedelta(hours=2, minutes=40)),
+            (start + timedelta(days=1), start + timedelta(days=3)),
+        ]
+        for from_date, to_date in ranges:
+            assert self.rollup_aggregate(db, from_date, to_date) == self.raw_aggregate(db, from_date, to_date)
+        
+        # A rebuild produces the same rollups as the incremental updates
+        before = self.rollup_aggregate(db)
+        rollups.rebuild_rollups(db)
+        assert self.rollup_aggregate(db) == before
+
+    def test_upsert_indicators(self, db, test_zone, test_source):
+        """Test natural key upserts skip or update stored readings and keep rollups and latest values exact"""
+        from datetime import timezone
+        
+        start = datetime(2025, 11, 1)
+        
+        def reading(i, value, aware=False):
+            timestamp = start + timedelta(minutes=50 * i)
+            return schemas.IndicatorCreate(
+                type="temperature", value=value, unit="°C", zone_id=test_zone.id, source_id=test_source.id,
+                timestamp=timestamp.replace(tzinfo=timezone.utc) if aware else timestamp,
+                extra_data={"parameter": "temperature_2m"}
+            )
+        
+        first = [reading(i, float(i % 13)) for i in range(80)]
+        assert crud.upsert_indicators(db, first) == {"inserted": 80, "updated": 0, "skipped": 0}
+        
+        # Same readings (timezone-aware timestamps included) are skipped without update
+        assert crud.upsert_indicators(db, [reading(i, 50.0, aware=True) for i in range(10)]) == \
+            {"inserted": 0, "updated": 0, "skipped": 10}
+        
+        # With update, changed values replace the stored ones; the last duplicate in a batch wins
+        batch = [reading(i, float(i % 13)) for i in range(70, 100)]
+        batch[0] = reading(70, 99.0)
+        batch[1] = reading(71, -5.0)
+        batch.append(reading(75, 42.0))
+        result = crud.upsert_indicators(db, batch, update=True)
+        assert result == {"inserted": 20, "updated": 3, "skipped": 7}
+        
+        assert db.query(models.Indicator).count() == 100
+        values = dict(db.query(models.Indicator.timestamp, models.Indicator.value))
+        assert values[start + timedelta(minutes=50 * 70)] == 99.0
+        assert values[start + timedelta(minutes=50 * 75)] == 42.0
+        assert values[start] == 0.0
+        assert self.rollup_aggregate(db) == self.raw_aggregate(db)
+        (latest_row,) = latest.latest_values(db)
+        assert latest_row.value_count == 100
+        assert latest_row.value == float(99 % 13)
+    
+    def test_deduplicate_indicators(self, db, test_zone, test_source):
+        """Test the natural key index is only created on existing tables once duplicates are removed"""
+        from sqlalchemy import text
+        from app.database import upgrade_schema
+        
+        # A database created before the unique index, with a reading stored twice
+        db.execute(text("DROP INDEX uq_indicators_natural_key"))
+        db.commit()
+        for value in (1.0, 2.0, 3.0):
+            db.add(models.Indicator(type="co2", value=value, unit="ppm", timestamp=datetime(2025, 11, 1),
+                                    zone_id=test_zone.id, source_id=test_source.id,
+                                    extra_data={"parameter": "co2" if value < 3 else "co2e"}))
+        db.add(models.Indicator(type="co2", value=4.0, unit="ppm", timestamp=datetime(2025, 11, 1),
+                                zone_id=test_zone.id, source_id=test_source.id))
+        db.commit()
+        rollups.rebuild_rollups(db)
+        
+        added = upgrade_schema(engine)
+        assert "uq_indicators_natural_key" in added
+        assert crud.deduplicate_indicators(db) == 1
+        assert sorted(value for (value,) in db.query(models.Indicator.value)) == [1.0, 3.0, 4.0]
+        assert self.rollup_aggregate(db) == self.raw_aggregate(db)
+        assert "uq_indicators_natural_key" not in upgrade_schema(engine)
+        
+        # Readings without parameter have no natural key
+        crud.create_indicator(db, schemas.IndicatorCreate(type="co2", value=4.0, unit="ppm",
+                                                          timestamp=datetime(2025, 11, 1),
+                                                          zone_id=test_zone.id, source_id=test_source.id))
+        assert db.query(models.Indicator).count() == 4
+    
+    def test_sketch_quantiles(self, db, auth_token, test_zone, test_source):
+        """Test sketch quantiles stay within the relative accuracy of exact ones through writes and rebuilds"""
+        import numpy as np
+        
+        rng = np.random.default_rng(11)
+        start = datetime(2025, 11, 1)
+        values = np.concatenate([rng.lognormal(3, 1, 400), rng.normal(0, 5, 100), [0.0]])
+        crud.create_indicators_bulk(db, [
+            schemas.IndicatorCreate(type="air_quality", value=float(value), unit="µg/m³",
+                                    timestamp=start + timedelta(minutes=17 * i),
+                                    zone_id=test_zone.id, source_id=test_source.id)
+            for i, value in enumerate(values)
+        ])
+        first = db.query(models.Indicator).order_by(models.Indicator.id).first()
+        crud.update_indicator(db, first.id, schemas.IndicatorUpdate(value=5000.0))
+        crud.delete_indicator(db, first.id + 1)
+        
+        def check(from_date=None, to_date=None):
+            query = db.query(models.Indicator.value)
+            if from_date:
+                query = query.filter(models.Indicator.timestamp >= from_date)
+            if to_date:
+                query = query.filter(models.Indicator.timestamp <= to_date)
+            exact = np.sort([value for (value,) in query])
+            sketch = sketches.sketches(db, from_date=from_date, to_date=to_date)[()]
+            assert sketch.count == len(exact)
+            for q in (0.01, 0.25, 0.5, 0.9, 0.95, 0.99):
+                expected = exact[int(q * (len(exact) - 1))]
+                assert abs(sketch.quantile(q) - expected) <= sketches.RELATIVE_ACCURACY * abs(expected) + 1e-9
+        
+        check()
+        check(start + timedelta(hours=7, minutes=30), start + timedelta(days=4, hours=2, minutes=5))
+        
+        before = {key: dict(sketch.bins) for key, sketch in sketches.sketches(db, group_by=("zone_id",), bucket="hour").items()}
+        rollups.rebuild_rollups(db)
+        after = {key: dict(sketch.bins) for key, sketch in sketches.sketches(db, group_by=("zone_id",), bucket="hour").items()}
+        assert after == before
+        
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = client.get("/stats/summary?quantiles=0.5,0.95,0.99", headers=headers)
+        assert response.status_code == 200
+        (summary,) = response.json()
+        assert set(summary["quantiles"]) == {"p50", "p95", "p99"}
+        assert summary["min"] <= summary["quantiles"]["p50"] <= summary["quantiles"]["p95"] <= summary["max"]
+        assert "quantiles" not in client.get("/stats/summary", headers=headers).json()[0]
+        assert client.get("/stats/summary?quantiles=95", headers=headers).status_code == 400
+        
+        for bucket in ("1d", "30min"):
+            data = client.get(f"/stats/timeseries?bucket={bucket}&agg=p95", headers=headers).json()
+            maxima = client.get(f"/stats/timeseries?bucket={bucket}&agg=max", headers=headers).json()
+            assert data["labels"] == maxima["labels"]
+            assert all(p95 <= high for p95, high in zip(data["series"][0]["data"], maxima["series"][0]["data"]))
+        assert client.get("/stats/timeseries?agg=p101", headers=headers).status_code == 400
+
+    def test_hot_window(self, db, auth_token, test_zone, test_source, monkeypatch):
+        """Test recent ranges are answered from the in-memory window with the same results as the rollups"""
+        from app.cache import bump_generation
+        from app.hotwindow import hot_window
+        
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        now = datetime.utcnow().replace(microsecond=0)
+        crud.create_indicators_bulk(db, [
+            schemas.IndicatorCreate(type=("air_quality", "co2")[i % 2], value=float((i * 37) % 101) - 20,
+                                    unit="u", timestamp=now - timedelta(minutes=41 * i),
+                                    zone_id=test_zone.id, source_id=test_source.id,
+                                    extra_data={"parameter": "pm25"} if i % 3 == 0 else None)
+            for i in range(300)
+        ])
+        since = (now - timedelta(days=3, minutes=7)).isoformat()
+        urls = [
+            f"/stats/summary?from={since}&quantiles=0.5,0.9",
+            f"/stats/air/averages?from={since}&to={(now - timedelta(hours=5)).isoformat()}",
+            f"/stats/timeseries?from={since}&bucket=1h&group_by=type,parameter",
+            f"/stats/timeseries?from={since}&bucket=15min&agg=p95",
+            f"/stats/timeseries?from={since}&bucket=1mo&agg=count&fill=zero",
+        ]
+        from_rollups = [client.get(url, headers=headers).json() for url in urls]
+        
+        def close(actual, expected, rel):
+            if isinstance(expected, dict):
+                assert set(actual) == set(expected)
+                for key in expected:
+                    close(actual[key], expected[key], rel)
+            elif isinstance(expected, list):
+                assert len(actual) == len(expected)
+                for a, e in zip(actual, expected):
+                    close(a, e, rel)
+            elif isinstance(expected, float):
+                assert actual == pytest.approx(expected, rel=rel, abs=1e-9)
+            else:
+                assert actual == expected
+        
+        monkeypatch.setattr(hot_window, "days", 7)
+        from_memory = [client.get(url, headers=headers).json() for url in urls]
+        assert hot_window.loads == 1
+        for url, expected, actual in zip(urls, from_rollups, from_memory):
+            if "source" in actual:
+                assert actual.pop("source") == "memory"
+                expected.pop("source")
+            # Quantiles from the rollups are sketches, within their relative accuracy of the exact ones
+            close(actual, expected, 2 * sketches.RELATIVE_ACCURACY if "quantiles" in url or "agg=p" in url else 1e-9)
+        
+        # crud writes are applied in place
+        first = db.query(models.Indicator).order_by(models.Indicator.id).first()
+        crud.update_indicator(db, first.id, schemas.IndicatorUpdate(value=1000.0))
+        crud.delete_indicator(db, first.id + 2)
+        crud.create_indicator(db, schemas.IndicatorCreate(type="energy", value=3.0, unit="kWh", timestamp=now,
+                                                          zone_id=test_zone.id, source_id=test_source.id))
+        summary = client.get(urls[0], headers=headers).json()
+        assert hot_window.loads == 1
+        by_type = {item["type"]: item for item in summary}
+        assert by_type["air_quality"]["max"] == 1000.0
+        assert by_type["energy"]["count"] == 1
+        monkeypatch.setattr(hot_window, "days", 0)
+        close(summary, client.get(urls[0], headers=headers).json(), 2 * sketches.RELATIVE_ACCURACY)
+        monkeypatch.setattr(hot_window, "days", 7)
+        
+        # Writes from elsewhere trigger a reload, ranges before the window go to the database
+        db.add(models.Indicator(type="energy", value=5.0, unit="kWh", timestamp=now,
+                                zone_id=test_zone.id, source_id=test_source.id))
+        bump_generation(db, "indicators")
+        db.commit()
+        summary = client.get(urls[0], headers=headers).json()
+        assert hot_window.loads == 2
+        assert {item["type"]: item["count"] for item in summary}["energy"] == 2
+        old = (now - timedelta(days=8)).isoformat()
+        assert client.get(f"/stats/timeseries?from={old}", headers=headers).json()["source"] == "day"
+        
+        # Over the memory budget, the oldest days are evicted and no longer answered from memory
+        monkeypatch.setattr(hot_window, "max_bytes", 100 * hotwindow.ROW_BYTES)
+        crud.create_indicator(db, schemas.IndicatorCreate(type="energy", value=4.0, unit="kWh", timestamp=now,
+                                                          zone_id=test_zone.id, source_id=test_source.id))
+        stats = hot_window.stats()
+        assert stats["bytes"] <= 100 * hotwindow.ROW_BYTES
+        assert stats["start"] > since
+        assert client.get(urls[2], headers=headers).json()["source"] == "hour"
+
 class TestZones:
     """Test zone endpoints"""
     
@@ -426,6 +1226,140 @@ class TestZones:
         assert response.status_code == 200
         assert isinstance(response.json(), list)
     
+    def test_zones_latest(self, db, auth_token, test_zone, test_source):
+        """Test the latest values per zone stay in sync with creates, bulk inserts, updates and deletes"""
+        start = datetime(2025, 11, 1)
+        created = [
+            crud.create_indicator(db, schemas.IndicatorCreate(
+                type=type_, value=value, unit="u", timestamp=start + timedelta(hours=hour),
+                zone_id=test_zone.id, source_id=test_source.id, extra_data=extra
+            ))
+            for type_, value, hour, extra in [
+                ("air_quality", 10.0, 1, {"parameter": "PM10"}),
+                ("air_quality", 30.0, 3, {"parameter": "PM10"}),
+                ("air_quality", 20.0, 2, {"parameter": "PM2.5"}),
+                ("co2", 5.0, 1, None),
+            ]
+        ]
+        crud.create_indicators_bulk(db, [
+            schemas.IndicatorCreate(type="co2", value=value, unit="kg", timestamp=start + timedelta(hours=hour),
+                                    zone_id=test_zone.id, source_id=test_source.id)
+            for value, hour in [(7.0, 5), (3.0, 0)]
+        ])
+        # The latest PM10 reading moves back in time, the PM2.5 one is deleted
+        crud.update_indicator(db, created[1].id, schemas.IndicatorUpdate(timestamp=start))
+        crud.delete_indicator(db, created[2].id)
+        
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = client.get("/zones/latest", headers=headers)
+        assert response.status_code == 200
+        (zone,) = response.json()
+        assert zone["id"] == test_zone.id
+        assert zone["count"] == 5
+        assert zone["average"] == pytest.approx(55.0 / 5)
+        assert [(item["type"], item["parameter"], item["value"], item["count"]) for item in zone["latest"]] == [
+            ("air_quality", "PM10", 10.0, 2),
+            ("co2", None, 7.0, 3),
+        ]
+        assert zone["latest"][1]["unit"] == "kg"
+        assert zone["latest"][1]["average"] == pytest.approx(5.0)
+        
+        response = client.get("/zones/latest?type=co2", headers=headers)
+        assert [item["type"] for item in response.json()[0]["latest"]] == ["co2"]
+        assert response.json()[0]["count"] == 3
+        
+        # Deletes are applied incrementally, the latest row is only looked up when it was deleted
+        statements = []
+        capture = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            co2 = {row.value: row for row in db.query(models.Indicator).filter(models.Indicator.type == "co2")}
+            crud.delete_indicator(db, co2[3.0].id)
+            older = list(statements)
+            crud.delete_indicator(db, co2[7.0].id)
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        assert not any("ORDER BY indicators.timestamp DESC" in statement for statement in older)
+        assert any("ORDER BY indicators.timestamp DESC" in statement for statement in statements[len(older):])
+        response = client.get("/zones/latest?type=co2", headers=headers)
+        assert [(item["value"], item["count"]) for item in response.json()[0]["latest"]] == [(5.0, 1)]
+        
+        # A rebuild produces the same rows as the incremental updates
+        before = [
+            (row.zone_id, row.type, row.parameter, row.value, row.timestamp, row.value_count, row.value_sum)
+            for row in latest.latest_values(db)
+        ]
+        latest.rebuild_latest(db)
+        assert [
+            (row.zone_id, row.type, row.parameter, row.value, row.timestamp, row.value_count, row.value_sum)
+            for row in latest.latest_values(db)
+        ] == before
+    
+    def test_zones_spatial_queries(self, auth_token, admin_token):
+        """Test bounding box and nearest zone queries, including after a zone moves"""
+        admin_headers = {"Authorization": f"Bearer {admin_token}"}
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        polygon = json.dumps({"type": "Polygon", "coordinates": [[[2.2, 48.8], [2.5, 48.8], [2.5, 48.9], [2.2, 48.8]]]})
+        ids = {}
+        for name, geom in [("Paris", "48.8566,2.3522"), ("Lyon", "45.7640, 4.8357"), ("Marseille", "43.2965,5.3698"),
+                           ("Paris polygon", polygon), ("Unknown", None), ("Broken", "north,east")]:
+            response = client.post("/zones/", headers=admin_headers, json={"name": name, "geom": geom})
+            ids[name] = response.json()["id"]
+        
+        zone = client.get(f"/zones/{ids['Paris polygon']}", headers=headers).json()
+        assert zone["bbox"] == [2.2, 48.8, 2.5, 48.9]
+        assert (zone["latitude"], zone["longitude"]) == pytest.approx((48.85, 2.35))
+        assert client.get(f"/zones/{ids['Broken']}", headers=headers).json()["latitude"] is None
+        
+        response = client.get("/zones/?bbox=2,48,3,49", headers=headers)
+        assert response.status_code == 200
+        assert [item["id"] for item in response.json()["items"]] == [ids["Paris"], ids["Paris polygon"]]
+        assert response.json()["total"] == 2
+        # The polygon intersects the box without its centre being in it
+        response = client.get("/zones/?bbox=2.45,48.85,3,49", headers=headers)
+        assert [item["id"] for item in response.json()["items"]] == [ids["Paris polygon"]]
+        response = client.get("/zones/?bbox=0,40,10,50&limit=2", headers=headers)
+        assert response.json()["total"] == 4
+        assert response.json()["has_next"] is True
+        assert client.get("/zones/?bbox=1,2,3", headers=headers).status_code == 400
+        
+        response = client.get("/zones/nearest?lat=45.5&lon=4.9&k=2", headers=headers)
+        assert response.status_code == 200
+        nearest = response.json()
+        assert [item["name"] for item in nearest] == ["Lyon", "Marseille"]
+        assert nearest[0]["distance_km"] == pytest.approx(
+            spatial.haversine_km(45.5, 4.9, 45.7640, 4.8357)
+        )
+        
+        # Moving a zone rebuilds the index
+        client.put(f"/zones/{ids['Marseille']}", headers=admin_headers, json={"geom": "45.6,4.9"})
+        response = client.get("/zones/nearest?lat=45.5&lon=4.9&k=1", headers=headers)
+        assert response.json()[0]["name"] == "Marseille"
+        response = client.get("/zones/latest?bbox=4,45,6,46", headers=headers)
+        assert [zone["name"] for zone in response.json()] == ["Lyon", "Marseille"]
+    
+    def test_zone_grid_matches_brute_force(self):
+        """Test grid lookups against a linear scan, across the antimeridian and near the poles"""
+        import random
+        rng = random.Random(7)
+        positions = []
+        for zone_id in range(2000):
+            lat, lon = rng.uniform(-89.9, 89.9), rng.uniform(-180, 180)
+            positions.append(spatial.ZonePosition(zone_id, lat, lon, lat, lon, lat, lon))
+        grid = spatial.ZoneGrid(positions, cell_degrees=2.0)
+        
+        for lat, lon, k in [(48.85, 2.35, 5), (0.0, 179.9, 10), (-89.5, -10.0, 3), (10.0, -100.0, 1)]:
+            expected = sorted((spatial.haversine_km(lat, lon, p.latitude, p.longitude), p.id) for p in positions)[:k]
+            assert grid.nearest(lat, lon, k) == [(zone_id, distance) for distance, zone_id in expected]
+        
+        for west, south, east, north in [(-10.0, 40.0, 20.0, 60.0), (170.0, -20.0, -170.0, 20.0)]:
+            expected = sorted(
+                p.id for p in positions
+                if south <= p.latitude <= north
+                and ((west <= p.longitude <= east) if west <= east else (p.longitude >= west or p.longitude <= east))
+            )
+            assert grid.in_bbox(west, south, east, north) == expected
+    
     def test_create_zone_as_admin(self, admin_token):
         """Test creating zone as admin"""
         headers = {"Authorization": f"Bearer {admin_token}"}
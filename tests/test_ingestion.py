@@ -0,0 +1,510 @@
+"""
+Ingestion tests
+
+Runs the Open-Meteo and OpenAQ ingestors against a local HTTP server serving
+recorded payloads (tests/fixtures), so no test depends on the real APIs.
+"""
+
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+import pytest
+from sqlalchemy import func, select
+from app.database import SessionLocal
+from app import crud, latest, models, rollups, schemas
+from ingestion import fetching, mock_data_ingestion, openaq_ingestion, openmeteo_ingestion, scheduler
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+class StubUpstream:
+    """
+    Serves a recorded payload per path after a delay, recording requests and
+    concurrency. A payload can be a function of the parsed query string.
+    """
+
+    def __init__(self, payloads, delay=0.0, failing=()):
+        self.payloads = payloads
+        self.delay = delay
+        # Query strings answered with a 500
+        self.failing = set(failing)
+        self.requests = []
+        self.started = []
+        self.clients = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                with stub._lock:
+                    stub.requests.append((url.path, parse_qs(url.query), dict(self.headers)))
+                    stub.started.append(time.monotonic())
+                    stub.clients.add(self.client_address)
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                time.sleep(stub.delay)
+                with stub._lock:
+                    stub.in_flight -= 1
+                body = stub.payloads.get(url.path)
+                if callable(body):
+                    body = body(parse_qs(url.query))
+                status = 200
+                if body is None or any(part in url.query for part in stub.failing):
+                    status, body = 500, b'{"error": "stub failure"}'
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _cities(count, coordinates=False):
+    cities = []
+    for i in range(count):
+        latitude, longitude = 43.0 + i * 0.25, 1.0 + i * 0.5
+        position = {"latitude": latitude, "longitude": longitude}
+        cities.append({"name": f"City {i}", **({"coordinates": position} if coordinates else position)})
+    return cities
+
+
+def _indicator_counts():
+    db = SessionLocal()
+    try:
+        return dict(
+            db.query(models.Zone.name, func.count(models.Indicator.id))
+            .join(models.Indicator, models.Indicator.zone_id == models.Zone.id)
+            .group_by(models.Zone.name)
+            .all()
+        )
+    finally:
+        db.close()
+
+
+def test_openmeteo_fetches_cities_concurrently(monkeypatch):
+    """Cities are fetched in parallel over a bounded pool of reused connections"""
+    payload = (FIXTURES / "openmeteo_archive.json").read_bytes()
+    hourly = json.loads(payload)["hourly"]
+    expected = len(hourly["time"]) + sum(1 for value in hourly["precipitation"] if value)
+    cities = _cities(8)
+
+    with StubUpstream({"/v1/archive": payload}, delay=0.3) as upstream:
+        monkeypatch.setattr(openmeteo_ingestion, "OPENMETEO_HISTORICAL_URL", f"{upstream.url}/v1/archive")
+        openmeteo_ingestion.run_ingestion(cities, concurrency=4)
+
+    # Two waves of 4 requests, serially the last one would start 7 * 0.3s after the first
+    assert upstream.started[-1] - upstream.started[0] < 3 * 0.3
+    assert 1 < upstream.max_in_flight <= 4
+    assert len(upstream.clients) <= 4
+    assert sorted(float(query["latitude"][0]) for _, query, _ in upstream.requests) == [
+        city["latitude"] for city in cities
+    ]
+    assert _indicator_counts() == {city["name"]: expected for city in cities}
+
+    # A second run with revised temperatures updates the stored readings in place
+    revised = json.loads(payload)
+    revised["hourly"]["temperature_2m"] = [value + 1 for value in revised["hourly"]["temperature_2m"]]
+    with StubUpstream({"/v1/archive": json.dumps(revised).encode()}) as upstream:
+        monkeypatch.setattr(openmeteo_ingestion, "OPENMETEO_HISTORICAL_URL", f"{upstream.url}/v1/archive")
+        openmeteo_ingestion.run_ingestion(cities, concurrency=4)
+    assert _indicator_counts() == {city["name"]: expected for city in cities}
+    db = SessionLocal()
+    try:
+        temperatures = db.query(models.Indicator.value).filter(models.Indicator.type == "temperature")
+        assert sorted({value for (value,) in temperatures}) == sorted(set(revised["hourly"]["temperature_2m"]))
+    finally:
+        db.close()
+
+
+def test_openaq_skips_failed_cities(monkeypatch, capsys):
+    """A failed request only loses its own city, the API key is sent with every request"""
+    payload = (FIXTURES / "openaq_measurements.json").read_bytes()
+    measurements = json.loads(payload)["results"]
+    cities = _cities(5, coordinates=True)
+
+    with StubUpstream({"/v3/measurements": payload}, failing=["coordinates=44.0%2C3.0"]) as upstream:
+        monkeypatch.setattr(openaq_ingestion, "OPENAQ_API_URL", f"{upstream.url}/v3")
+        monkeypatch.setattr(openaq_ingestion, "OPENAQ_API_KEY", "test-key")
+        openaq_ingestion.run_ingestion(cities, concurrency=3)
+
+    assert all(headers.get("X-API-Key") == "test-key" for _, _, headers in upstream.requests)
+    assert len(upstream.requests) == 5
+    assert _indicator_counts() == {city["name"]: len(measurements) for city in cities if city["name"] != "City 4"}
+    assert "No data retrieved for City 4" in capsys.readouterr().out
+
+
+def test_fetch_and_ingest_stops_on_write_error():
+    """An exception raised by a write stops the pipeline and is re-raised"""
+    written = []
+
+    def write(key, payload):
+        if key == 2:
+            raise RuntimeError("write failed")
+        written.append(key)
+
+    with StubUpstream({"/data": b"{}"}, delay=0.05) as upstream:
+        jobs = [fetching.FetchJob(i, f"{upstream.url}/data", {"i": i}) for i in range(20)]
+        with pytest.raises(RuntimeError, match="write failed"):
+            fetching.fetch_and_ingest(jobs, write, concurrency=2, queue_size=1)
+
+    assert 2 not in written
+    assert len(upstream.requests) < 20
+
+
+def test_mock_data_is_deterministic():
+    """The same seed generates the same readings whatever the batch size, another seed others"""
+    zones = [(zone_id, 1.0 + zone_id / 10) for zone_id in range(1, 8)]
+    start, end = datetime(2024, 6, 1), datetime(2024, 6, 4)
+
+    def generate(seed, batch_size):
+        blocks = list(mock_data_ingestion.generate_batches(
+            zones, start, end, timedelta(hours=1), timedelta(days=1), seed, batch_size
+        ))
+        return [(metric.parameter, zone_ids, timestamps, values)
+                for metric, zone_ids, timestamps, values in blocks]
+
+    def flatten(blocks):
+        rows = {}
+        for parameter, zone_ids, timestamps, values in blocks:
+            rows.update(((parameter, z, t), v) for z, t, v in zip(zone_ids.tolist(), timestamps.tolist(), values.tolist()))
+        return rows
+
+    small, large = generate(1, 50), generate(1, 100000)
+    assert len(small) > len(large) == len(mock_data_ingestion.METRICS)
+    assert flatten(small) == flatten(large)
+    assert len(flatten(large)) == len(zones) * (5 * 72 + 2 * 3)
+    assert flatten(generate(2, 100000)) != flatten(large)
+    assert all((values >= 0).all() for _, _, _, values in large)
+
+
+def test_mock_ingestion_keeps_derived_tables_consistent():
+    """Batched mock writes maintain rollups, sketches and latest values like a rebuild, re-runs add nothing"""
+    options = dict(days=2, zones=7, interval="1h", meter_interval="6h", seed=3, end=datetime(2024, 2, 1))
+    mock_data_ingestion.run_ingestion(batch_size=100, **options)
+    counts = _indicator_counts()
+    assert counts == {spec["name"]: 5 * 48 + 2 * 8 for spec in mock_data_ingestion.zone_specs(7)}
+
+    mock_data_ingestion.run_ingestion(days=3, **{key: value for key, value in options.items() if key != "days"})
+    assert sum(_indicator_counts().values()) == sum(counts.values()) + 7 * (5 * 24 + 2 * 4)
+
+    tables = [models.IndicatorRollup.__table__, models.IndicatorSketchBin.__table__,
+              models.LatestIndicator.__table__]
+
+    def dump(db):
+        return [
+            sorted(tuple(round(value, 6) if isinstance(value, float) else value for value in row[1:])
+                   for row in db.execute(select(table)))
+            for table in tables
+        ]
+
+    db = SessionLocal()
+    try:
+        incremental = dump(db)
+        rollups.rebuild_rollups(db)
+        latest.rebuild_latest(db)
+        assert dump(db) == incremental
+        assert all(incremental)
+    finally:
+        db.close()
+
+
+def test_openmeteo_requests_from_watermarks(monkeypatch):
+    """After a first full window, cities are requested from their oldest covered hour minus the overlap"""
+    payload = json.loads((FIXTURES / "openmeteo_archive.json").read_bytes())
+    hourly = payload["hourly"]
+    first_hour = datetime.combine(datetime.now().date() - timedelta(days=2), datetime.min.time())
+    hourly["time"] = [(first_hour + timedelta(hours=i)).isoformat(timespec="minutes") for i in range(len(hourly["time"]))]
+    # The last hours are not in the archive yet
+    hourly["temperature_2m"][-6:] = [None] * 6
+    hourly["precipitation"][-3:] = [None] * 3
+    cities = _cities(2)
+
+    def start_dates():
+        with StubUpstream({"/v1/archive": json.dumps(payload).encode()}) as upstream:
+            monkeypatch.setattr(openmeteo_ingestion, "OPENMETEO_HISTORICAL_URL", f"{upstream.url}/v1/archive")
+            openmeteo_ingestion.run_ingestion(cities, days_back=7, overlap=timedelta(hours=20))
+        return {query["start_date"][0] for _, query, _ in upstream.requests}
+
+    assert start_dates() == {(datetime.now().date() - timedelta(days=7)).isoformat()}
+    db = SessionLocal()
+    try:
+        marks = {(row.zone_id, row.parameter): row.watermark for row in db.query(models.IngestionWatermark)}
+    finally:
+        db.close()
+    assert sorted(set(marks.values())) == [first_hour + timedelta(hours=17), first_hour + timedelta(hours=20)]
+    assert len(marks) == 2 * len(openmeteo_ingestion.WEATHER_PARAMETERS)
+
+    # Oldest watermark (temperature at 17h) minus 20 hours
+    assert start_dates() == {(first_hour - timedelta(hours=3)).date().isoformat()}
+
+
+def test_openaq_requests_from_watermarks(monkeypatch):
+    """Watermarks only move forward, and ones older than the window are ignored"""
+    payload = json.loads((FIXTURES / "openaq_measurements.json").read_bytes())
+    recent = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=12)
+    seen = {}
+    for measurement in payload["results"]:
+        position = seen[measurement["parameter"]["name"]] = seen.get(measurement["parameter"]["name"], -1) + 1
+        measurement["date"]["utc"] = (recent + timedelta(hours=position)).isoformat() + "Z"
+    cities = _cities(1, coordinates=True)
+
+    def date_from(body):
+        with StubUpstream({"/v3/measurements": json.dumps(body).encode()}) as upstream:
+            monkeypatch.setattr(openaq_ingestion, "OPENAQ_API_URL", f"{upstream.url}/v3")
+            monkeypatch.setattr(openaq_ingestion, "OPENAQ_API_KEY", "test-key")
+            openaq_ingestion.run_ingestion(cities, overlap=timedelta(hours=2))
+        (_, query, _), = upstream.requests
+        return datetime.fromisoformat(query["date_from"][0].rstrip("Z"))
+
+    first = date_from(payload)
+    assert abs(first - (datetime.utcnow() - timedelta(days=openaq_ingestion.DAYS_BACK))) < timedelta(minutes=1)
+    # Every parameter (6 measurements each) was last measured at recent + 5h
+    assert date_from({"results": []}) == recent + timedelta(hours=3)
+
+    # An empty response leaves the watermarks where they were, a stale one is ignored
+    db = SessionLocal()
+    try:
+        db.query(models.IngestionWatermark).filter(models.IngestionWatermark.parameter == "pm25").update(
+            {"watermark": recent - timedelta(days=30)}
+        )
+        db.commit()
+    finally:
+        db.close()
+    assert date_from({"results": []}) == recent + timedelta(hours=3)
+
+
+
+def test_openaq_resumes_truncated_responses(monkeypatch):
+    """Pages are followed oldest first, a response cut by MAX_PAGES moves the watermarks to its end"""
+    payload = json.loads((FIXTURES / "openaq_measurements.json").read_bytes())
+    measurements = payload["results"]
+    start = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(days=3)
+    # Oldest first, measurements 9 and 10 share a timestamp across the page boundary
+    times = [start + timedelta(minutes=10 * ((i + 1) // 2)) for i in range(len(measurements))]
+    for measurement, timestamp in zip(measurements, times):
+        measurement["date"]["utc"] = timestamp.isoformat() + "Z"
+    monkeypatch.setattr(openaq_ingestion, "PAGE_LIMIT", 5)
+    monkeypatch.setattr(openaq_ingestion, "MAX_PAGES", 2)
+
+    def page(query):
+        assert (query["order_by"], query["sort_order"]) == (["datetime"], ["asc"])
+        date_from = datetime.fromisoformat(query["date_from"][0].rstrip("Z"))
+        number, limit = int(query["page"][0]), int(query["limit"][0])
+        selected = [measurement for measurement, timestamp in zip(measurements, times) if timestamp >= date_from]
+        return json.dumps({"results": selected[(number - 1) * limit:number * limit]}).encode()
+
+    (city,) = _cities(1, coordinates=True)
+
+    def run():
+        with StubUpstream({"/v3/measurements": page}) as upstream:
+            monkeypatch.setattr(openaq_ingestion, "OPENAQ_API_URL", f"{upstream.url}/v3")
+            monkeypatch.setattr(openaq_ingestion, "OPENAQ_API_KEY", "test-key")
+            openaq_ingestion.run_ingestion([city])
+        queries = sorted((int(query["page"][0]), query["date_from"][0]) for _, query, _ in upstream.requests)
+        assert len({date_from for _, date_from in queries}) == 1
+        return [number for number, _ in queries], datetime.fromisoformat(queries[0][1].rstrip("Z"))
+
+    def watermarks():
+        db = SessionLocal()
+        try:
+            return {(row.watermark, row.truncated) for row in db.query(models.IngestionWatermark)}
+        finally:
+            db.close()
+
+    pages, date_from = run()
+    assert pages == [1, 2]
+    assert date_from < start
+    assert _indicator_counts()[city["name"]] == 10
+    # Every parameter is covered up to the last fetched measurement
+    assert watermarks() == {(times[9], True)}
+
+    # The next run resumes there without overlap, re-reading measurement 9 and catching up
+    pages, date_from = run()
+    assert (pages, date_from) == ([1, 2], times[9])
+    assert _indicator_counts()[city["name"]] == len(measurements)
+    marks = watermarks()
+    assert {truncated for _, truncated in marks} == {False}
+    assert max(mark for mark, _ in marks) == times[-1]
+
+    # Complete again, the overlap applies
+    pages, date_from = run()
+    assert date_from == min(mark for mark, _ in marks) - openaq_ingestion.WATERMARK_OVERLAP
+
+
+def _runs(source):
+    db = SessionLocal()
+    try:
+        return db.query(models.IngestionRun).filter(models.IngestionRun.source == source).order_by(
+            models.IngestionRun.id
+        ).all()
+    finally:
+        db.close()
+
+
+class VirtualClock:
+    """
+    Virtual time for a Scheduler: its wait, and jobs calling sleep, only move
+    the clock forward once every run in progress is asleep on it, so runs
+    start at exact times however slow the machine is.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.scheduler = None
+        self.sleepers = {}
+        self.condition = threading.Condition()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.condition:
+            token = object()
+            self.sleepers[token] = self.now + seconds
+            self.condition.wait_for(lambda: token not in self.sleepers)
+
+    def wait(self, event, timeout):
+        end = self.now + timeout
+        while True:
+            # The scheduler sets its event under its lock when a run finishes
+            with self.scheduler._lock, self.condition:
+                if event.is_set():
+                    return True
+                running = sum(state.running for state in self.scheduler._states.values())
+                if running == len(self.sleepers):
+                    self.now = max(self.now, min([end, *self.sleepers.values()]))
+                    woken = [token for token, wake_at in self.sleepers.items() if wake_at <= self.now]
+                    for token in woken:
+                        del self.sleepers[token]
+                    self.condition.notify_all()
+                    if not woken and self.now >= end:
+                        return False
+                    continue
+            # A run is busy in real time
+            event.wait(0.001)
+
+    def run(self, sources, duration, **kwargs):
+        self.scheduler = scheduler.Scheduler(sources, clock=self.time, wait=self.wait, **kwargs)
+        self.scheduler.run(duration=duration)
+
+
+def test_scheduler_runs_sources_on_their_frequency(monkeypatch):
+    """Each source follows its sources row frequency, a slow one does not hold the others back"""
+    monkeypatch.setitem(scheduler.FREQUENCIES, "fast", timedelta(milliseconds=125))
+    db = SessionLocal()
+    try:
+        crud.create_source(db, schemas.SourceCreate(name="Fast", frequency="fast"))
+        crud.create_source(db, schemas.SourceCreate(name="Slow", frequency="fast"))
+    finally:
+        db.close()
+    clock = VirtualClock()
+    starts = {"Fast": [], "Slow": []}
+
+    def job(name, seconds):
+        def run():
+            starts[name].append(clock.time())
+            clock.sleep(seconds)
+            return {"requests": 1, "failed": 0}
+        return run
+
+    sources = [
+        scheduler.ScheduledSource("Slow", job("Slow", 0.5)),
+        # Daily until its frequency is read from the sources row
+        scheduler.ScheduledSource("Fast", job("Fast", 0.015625)),
+    ]
+    clock.run(sources, duration=1.0, slots=2)
+
+    assert starts["Fast"] == [0.125 * i for i in range(8)]
+    # Started again as soon as the previous run ended, once the deadline is past the run is completed
+    assert starts["Slow"] == [0.0, 0.5]
+    slow_runs = _runs("Slow")
+    assert [(run.status, run.duration) for run in slow_runs] == [("success", 0.5), ("success", 0.5)]
+    assert len(_runs("Fast")) == 8
+    assert {row["source"]: row["runs"] for row in scheduler.report()} == {"Fast": 8, "Slow": 2}
+
+
+def test_scheduler_waits_for_a_free_slot(monkeypatch):
+    """A due source waits for a slot without holding up the scheduling loop"""
+    monkeypatch.setitem(scheduler.FREQUENCIES, "fast", timedelta(milliseconds=125))
+    clock = VirtualClock()
+    starts = {"A": [], "B": []}
+
+    def job(name):
+        def run():
+            starts[name].append(clock.time())
+            clock.sleep(0.25)
+            return {"requests": 1, "failed": 0}
+        return run
+
+    clock.run([scheduler.ScheduledSource(name, job(name), "fast") for name in starts], duration=1.0, slots=1)
+
+    # Each run ends past the other's due time, so they alternate
+    assert starts == {"A": [0.0, 0.5], "B": [0.25, 0.75]}
+
+
+def test_scheduler_backs_off_on_failure(monkeypatch):
+    """Failed runs (raised or with failed requests) are retried after growing jittered delays"""
+    monkeypatch.setitem(scheduler.FREQUENCIES, "slow", timedelta(seconds=30))
+    outcomes = [RuntimeError("upstream down"), {"requests": 2, "failed": 1}, {"requests": 2, "failed": 2},
+                {"requests": 2, "failed": 0}]
+    clock = VirtualClock()
+    starts = []
+
+    def run():
+        starts.append(clock.time())
+        outcome = outcomes[min(len(starts), len(outcomes)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    source = scheduler.ScheduledSource("Flaky", run, "slow")
+    clock.run([source], duration=1.5, backoff_base=0.1, backoff_max=60, rng=random.Random(7))
+
+    # Success resets the backoff, the next run is 30s away
+    rng = random.Random(7)
+    delays = [scheduler.backoff_delay(failures, 0.1, 30, rng) for failures in range(1, 4)]
+    assert len(starts) == 4
+    gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+    assert gaps == pytest.approx(delays)
+    for failures, gap in enumerate(gaps, start=1):
+        delay = 0.1 * 2 ** (failures - 1)
+        assert delay / 2 <= gap <= delay
+    assert [(run.status, run.failures) for run in _runs("Flaky")] == [
+        ("failed", 1), ("failed", 2), ("failed", 3), ("success", 0)
+    ]
+    assert "RuntimeError: upstream down" in _runs("Flaky")[0].error
+
+
+def test_backoff_delay_is_capped():
+    rng = random.Random(1)
+    delays = [scheduler.backoff_delay(failures, 60, 3600, rng) for failures in range(1, 12)]
+    assert all(60 * 2 ** i / 2 <= delay <= 60 * 2 ** i for i, delay in enumerate(delays[:6]))
+    assert all(1800 <= delay <= 3600 for delay in delays[6:])
+    assert scheduler.parse_frequency("6h") == timedelta(hours=6)
+    assert scheduler.parse_frequency("sometimes", "hourly") == timedelta(hours=1)
+    assert scheduler.parse_frequency(None) == timedelta(days=1)
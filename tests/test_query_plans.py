@@ -0,0 +1,154 @@
+"""
+Query plan tests
+
+Runs each endpoint (and the ingestion upserts) against a small dataset,
+captures every SQL statement that reads the indicators or rollup tables, and
+checks with EXPLAIN QUERY PLAN that none of them falls back to a full table scan.
+"""
+
+import re
+from datetime import datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from app.main import app
+from app.database import SessionLocal, engine, async_engine
+from app import models
+from app.rollups import rebuild_rollups
+from app.auth import create_access_token
+
+client = TestClient(app)
+
+# A plain "SCAN indicators" reads every row of the table; scans that walk an
+# index ("SCAN indicators USING [COVERING] INDEX ...") only happen for
+# unfiltered aggregates, and SEARCH lines are index lookups.
+FULL_SCAN = re.compile(r"\bSCAN (indicators|indicator_rollups|indicator_sketch_bins)\b(?! USING)")
+
+
+@pytest.fixture
+def seeded():
+    """Create a user, two zones, a source and a few days of indicators"""
+    db = SessionLocal()
+    try:
+        user = models.User(email="plan@example.com", username="planuser", hashed_password="x")
+        zones = [models.Zone(name="Paris"), models.Zone(name="Lyon")]
+        source = models.Source(name="Plan Source")
+        db.add_all([user, source, *zones])
+        db.flush()
+        
+        start = datetime(2025, 11, 1)
+        for zone in zones:
+            for hour in range(0, 72, 3):
+                for ind_type, parameter in (("air_quality", "PM2.5"), ("co2", None), ("temperature", "temperature_2m")):
+                    db.add(models.Indicator(
+                        type=ind_type,
+                        value=float(hour),
+                        unit="test",
+                        timestamp=start + timedelta(hours=hour),
+                        zone_id=zone.id,
+                        source_id=source.id,
+                        extra_data={"parameter": parameter} if parameter else None
+                    ))
+        db.commit()
+        rebuild_rollups(db)
+        yield {"zone_id": zones[0].id, "source_id": source.id}
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def captured_sql():
+    """Record (statement, parameters) for every query touching indicators or rollups"""
+    statements = []
+    
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and re.search(r"\bindicator(s|_rollups|_sketch_bins)\b", statement):
+            statements.append((statement, parameters))
+    
+    # The routers run on the async engine, ingestion and exports on the sync one
+    engines = (engine, async_engine.sync_engine)
+    for bind in engines:
+        event.listen(bind, "before_cursor_execute", capture)
+    yield statements
+    for bind in engines:
+        event.remove(bind, "before_cursor_execute", capture)
+
+
+def full_scans(statements):
+    """Return the plan lines of captured statements that scan a whole table"""
+    offenders = []
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            for row in plan:
+                if FULL_SCAN.search(row[-1]):
+                    offenders.append((statement, row[-1]))
+    return offenders
+
+
+ENDPOINTS = [
+    "/indicators/",
+    "/indicators/?type=air_quality",
+    "/indicators/?zone_id={zone_id}",
+    "/indicators/?type=co2&zone_id={zone_id}",
+    "/indicators/?from=2025-11-02T00:00:00&to=2025-11-03T00:00:00",
+    "/indicators/?paginate=cursor&limit=5",
+    "/indicators/?count=cached&type=co2",
+    "/indicators/export",
+    "/indicators/export?format=csv&zone_id={zone_id}&from=2025-11-02T00:00:00",
+    "/stats/summary",
+    "/stats/summary?zone_id={zone_id}",
+    "/stats/air/averages",
+    "/stats/air/averages?zone_id={zone_id}",
+    "/stats/air/averages?from=2025-11-02T00:00:00&to=2025-11-03T00:00:00",
+    "/stats/air/averages?from=2025-11-01T04:30:00&to=2025-11-03T07:15:00&zone_id={zone_id}",
+    "/stats/co2/trend?period=daily",
+    "/stats/co2/trend?period=weekly&zone_id={zone_id}",
+    "/stats/co2/trend?period=monthly",
+    "/stats/dashboard",
+    "/stats/dashboard?zone_id={zone_id}&period=weekly",
+    "/stats/timeseries?bucket=1h&type=co2&zone_id={zone_id}",
+    "/stats/timeseries?bucket=1w&agg=max&group_by=zone_id,type&fill=null",
+    "/stats/timeseries?bucket=15min&type=air_quality&from=2025-11-02T00:00:00&to=2025-11-03T00:00:00",
+    "/stats/timeseries?bucket=5min&from=2025-11-02T00:00:00&to=2025-11-02T06:00:00",
+    "/stats/timeseries?bucket=1d&agg=p95&type=air_quality&zone_id={zone_id}",
+    "/stats/summary?quantiles=0.5,0.95&zone_id={zone_id}&from=2025-11-01T04:30:00&to=2025-11-03T07:15:00",
+]
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_endpoint_uses_indexes(url, seeded, captured_sql):
+    """Endpoint queries on indicators and rollups must not scan the whole table"""
+    token = create_access_token({"sub": "planuser"})
+    response = client.get(url.format(**seeded), headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert captured_sql, "no indicator query was captured"
+    assert full_scans(captured_sql) == []
+
+
+def test_ingestion_dedup_uses_indexes(seeded, captured_sql):
+    """Ingestion upserts (and the lookups of the readings they replace) must be index lookups"""
+    from ingestion import openmeteo_ingestion, openaq_ingestion
+    
+    db = SessionLocal()
+    try:
+        zone = db.get(models.Zone, seeded["zone_id"])
+        source = db.get(models.Source, seeded["source_id"])
+        openmeteo_ingestion.ingest_weather_data(db, zone, source, {
+            "hourly": {
+                "time": ["2025-11-01T03:00"],
+                "temperature_2m": [12.5],
+                "precipitation": [0.4],
+            }
+        })
+        openaq_ingestion.ingest_air_quality_data(db, zone, source, [{
+            "parameter": {"name": "PM2.5"},
+            "value": 12.0,
+            "unit": "µg/m³",
+            "date": {"utc": "2025-11-01T03:00:00Z"},
+        }])
+    finally:
+        db.close()
+    
+    assert captured_sql, "no indicator query was captured"
+    assert full_scans(captured_sql) == []